@@ -1,12 +1,20 @@
 import logging
+import shlex
+import sys
 
 
 def main():
     """
-    Launch the Framework application command line interface.
+    Launch the Framework application command line interface. If arguments
+    are given they are run as a single command instead of starting the
+    interactive prompt, for example:
+        chiptools worker --connect host:port --project project.xml
     """
     main = CommandLine()
-    main.cmdloop()
+    if len(sys.argv) > 1:
+        main.onecmd(' '.join(shlex.quote(arg) for arg in sys.argv[1:]))
+    else:
+        main.cmdloop()
     logging.shutdown()
 
 if __name__ == '__main__':
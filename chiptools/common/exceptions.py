@@ -7,7 +7,13 @@ class CompilationException(SimulatorException):
 
 
 class ExecutionError(Exception):
-    pass
+    """
+    Raised when a tool fails. The *return_code* attribute holds the exit code
+    of the tool if it is known.
+    """
+    def __init__(self, *args, return_code=None):
+        super(ExecutionError, self).__init__(*args)
+        self.return_code = return_code
 
 
 class ProjectFileException(Exception):
@@ -16,3 +22,23 @@ class ProjectFileException(Exception):
 
 class SynthesisException(Exception):
     pass
+
+
+class AbortedError(ExecutionError):
+    """
+    Raised when a tool is killed because its output matched a failure
+    pattern. The *match* attribute holds the matching line of output.
+    """
+    def __init__(self, message, match=None):
+        super(AbortedError, self).__init__(message)
+        self.match = match
+
+
+class ExecutionTimeout(ExecutionError):
+    """
+    Raised when a tool is killed because it did not complete within its
+    timeout. The *timeout* attribute holds the timeout in seconds.
+    """
+    def __init__(self, message, timeout=None):
+        super(ExecutionTimeout, self).__init__(message)
+        self.timeout = timeout
@@ -62,6 +62,14 @@ class ProjectAttributes:
     ATTRIBUTE_SYNTH_TOOL = 'synthesiser'
     ATTRIBUTE_SYNTH_PART = 'part'
     ATTRIBUTE_REPORTER = 'reporter'
+    ATTRIBUTE_SIM_ECHO = 'simulation_echo'
+    ATTRIBUTE_FAILURE_PATTERN = 'failure_pattern'
+    ATTRIBUTE_TIMEOUT = 'timeout'
+    ATTRIBUTE_TOOL_TIMEOUT = 'tool_timeout'
+    ATTRIBUTE_RETRIES = 'retries'
+    ATTRIBUTE_INFRASTRUCTURE_RETRIES = 'infrastructure_retries'
+    ATTRIBUTE_INFRASTRUCTURE_PATTERN = 'infrastructure_pattern'
+    ATTRIBUTE_WARM_SIMULATION = 'warm_simulation'
     # Additional tool-specific arguments can be attached to a config object in
     # the XML file to allow fine tweaking of the simulation or synthesis flows.
     ATTRIBUTE_MODELSIM_SIMULATE = 'args_modelsim_simulate'
@@ -86,11 +94,14 @@ class ProjectAttributes:
 
 
 class UnitTestFile(object):
-    """The UnitTestFile object provides a container for Python test shims."""
+    """The UnitTestFile object provides a container for Python test shims.
+    The test suite is loaded from the shim when it is first needed, *loaded*
+    is set once an import has been attempted."""
     def __init__(self, **kwargs):
         self.path = kwargs[ProjectAttributes.XML_ATTRIBUTE_PATH]
         self.fileType = FileType.Python
         self.testsuite = None
+        self.loaded = False
 
 
 class File(object):
@@ -1,8 +1,13 @@
 import subprocess
 import os
+import re
+import sys
+import signal
 import logging
 import threading
 import time
+import collections
+import contextlib
 
 if __name__ == '__main__':
     import exceptions
@@ -90,8 +95,45 @@ def seconds_to_timestring(duration):
     return str(duration * 1e9) + "ns"
 
 
-def execute(command, path=None, shell=True, quiet=False):
-    return popen_throws_ex(command, path, quiet)
+def truncate_text(text, limit):
+    """
+    Return the given *text* truncated to approximately *limit* characters by
+    keeping its start and end and noting the number of characters omitted.
+    The text is returned unchanged if *limit* is None or the text is short
+    enough.
+    >>> truncate_text('0123456789', 4)
+    '01\\n... 6 character(s) omitted ...\\n89'
+    """
+    if limit is None or text is None or len(text) <= limit:
+        return text
+    head = limit // 2
+    tail = limit - head
+    return '{0}\n... {1} character(s) omitted ...\n{2}'.format(
+        text[:head],
+        len(text) - head - tail,
+        text[len(text) - tail:]
+    )
+
+
+def execute(
+    command,
+    path=None,
+    shell=True,
+    quiet=False,
+    log_path=None,
+    echo=True,
+    failure_patterns=None,
+    timeout=None
+):
+    return popen_throws_ex(
+        command,
+        path,
+        quiet,
+        log_path,
+        echo,
+        failure_patterns,
+        timeout
+    )
 
 
 def call(command, path=None, shell=True):
@@ -112,29 +154,66 @@ def call(command, path=None, shell=True):
         raise exceptions.ExecutionError(return_val)
 
 
-def popen_throws_ex(command, path=None, quiet=False):
+def popen_throws_ex(
+    command,
+    path=None,
+    quiet=False,
+    log_path=None,
+    echo=True,
+    failure_patterns=None,
+    timeout=None
+):
     '''
     Call the executable in the given path, hiding standard output unless the
     return value is an error. If the return value is an error raise an
     exception for the caller to handle.
+    If a *log_path* is given the output is captured to log files, if
+    *failure_patterns* are given the executable is aborted when its output
+    matches one of them and if a *timeout* is given the executable is
+    aborted when it expires, refer to *popen* for details.
     '''
 
-    if quiet:
+    if quiet and log_path is None and not failure_patterns and not timeout:
         returnVal, stdout, stderr = popen_quiet(command, path)
     else:
-        returnVal, stdout, stderr = popen(command, path)
+        returnVal, stdout, stderr = popen(
+            command,
+            path,
+            log_path=log_path,
+            echo=echo and not quiet,
+            failure_patterns=failure_patterns,
+            timeout=timeout
+        )
 
     if returnVal != 0:
-        errstring = ''
-        if stdout:
-            errstring += stdout + '\n'
-        if stderr:
-            errstring += str(stderr) + '\n'
-        raise exceptions.ExecutionError(errstring)
+        raise exceptions.ExecutionError(
+            get_error_string(stdout, stderr),
+            return_code=returnVal
+        )
 
     return returnVal, stdout, stderr
 
 
+def get_error_string(stdout, stderr):
+    """
+    Return the message of the ExecutionError raised when an executable with
+    the given *stdout* and *stderr* output (strings or OutputLog objects)
+    fails.
+    """
+    errstring = ''
+    if stdout:
+        if isinstance(stdout, OutputLog):
+            errstring += stdout.summary() + '\n'
+        else:
+            errstring += stdout + '\n'
+    if stderr:
+        if isinstance(stderr, OutputLog):
+            errstring += stderr.summary() + '\n'
+        else:
+            errstring += str(stderr) + '\n'
+    return errstring
+
+
 def tee(infile, *files):
     """
     Print `infile` to `files` in a separate thread.
@@ -165,31 +244,326 @@ class LogWrapper:
         self.logfn(line.rstrip())
 
 
-def teed_call(cmd_args, **kwargs):
+class OutputLog:
+    """
+    An OutputLog provides a file interface that captures the lines of an
+    output stream. If a *path* is given every line is written to the log
+    file at *path* but only the first *head_lines* and the last *tail_lines*
+    lines are kept in memory, so the memory used does not depend on the
+    amount of output. Without a log file to recover them from, all of the
+    lines are kept in memory. If an *echo* function is given each line is
+    also passed to it, for example to print it to the console.
+
+    The captured output can be accessed without loading it into memory by
+    iterating over the lines of the OutputLog or by using the *search*
+    method. Converting the OutputLog to a string reads the complete output
+    from the log file.
+    """
+    head_lines = 100
+    tail_lines = 400
+
+    def __init__(self, path=None, echo=None):
+        self.path = path
+        self.echo = echo
+        self.head = []
+        self.tail = collections.deque(maxlen=self.tail_lines)
+        self.line_count = 0
+        self.stream = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if len(directory) > 0 and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            self.stream = open(path, 'w')
+
+    def write(self, line):
+        """Capture the given *line*, which should include the line end."""
+        self.line_count += 1
+        if self.stream is not None:
+            self.stream.write(line)
+        if self.path is None or len(self.head) < self.head_lines:
+            self.head.append(line)
+        else:
+            self.tail.append(line)
+        if self.echo is not None:
+            self.echo(line.rstrip())
+
+    def close(self):
+        """Close the log file, the captured output can still be read."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def get_omitted(self):
+        """
+        Return the number of lines that are stored in the log file but are
+        not held in memory.
+        """
+        return self.line_count - len(self.head) - len(self.tail)
+
+    def summary(self):
+        """
+        Return a string of the first and last lines of the output, with a
+        note of the number of lines omitted between them (if any).
+        """
+        text = ''.join(self.head)
+        omitted = self.get_omitted()
+        if omitted > 0:
+            text += '... {0} line(s) omitted'.format(omitted)
+            if self.path is not None:
+                text += ', refer to ' + self.path
+            text += ' ...\n'
+        return text + ''.join(self.tail)
+
+    def __iter__(self):
+        """
+        Return an iterator over the captured lines, read from the log file
+        if there is one.
+        """
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, 'r', errors='replace') as f:
+                for line in f:
+                    yield line
+        else:
+            for line in self.head:
+                yield line
+            for line in self.tail:
+                yield line
+
+    def search(self, pattern, flags=0):
+        """
+        Search each line of the captured output for the regular expression
+        *pattern* and return the match object of the first matching line, or
+        None if no line matches.
+        """
+        expression = re.compile(pattern, flags)
+        for line in self:
+            match = expression.search(line)
+            if match is not None:
+                return match
+        return None
+
+    def __contains__(self, text):
+        return any(text in line for line in self)
+
+    def __len__(self):
+        return self.line_count
+
+    def __bool__(self):
+        return self.line_count > 0
+
+    def read(self):
+        """Return the complete captured output as a string."""
+        return ''.join(self)
+
+    def __str__(self):
+        return self.read()
+
+
+class FailureMonitor:
+    """
+    A FailureMonitor provides a file interface that searches each line
+    written to it for any of the given failure *patterns* (regular expression
+    strings or compiled expressions). When the first match is found the line
+    is stored as the *match* attribute and the *abort* function is called.
+    """
+    def __init__(self, patterns, abort):
+        self.patterns = [
+            re.compile(p) if isinstance(p, str) else p for p in patterns
+        ]
+        self.abort = abort
+        self.match = None
+        self.lock = threading.Lock()
+
+    def write(self, line):
+        if self.match is not None:
+            return
+        for pattern in self.patterns:
+            if pattern.search(line) is not None:
+                with self.lock:
+                    if self.match is not None:
+                        return
+                    self.match = line.rstrip()
+                self.abort()
+                return
+
+
+def kill_process(process):
+    """
+    Kill the given subprocess.Popen *process* and the other processes in its
+    process group. The process should have been started in a new process
+    group (refer to *teed_call*), otherwise only the process is killed.
+    """
+    try:
+        if sys.platform == 'win32':
+            subprocess.call(
+                ['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Return a context manager that holds an exclusive lock on the lock file
+    at *path* (which is created if required), blocking until the lock is
+    available. Locks are held by the operating system, so a lock is released
+    if the process holding it exits without releasing it.
+    """
+    with open(path, 'a+b') as f:
+        if sys.platform == 'win32':
+            import msvcrt
+            # The first byte of the file is locked
+            f.seek(0)
+            while True:
+                try:
+                    # msvcrt retries for 10 seconds before raising an error
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def teed_call(
+    cmd_args,
+    echo=True,
+    failure_patterns=None,
+    timeout=None,
+    **kwargs
+):
+    """
+    Call the command given by *cmd_args* and write each line of its output
+    to the file objects given by the *stdout* and *stderr* inputs. If *echo*
+    is True the output is also printed through the logger.
+
+    If a list of *failure_patterns* is given the output is searched for the
+    regular expressions as it is received. If a line matches, the process
+    group of the command is killed and an AbortedError is raised.
+
+    If a *timeout* in seconds is given and the command does not complete
+    within it, the process group of the command is killed and an
+    ExecutionTimeout is raised.
+    """
     stdout, stderr = [kwargs.pop(s, None) for s in ['stdout', 'stderr']]
+    monitor = None
+    timer = None
+    expired = threading.Event()
+    if failure_patterns or timeout:
+        # Start the command in a new process group so that any processes
+        # that it creates can be killed with it.
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True
     p = subprocess.Popen(
         cmd_args,
         stdout=subprocess.PIPE if stdout is not None else None,
         stderr=subprocess.PIPE if stderr is not None else None,
         **kwargs
     )
-    threads = []
-    if stdout is not None:
-        threads.append(tee(p.stdout, stdout, LogWrapper(log.info)))
-    if stderr is not None:
-        threads.append(tee(p.stderr, stderr, LogWrapper(log.error)))
-    for t in threads:
-        t.join()  # wait for IO completion
-    return p.wait()
-
-
-def popen(command, path=None):
-    from io import StringIO
-    fout, ferr = StringIO(), StringIO()
-    exitcode = teed_call(command, cwd=path, stdout=fout, stderr=ferr)
-    stdout = fout.getvalue()
-    stderr = ferr.getvalue()
-    return exitcode, stdout, stderr
+    if failure_patterns:
+        monitor = FailureMonitor(failure_patterns, lambda: kill_process(p))
+    if timeout:
+        def expire():
+            expired.set()
+            kill_process(p)
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+    try:
+        threads = []
+        if stdout is not None:
+            files = [stdout] + ([LogWrapper(log.info)] if echo else [])
+            files += [monitor] if monitor is not None else []
+            threads.append(tee(p.stdout, *files))
+        if stderr is not None:
+            files = [stderr] + ([LogWrapper(log.error)] if echo else [])
+            files += [monitor] if monitor is not None else []
+            threads.append(tee(p.stderr, *files))
+        for t in threads:
+            t.join()  # wait for IO completion
+        exitcode = p.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if monitor is not None and monitor.match is not None:
+        raise exceptions.AbortedError(
+            'Output matched a failure pattern: ' + monitor.match,
+            match=monitor.match
+        )
+    if expired.is_set():
+        raise exceptions.ExecutionTimeout(
+            'Timed out after {0} seconds: {1}'.format(
+                timeout,
+                cmd_args if isinstance(cmd_args, str) else ' '.join(cmd_args)
+            ),
+            timeout=timeout
+        )
+    return exitcode
+
+
+def popen(
+    command,
+    path=None,
+    log_path=None,
+    echo=True,
+    failure_patterns=None,
+    timeout=None
+):
+    """
+    Call the executable in the given path and return a tuple of the exit
+    code, standard output and standard error streams. If *echo* is True the
+    output is printed through the logger as it is received. If any line of
+    output matches one of the *failure_patterns* the executable is killed
+    and an AbortedError is raised, if the executable does not complete
+    within *timeout* seconds it is killed and an ExecutionTimeout is raised
+    (refer to *teed_call*).
+
+    The output streams are returned as OutputLog objects. If a *log_path* is
+    given they are written to the log files *log_path*.stdout.log and
+    *log_path*.stderr.log and only the first and last lines of the output
+    are held in memory, otherwise the complete output is held in memory.
+    """
+    fout = OutputLog(
+        None if log_path is None else log_path + '.stdout.log'
+    )
+    ferr = OutputLog(
+        None if log_path is None else log_path + '.stderr.log'
+    )
+    try:
+        exitcode = teed_call(
+            command,
+            echo=echo,
+            failure_patterns=failure_patterns,
+            timeout=timeout,
+            cwd=path,
+            stdout=fout,
+            stderr=ferr
+        )
+    finally:
+        fout.close()
+        ferr.close()
+    return exitcode, fout, ferr
 
 
 def popen_quiet(command, path=None):
@@ -137,6 +137,37 @@ class FileCache:
             return self.cache[tool_name][self.field_id_libraries]
         return set()
 
+    def get_fingerprint(self, tool_name, paths=None):
+        """
+        Return a string that identifies the compiled state of the design for
+        the given *tool_name*: a hash of the MD5 sums of every file and the
+        set of libraries recorded in the cache for the tool. If a list of
+        *paths* is given only the MD5 sums of those files are used, files
+        that are not present in the cache are recorded as uncompiled.
+        """
+        digest = hashlib.sha1()
+        if tool_name in self.cache:
+            files = self.cache[tool_name][self.field_id_files]
+        else:
+            files = {}
+        if paths is None:
+            for path in sorted(files.keys()):
+                digest.update('{0}:{1}\n'.format(path, files[path]).encode(
+                    'utf-8'
+                ))
+            for library in sorted(self.get_libraries(tool_name)):
+                digest.update('{0}\n'.format(library).encode('utf-8'))
+        else:
+            md5s = dict(
+                (os.path.normpath(path), md5) for path, md5 in files.items()
+            )
+            for path in sorted(os.path.normpath(p) for p in paths):
+                digest.update('{0}:{1}\n'.format(
+                    path,
+                    md5s.get(path, None)
+                ).encode('utf-8'))
+        return digest.hexdigest()
+
     def get_tool_names(self):
         return list(self.cache.keys())
 
@@ -194,3 +225,49 @@ class FileCache:
         """
         if os.path.exists(self.cache_path):
             os.remove(self.cache_path)
+
+
+class PickleStore:
+    """
+    A PickleStore is the base class of the stores that keep a dictionary of
+    data about the tests of a project between runs. The dictionary is held in
+    the *cache* attribute and is stored as a Pickled dictionary in a file
+    derived from the given *cache_path* and the *cache_file_name* of the
+    subclass, in the same way as the FileCache. A store file that cannot be
+    read is replaced by an empty dictionary.
+    """
+    cache_file_name = '_store.cache'
+    # Name of the store used in log messages
+    store_name = 'store'
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path + self.cache_file_name
+        self.cache = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'rb') as f:
+                    self.cache = pickle.load(f)
+            except:
+                log.warning(
+                    'The {0} was corrupted, re-initialising...'.format(
+                        self.store_name
+                    )
+                )
+                log.debug(traceback.format_exc())
+                self.cache = {}
+
+    def save_cache(self):
+        """
+        Store the local dictionary into the linked cache file.
+        """
+        with open(self.cache_path, 'wb') as f:
+            pickle.dump(self.cache, f)
+
+    def delete(self):
+        """
+        Clear the local dictionary and delete the cache file pointed to by
+        this store.
+        """
+        self.cache = {}
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
@@ -1,13 +1,21 @@
+import argparse
 import cmd
 import logging
 import traceback
 import os
+import shlex
 import sys
 import shutil
 import textwrap
 
 from chiptools.parsers.xml_project import XmlProjectParser
 from chiptools.core.project import Project
+from chiptools.core.sandbox import SimulationSandbox
+from chiptools.wrappers.simulator import Simulator
+from chiptools.testing import distributed
+from chiptools.testing import results
+from chiptools.testing.durations import TestDurationStore
+from chiptools.testing.result_cache import TestResultCache
 from chiptools.common import exceptions
 from chiptools.common import utils
 from chiptools.common import colourer as term
@@ -29,6 +37,23 @@ def wraps_do_commands(fn):
             log.error(traceback.format_exc())
     return wrapper
 
+
+class CommandArgumentParser(argparse.ArgumentParser):
+    """
+    ArgumentParser for command options entered at the ChipTools prompt. Parse
+    errors raise a ValueError instead of exiting the interpreter.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs['add_help'] = False
+        super(CommandArgumentParser, self).__init__(*args, **kwargs)
+
+    def error(self, message):
+        raise ValueError(message)
+
+    def parse_command(self, command):
+        """Split the *command* string and parse it."""
+        return self.parse_args(shlex.split(command))
+
 SEP = ' ' * 4
 
 INTRO_TEMPL = (
@@ -90,9 +115,9 @@ class CommandLine(cmd.Cmd):
                     str(len(self.project.get_files())),
                     fg='yellow'
                 ) + ' file(s) and ' + term.colourise(
-                    str(len(self.project.get_tests())),
+                    str(len(self.project.tests)),
                     fg='yellow'
-                ) + ' test(s).'
+                ) + ' test file(s).'
             )
             self.intro = INTRO_TEMPL % dict(
                 version=_version.__version__,
@@ -228,6 +253,52 @@ class CommandLine(cmd.Cmd):
             return
         self.project.simulate(library, entity, gui=True, tool_name=tool_name)
 
+    @wraps_do_commands
+    def do_watch(self, command):
+        """Watch the project files for changes and incrementally recompile
+        the design each time a file is saved. Add --tests to also run the unit
+        tests after each successful compilation. Press Ctrl+C to stop.
+        Example: (Cmd) watch [tool_name] [--tests]"""
+        parser = CommandArgumentParser(prog='watch')
+        parser.add_argument('tool_name', nargs='?', default=None)
+        parser.add_argument('--tests', action='store_true')
+        try:
+            args = parser.parse_command(command)
+        except ValueError as e:
+            log.error('Command \"' + command + '\" not understood: ' + str(e))
+            return
+        self.project.watch(tool_name=args.tool_name, run_tests=args.tests)
+
+    @wraps_do_commands
+    def do_build_vendor_libraries(self, command):
+        """Compile the vendor libraries declared in the [vendor libraries]
+        section of the system configuration file into the shared vendor
+        library cache. Libraries are compiled in parallel using up to -j
+        workers, use --force to rebuild libraries that are already cached.
+        Example: (Cmd) build_vendor_libraries [tool_name] [-j N] [--force]
+        [--library NAME]"""
+        parser = CommandArgumentParser(prog='build_vendor_libraries')
+        parser.add_argument('tool_name', nargs='?', default=None)
+        parser.add_argument('-j', '--jobs', type=int, default=None)
+        parser.add_argument('--force', action='store_true')
+        parser.add_argument(
+            '--library',
+            action='append',
+            dest='libraries',
+            default=None
+        )
+        try:
+            args = parser.parse_command(command)
+        except ValueError as e:
+            log.error('Command \"' + command + '\" not understood: ' + str(e))
+            return
+        self.project.build_vendor_libraries(
+            tool_name=args.tool_name,
+            libraries=args.libraries,
+            jobs=args.jobs,
+            force=args.force
+        )
+
     @wraps_do_commands
     def do_clean(self, command):
         """Clear the file cache"""
@@ -243,8 +314,19 @@ class CommandLine(cmd.Cmd):
                 if os.path.exists(path):
                     log.info('Removing ' + path)
                     shutil.rmtree(path)
+        # Remove the elaboration records so that designs are re-elaborated
+        path = os.path.join(simpath, Simulator.elaboration_cache_name)
+        if os.path.exists(path):
+            log.info('Removing ' + path)
+            shutil.rmtree(path)
+        # Remove any simulation sandboxes left behind by aborted runs
+        path = os.path.join(simpath, SimulationSandbox.sandbox_directory_name)
+        if os.path.exists(path):
+            log.info('Removing ' + path)
+            shutil.rmtree(path)
         log.info('...done')
         self.project.cache.initialise_cache()
+        TestResultCache(self.project.cache_path).delete()
 
     @wraps_do_commands
     def do_pwd(self, command):
@@ -366,43 +448,44 @@ class CommandLine(cmd.Cmd):
     @wraps_do_commands
     def do_show_tests(self, command):
         """
-        Show the tests available in the current project.
+        Show the tests available in the current project. Tests are listed
+        from the test index, test files are only imported if they have
+        changed since they were indexed.
         """
-        tests = self.project.get_tests()
+        tests = self.project.get_test_index()
 
         if len(tests) == 0:
             log.info('There are no tests available.')
             return
 
         testUniqueId = 0
-        for file_object in tests:
+        for file_object, entries in tests:
             file_name = os.path.basename(file_object.path)
             print(term.yellow(file_name))
-            for test_group in file_object.testsuite:
-                for testId, test in enumerate(test_group):
-                    if testId == 0:
-                        print(
-                            SEP + term.green(str(test.__class__.__name__))
-                        )
-                    doc = test.shortDescription()
-                    if doc is None:
-                        doc = term.darkred('No description')
-                    if testUniqueId in self.test_set:
-                        msg = SEP * 2 + '[' + term.blue('ID ' + str(
-                            testUniqueId) + ' ' + test.id().split('.')[-1]
-                        ) + ']'
-                    else:
-                        msg = SEP * 2 + term.lightgray('ID ' + str(
-                            testUniqueId) + ' ' + test.id().split('.')[-1]
-                        )
-                    print(msg)
-                    print(term.darkgray(textwrap.fill(
-                        doc,
-                        width=80,
-                        initial_indent=SEP * 2,
-                        subsequent_indent=SEP * 2,
-                    )))
-                    testUniqueId += 1
+            groupName = None
+            for entry in entries:
+                if entry['class_name'] != groupName:
+                    groupName = entry['class_name']
+                    print(SEP + term.green(groupName))
+                doc = entry['description']
+                if doc is None:
+                    doc = term.darkred('No description')
+                if testUniqueId in self.test_set:
+                    msg = SEP * 2 + '[' + term.blue('ID ' + str(
+                        testUniqueId) + ' ' + entry['name']
+                    ) + ']'
+                else:
+                    msg = SEP * 2 + term.lightgray('ID ' + str(
+                        testUniqueId) + ' ' + entry['name']
+                    )
+                print(msg)
+                print(term.darkgray(textwrap.fill(
+                    doc,
+                    width=80,
+                    initial_indent=SEP * 2,
+                    subsequent_indent=SEP * 2,
+                )))
+                testUniqueId += 1
 
     def show_test_selection(self):
         """
@@ -412,15 +495,13 @@ class CommandLine(cmd.Cmd):
         """
         ids_list = list(self.test_set)
         tests = []
-        for file_object in self.project.get_tests():
+        for file_object, entries in self.project.get_test_index():
             file_name = os.path.basename(file_object.path)
             print(term.yellow(file_name))
-            for test_group in file_object.testsuite:
-                for testId, test in enumerate(test_group):
-                    if testId == 0:
-                        groupName = str(test.__class__.__name__)
-                    testName = test.id().split('.')[-1]
-                    tests.append((file_name, groupName, testName, test))
+            for entry in entries:
+                tests.append(
+                    (file_name, entry['class_name'], entry['name'], entry)
+                )
 
         # Filter out any invalid indices
         ids_list = list(filter(lambda x: x < len(tests), ids_list))
@@ -486,11 +567,144 @@ class CommandLine(cmd.Cmd):
     def do_run_tests(self, command):
         """
         Run the tests that were selected via the add_tests command and report
-        the results.
+        the results. Use -j N to run the tests in N parallel worker
+        processes (-j 0 uses one worker per CPU).
+        Use --cache to skip tests that previously passed with unchanged
+        inputs.
+        Use --shard INDEX/COUNT to run only one of COUNT deterministic
+        subsets of the tests (INDEX from 1 to COUNT) and --results PATH to
+        set the result file, shard result files can be combined using the
+        merge_results command. Shards hold the same number of tests unless
+        --shard-history gives every shard the same result files of an
+        earlier run to balance the shards by test duration.
+        Use --listen [HOST:]PORT to distribute the tests to workers started
+        on other hosts with the worker command, the --authkey KEY (or the
+        CHIPTOOLS_AUTHKEY environment variable) must match the workers.
+        The coordinator only listens on localhost unless HOST is given, use
+        the address of the interface that the workers connect to (or
+        0.0.0.0 for all interfaces) to expose it.
+        Use --affected-by followed by changed files and/or git revision
+        ranges (for example main..HEAD) to run only the tests that depend on
+        the changes.
+        Use --failed to run only the selected tests that failed in their
+        last run, or --first-failed to run those tests before the others.
+        Results are written as each test completes to the JSON Lines result
+        file and to a JUnit XML report, use --junit PATH to set the JUnit
+        report path. Use --report stream to write each test to the HTML
+        report as it completes with truncated outputs (for long runs), or
+        --report text to print the results to the console instead of
+        generating the HTML report.
+        Example: (Cmd) run_tests [tool_name] [-j N] [--cache]
+        [--shard INDEX/COUNT] [--shard-history PATH [PATH ...]]
+        [--results PATH] [--junit PATH]
+        [--report html|stream|text] [--listen [HOST:]PORT] [--authkey KEY]
+        [--affected-by CHANGE [CHANGE ...]] [--failed | --first-failed]
         """
-        if len(command) > 0:
-            tool_name = command
-        else:
-            tool_name = None
+        parser = CommandArgumentParser(prog='run_tests')
+        parser.add_argument('tool_name', nargs='?', default=None)
+        parser.add_argument('-j', '--jobs', type=int, default=1)
+        parser.add_argument('--cache', action='store_true')
+        parser.add_argument('--shard', type=results.parse_shard, default=None)
+        parser.add_argument('--shard-history', nargs='+', default=None)
+        parser.add_argument('--results', default=None)
+        parser.add_argument('--listen', default=None)
+        parser.add_argument('--authkey', default=None)
+        parser.add_argument('--affected-by', nargs='+', default=None)
+        parser.add_argument('--junit', default=None)
+        parser.add_argument(
+            '--report',
+            choices=Project.report_formats,
+            default='html'
+        )
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--failed', action='store_true')
+        group.add_argument('--first-failed', action='store_true')
+        try:
+            args = parser.parse_command(command)
+            listen = authkey = None
+            if args.listen is not None:
+                listen = distributed.parse_address(args.listen)
+                authkey = distributed.get_authkey(args.authkey)
+        except ValueError as e:
+            log.error('Command \"' + command + '\" not understood: ' + str(e))
+            return
         self.show_test_selection()
-        self.project.run_tests(self.test_set, tool_name=tool_name)
+        self.project.run_tests(
+            self.test_set,
+            tool_name=args.tool_name,
+            jobs=args.jobs,
+            cache=args.cache,
+            shard=args.shard,
+            shard_history=args.shard_history,
+            results_path=args.results,
+            listen=listen,
+            authkey=authkey,
+            affected_by=args.affected_by,
+            report=args.report,
+            junit_path=args.junit,
+            failed=args.failed,
+            first_failed=args.first_failed
+        )
+
+    @wraps_do_commands
+    def do_worker(self, command):
+        """
+        Compile the project and run tests for a run_tests coordinator started
+        with --listen, using -j N worker processes. The --authkey KEY (or the
+        CHIPTOOLS_AUTHKEY environment variable) must match the coordinator.
+        Use --project PATH to load a project file first, for example when
+        starting a worker from the shell:
+            chiptools worker --connect host:port --project project.xml
+        Example: (Cmd) worker --connect HOST:PORT [tool_name] [-j N]
+        [--authkey KEY] [--project PATH]
+        """
+        parser = CommandArgumentParser(prog='worker')
+        parser.add_argument('tool_name', nargs='?', default=None)
+        parser.add_argument('--connect', required=True)
+        parser.add_argument('-j', '--jobs', type=int, default=1)
+        parser.add_argument('--authkey', default=None)
+        parser.add_argument('--project', default=None)
+        try:
+            args = parser.parse_command(command)
+            address = distributed.parse_address(args.connect)
+            authkey = distributed.get_authkey(args.authkey)
+        except ValueError as e:
+            log.error('Command \"' + command + '\" not understood: ' + str(e))
+            return
+        if args.project is not None:
+            self.do_load_project(args.project)
+        self.project.run_test_worker(
+            address,
+            authkey,
+            tool_name=args.tool_name,
+            jobs=args.jobs
+        )
+
+    @wraps_do_commands
+    def do_merge_results(self, command):
+        """
+        Combine test result files written by run_tests (for example by each
+        shard of a sharded run) into a single HTML report. Glob patterns are
+        expanded. The merge fails if the shards were planned differently, a
+        shard is missing or a test has no result or more than one result.
+        The test durations in the result files are added to the duration
+        history of the project. Use --junit PATH to also write a JUnit XML
+        report of the combined results.
+        Example: (Cmd) merge_results [-o report.html] [--junit PATH]
+        results_*.jsonl
+        """
+        parser = CommandArgumentParser(prog='merge_results')
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('-o', '--output', default='merged_report.html')
+        parser.add_argument('--junit', default=None)
+        try:
+            args = parser.parse_command(command)
+        except ValueError as e:
+            log.error('Command \"' + command + '\" not understood: ' + str(e))
+            return
+        results.merge_results(
+            args.paths,
+            report_path=args.output,
+            duration_store=TestDurationStore(self.project.cache_path),
+            junit_path=args.junit
+        )
@@ -0,0 +1,317 @@
+"""
+The DependencyGraph scans the VHDL and Verilog source files of a Project to
+find the design units that each file declares and the design units that it
+references, so that the set of files that a top level design unit depends on
+can be determined without invoking a simulator.
+
+The scanner uses regular expressions rather than a full language parser, it
+recognises the following constructs:
+
+    * VHDL entities, architectures, packages, package bodies, contexts and
+      configurations.
+    * VHDL *use* and *context* clauses, direct entity instantiations,
+      component instantiations and the *use entity* and *use configuration*
+      bindings of configuration specifications and declarations.
+    * Verilog and SystemVerilog modules, interfaces and packages, module
+      instantiations, package imports and *`include* directives.
+
+References to units that are not declared by any project file (for example
+the IEEE libraries or precompiled vendor libraries) are ignored.
+"""
+
+import os
+import re
+import logging
+import traceback
+import subprocess
+
+from chiptools.common import exceptions
+from chiptools.common.filetypes import FileType
+
+log = logging.getLogger(__name__)
+
+# VHDL declarations
+_VHDL_COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+_VHDL_PRIMARY_RE = re.compile(
+    r'^\s*(entity|package|context|configuration)\s+(\w+)\s+(?:is|of)\b',
+    re.IGNORECASE | re.MULTILINE
+)
+_VHDL_SECONDARY_RE = re.compile(
+    r'^\s*(?:architecture\s+\w+\s+of|package\s+body)\s+(\w+)\s+is\b',
+    re.IGNORECASE | re.MULTILINE
+)
+# VHDL references
+_VHDL_USE_RE = re.compile(
+    r'\b(?:use|context)\s+(\w+)\s*\.\s*(\w+)',
+    re.IGNORECASE
+)
+_VHDL_ENTITY_RE = re.compile(
+    r':\s*entity\s+(\w+)\s*\.\s*(\w+)',
+    re.IGNORECASE
+)
+_VHDL_BINDING_RE = re.compile(
+    r'\buse\s+(?:entity|configuration)\s+(\w+)\s*\.\s*(\w+)',
+    re.IGNORECASE
+)
+_VHDL_COMPONENT_RE = re.compile(
+    r'(?:\bcomponent\s+(\w+)\b)|' +
+    r'(?::\s*(\w+)\s+(?:generic|port)\s+map\b)',
+    re.IGNORECASE
+)
+# Verilog declarations and references
+_VERILOG_COMMENT_RE = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+_VERILOG_DECLARATION_RE = re.compile(
+    r'^\s*(?:module|macromodule|interface|package|program)\s+' +
+    r'(?:automatic\s+|static\s+)?(\w+)',
+    re.MULTILINE
+)
+_VERILOG_INSTANCE_RE = re.compile(
+    r'^\s*(\w+)\s*(?:#\s*\([^;]*?\)\s*)?\w+\s*(?:\[[^\]]*\]\s*)?\(',
+    re.MULTILINE
+)
+_VERILOG_IMPORT_RE = re.compile(r'\b(\w+)\s*::')
+_VERILOG_INCLUDE_RE = re.compile(r'`include\s+"([^"]+)"')
+_VERILOG_KEYWORDS = set([
+    'module', 'macromodule', 'interface', 'package', 'program', 'function',
+    'task', 'always', 'always_ff', 'always_comb', 'always_latch', 'assign',
+    'initial', 'if', 'else', 'case', 'for', 'foreach', 'while', 'repeat',
+    'forever', 'begin', 'end', 'return', 'wait', 'assert', 'property',
+    'sequence', 'class', 'covergroup', 'input', 'output', 'inout', 'wire',
+    'reg', 'logic', 'bit', 'int', 'integer', 'genvar', 'generate',
+    'localparam', 'parameter', 'typedef', 'struct', 'enum',
+])
+
+
+class SourceFile:
+    """
+    A SourceFile holds the results of scanning a single design source file:
+    the *provides* set of (library, unit) names declared by the file and the
+    *references* set of (library, unit) names that it uses. Unit names are
+    stored in lower case. A library of None in a reference indicates that the
+    unit may be found in any library.
+    """
+    def __init__(self, path, library):
+        self.path = path
+        self.library = library.lower()
+        self.provides = set()
+        self.secondary = set()
+        self.references = set()
+        self.includes = set()
+
+    def scan(self, file_type):
+        """
+        Read the file and populate the unit sets using the scanner for the
+        given *file_type*.
+        """
+        with open(self.path, 'r', errors='replace') as f:
+            text = f.read()
+        if file_type == FileType.VHDL:
+            self.scan_vhdl(text)
+        elif file_type in [FileType.Verilog, FileType.SystemVerilog]:
+            self.scan_verilog(text)
+
+    def qualify(self, library):
+        """Return the library name for a reference to *library*."""
+        library = library.lower()
+        return self.library if library == 'work' else library
+
+    def scan_vhdl(self, text):
+        text = _VHDL_COMMENT_RE.sub('', text)
+        for match in _VHDL_PRIMARY_RE.finditer(text):
+            self.provides.add((self.library, match.group(2).lower()))
+        for match in _VHDL_SECONDARY_RE.finditer(text):
+            unit = (self.library, match.group(1).lower())
+            # A secondary unit depends on its primary unit
+            self.secondary.add(unit)
+            self.references.add(unit)
+        for match in _VHDL_USE_RE.finditer(text):
+            self.references.add(
+                (self.qualify(match.group(1)), match.group(2).lower())
+            )
+        for match in _VHDL_ENTITY_RE.finditer(text):
+            self.references.add(
+                (self.qualify(match.group(1)), match.group(2).lower())
+            )
+        for match in _VHDL_BINDING_RE.finditer(text):
+            self.references.add(
+                (self.qualify(match.group(1)), match.group(2).lower())
+            )
+        for match in _VHDL_COMPONENT_RE.finditer(text):
+            name = match.group(1) or match.group(2)
+            self.references.add((None, name.lower()))
+
+    def scan_verilog(self, text):
+        text = _VERILOG_COMMENT_RE.sub('', text)
+        for match in _VERILOG_DECLARATION_RE.finditer(text):
+            self.provides.add((self.library, match.group(1).lower()))
+        for match in _VERILOG_INSTANCE_RE.finditer(text):
+            name = match.group(1)
+            if name not in _VERILOG_KEYWORDS:
+                self.references.add((None, name.lower()))
+        for match in _VERILOG_IMPORT_RE.finditer(text):
+            self.references.add((None, match.group(1).lower()))
+        for match in _VERILOG_INCLUDE_RE.finditer(text):
+            self.includes.add(
+                os.path.normpath(
+                    os.path.join(os.path.dirname(self.path), match.group(1))
+                )
+            )
+
+
+class DependencyGraph:
+    """
+    A DependencyGraph is built from a list of project File objects. It can
+    be used to find the files that a design unit depends on
+    (*get_dependencies*) and the design units that are affected by changes to
+    a set of files (*is_affected*).
+    """
+    def __init__(self, file_objects):
+        self.files = {}
+        # (library, unit) : set of paths declaring or implementing the unit
+        self.units = {}
+        # unit : set of libraries declaring the unit, to resolve references
+        # that do not name a library
+        self.unit_libraries = {}
+        for file_object in file_objects:
+            self.add_file(file_object)
+
+    def add_file(self, file_object):
+        """Scan the given *file_object* and add it to the graph."""
+        path = os.path.normpath(file_object.path)
+        source = SourceFile(path, file_object.library)
+        try:
+            source.scan(file_object.fileType)
+        except:
+            log.warning('Could not scan file for dependencies: ' + path)
+            log.debug(traceback.format_exc())
+        self.files[path] = source
+        for unit in source.provides | source.secondary:
+            self.units.setdefault(unit, set()).add(path)
+        for library, name in source.provides:
+            self.unit_libraries.setdefault(name, set()).add(library)
+
+    def resolve(self, source, reference):
+        """
+        Return the list of (library, unit) keys declared in the graph that
+        match the *reference* made by the *source* file.
+        """
+        library, name = reference
+        if library is not None:
+            return [reference] if reference in self.units else []
+        libraries = self.unit_libraries.get(name, set())
+        if source.library in libraries:
+            return [(source.library, name)]
+        return [(lib, name) for lib in sorted(libraries)]
+
+    def get_file_dependencies(self, path):
+        """
+        Return the set of file paths that the file at *path* directly depends
+        on.
+        """
+        source = self.files[path]
+        result = set(
+            include for include in source.includes if include in self.files
+        )
+        for reference in source.references:
+            for unit in self.resolve(source, reference):
+                result |= self.units[unit]
+        result.discard(path)
+        return result
+
+    def has_unit(self, library, unit):
+        """
+        Return True if the design unit *unit* in *library* is declared in
+        the graph.
+        """
+        return (library.lower(), unit.lower()) in self.units
+
+    def get_dependencies(self, library, unit):
+        """
+        Return the set of file paths that the design unit *unit* in *library*
+        depends on, including the files that declare the unit itself. An
+        empty set is returned if the unit is not declared in the graph.
+        """
+        pending = list(self.units.get((library.lower(), unit.lower()), []))
+        result = set()
+        while len(pending) > 0:
+            path = pending.pop()
+            if path in result:
+                continue
+            result.add(path)
+            pending.extend(self.get_file_dependencies(path) - result)
+        return result
+
+    def is_affected(self, library, unit, paths):
+        """
+        Return True if the design unit *unit* in *library* depends on any of
+        the files in the given list of *paths*.
+        """
+        paths = set(os.path.normpath(os.path.abspath(p)) for p in paths)
+        dependencies = set(
+            os.path.normpath(os.path.abspath(p))
+            for p in self.get_dependencies(library, unit)
+        )
+        return len(paths & dependencies) > 0
+
+
+def is_revision(item, root):
+    """
+    Return True if the string *item* is a git revision range (it contains
+    '..' other than as a parent directory path component) or a revision that
+    resolves to a commit in the repository at *root*.
+    """
+    if any(
+        '..' in part and part != '..' for part in re.split(r'[/\\]', item)
+    ):
+        return True
+    try:
+        subprocess.check_output(
+            ['git', 'rev-parse', '--verify', '--quiet', item + '^{commit}'],
+            cwd=root,
+            stderr=subprocess.STDOUT
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+
+def get_changed_files(changes, root):
+    """
+    Return the list of absolute paths of the files described by *changes*,
+    a list of file paths and git revision ranges (for example 'main..HEAD'
+    or 'HEAD~3'). Items that contain '..' or that git resolves to a
+    commit are passed to 'git diff --name-only' in the *root* directory,
+    other items are treated as file paths (relative paths are relative to
+    *root*), which may name deleted files. An ExecutionError is raised if a
+    git command fails.
+    """
+    result = []
+    for item in changes:
+        path = os.path.normpath(os.path.join(root, item))
+        if os.path.isfile(path) or not is_revision(item, root):
+            result.append(path)
+            continue
+        try:
+            top = subprocess.check_output(
+                ['git', 'rev-parse', '--show-toplevel'],
+                cwd=root,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True
+            ).strip()
+            output = subprocess.check_output(
+                ['git', 'diff', '--name-only', item, '--'],
+                cwd=root,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise exceptions.ExecutionError(
+                '{0} is not a file or git revision range: {1}'.format(
+                    item,
+                    getattr(e, 'output', None) or e
+                )
+            )
+        for line in output.splitlines():
+            if len(line.strip()) > 0:
+                result.append(os.path.normpath(os.path.join(top, line)))
+    return result
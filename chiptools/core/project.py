@@ -1,6 +1,9 @@
 import logging
+import datetime
 import glob
+import inspect
 import os
+import time
 import traceback
 import re
 import unittest
@@ -14,37 +17,81 @@ from chiptools.common.filetypes import UnitTestFile
 from chiptools.core.preprocessor import Preprocessor
 from chiptools.core import reporter
 from chiptools.core.cache import FileCache
+from chiptools.core import dependencies
+from chiptools.core.dependencies import DependencyGraph
+from chiptools.core.sandbox import SimulationSandbox
+from chiptools.core.watcher import FileWatcher
 from chiptools.parsers import options
+from chiptools.parsers.xml_project import XmlProjectParser
 from chiptools.testing import testloader
+from chiptools.testing import parallel
+from chiptools.testing import results
+from chiptools.testing import distributed
+from chiptools.testing.distributed import DistributedTestRunner
+from chiptools.testing.parallel import ParallelTestRunner
+from chiptools.testing.result_cache import TestResultCache
 from chiptools.testing.custom_runners import HTMLTestRunner
+from chiptools.testing.durations import TestDurationStore
+from chiptools.testing.durations import TimedTestResult
+from chiptools.testing.last_run import LastRunStore
+from chiptools.testing.retry import FlakinessStore
+from chiptools.testing.retry import RetryPolicy
+from chiptools.testing.test_index import TestIndex
+from chiptools.testing.report import HTMLReportWriter
 from chiptools.wrappers.wrapper import ToolWrapper
 
 log = logging.getLogger(__name__)
 
 
 class Project:
+    # Reports that can be generated by run_tests
+    report_formats = ['html', 'stream', 'text']
+
     def __init__(self):
         super(Project, self).__init__()
         self.initialise()
 
     def initialise(self):
         self.options = options.Options()
+        self.vendor_libraries = self.options.get_vendor_library_cache()
         self.tool_wrapper = ToolWrapper(
             self,
             self.options.get_user_tool_paths()
         )
 
-        self.config = {}
-        self.cache = FileCache('.chiptools')
+        self.cache_path = '.chiptools'
+        self.cache = FileCache(self.cache_path)
         self.root = os.getcwd()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the data loaded from project files (configuration, generics,
+        source files, constraints and unit tests) so that the project files
+        can be loaded again. The tool wrappers and caches are kept.
+        """
+        self.config = {}
         self.generics = {}
         self.constraints = []
         self.file_list = []
         self.project_data = {}
+        self.project_files = []
         self.tests = []
 
+    def reload(self):
+        """
+        Load the project XML file again, replacing the project data with its
+        current contents (refer to *reset*).
+        """
+        path = self.get_project_files()[0]
+        log.info('Reloading project: ' + path)
+        self.reset()
+        self.vendor_libraries.clear()
+        XmlProjectParser.parse_project(path, self)
+
     def set_cache_path(self, cache_path):
         # Update the FileCache to point at the new path
+        self.cache_path = cache_path
         self.cache = FileCache(cache_path)
         self.root = os.path.dirname(cache_path)
 
@@ -74,15 +121,30 @@ class Project:
         for filepath in glob.glob(os.path.join(root, pattern)):
             self.add_file(filepath, library)
 
+    def add_project_file(self, path):
+        """Record the path to a project XML file that was loaded into the
+        project."""
+        path = os.path.abspath(path)
+        if path not in self.project_files:
+            self.project_files.append(path)
+
     def add_constraints(self, path, **attribs):
         """Add the given constraints file to the project."""
         path = utils.relativePathToAbs(path, self.root)
         self.constraints.append(Constraints(path=path, **attribs))
 
     def add_unittest(self, path, **attribs):
-        """Add the given TestSuite file to the project."""
+        """Add the given TestSuite file to the project. The file is not
+        imported until its tests are needed (see *get_tests*)."""
         path = utils.relativePathToAbs(path, self.root)
         unit = UnitTestFile(path=path, **attribs)
+        self.tests.append(unit)
+
+    def load_unittest(self, unit):
+        """Import the TestSuite file linked to the given *UnitTestFile* and
+        store the loaded test suite on it."""
+        path = unit.path
+        unit.loaded = True
         # Perform TestSuite loading on the supplied path
         if os.path.exists(path):
             # Convert the testsuite path into an unpacked testsuite
@@ -98,7 +160,6 @@ class Project:
             # string with the testsuite object that we just
             # unpacked.
             unit.testsuite = unpacked_testsuite
-        self.tests.append(unit)
 
     def add_config(self, name, value, force=False):
         """
@@ -175,6 +236,129 @@ class Project:
         else:
             return None
 
+    def get_shared_simulation_directory(self):
+        """
+        Return the path to the simulation directory shared by the simulation
+        sandboxes of the project, where elaborated designs are cached. This
+        is the simulation directory, also when accessed through a sandbox.
+        """
+        return self.get_simulation_directory()
+
+    def get_simulation_log_directory(self):
+        """
+        Return the path to the directory where the simulator output of each
+        test is logged.
+        """
+        path = self.get_simulation_directory()
+        if path is None:
+            return None
+        return os.path.join(path, 'logs')
+
+    def get_simulation_echo(self):
+        """
+        Return True if simulator output should be printed to the console as
+        it is received, this can be disabled using the 'simulation_echo'
+        configuration item.
+        """
+        return self.config.get(
+            ProjectAttributes.ATTRIBUTE_SIM_ECHO,
+            None
+        ) is not False
+
+    def get_warm_simulation(self):
+        """
+        Return True if the simulator should be kept running between tests
+        and the design restarted for each test instead of launching the
+        simulator again, this is enabled using the 'warm_simulation'
+        configuration item.
+        """
+        return self.config.get(
+            ProjectAttributes.ATTRIBUTE_WARM_SIMULATION,
+            None
+        ) is True
+
+    def get_failure_patterns(self):
+        """
+        Return the list of regular expressions that abort a test simulation
+        when they match its output, set using the 'failure_pattern'
+        configuration item.
+        """
+        pattern = self.config.get(
+            ProjectAttributes.ATTRIBUTE_FAILURE_PATTERN,
+            None
+        )
+        if pattern is None or len(pattern) == 0:
+            return []
+        return [pattern]
+
+    def get_timeout(self, name=ProjectAttributes.ATTRIBUTE_TIMEOUT):
+        """
+        Return the timeout in seconds set by the configuration item *name*,
+        by default the project 'timeout' configuration item. None is
+        returned if the timeout is not set.
+        """
+        timeout = self.config.get(name, None)
+        if timeout is None or len(str(timeout).strip()) == 0:
+            return None
+        try:
+            return float(timeout)
+        except ValueError:
+            log.warning(
+                'Ignoring invalid timeout {0} set to {1}'.format(
+                    name,
+                    timeout
+                )
+            )
+            return None
+
+    def get_tool_timeout(self, tool_name, flow_name):
+        """
+        Return the timeout in seconds for the given toolname and flowname,
+        set using the 'timeout_toolname_flowname' configuration item. If it
+        is not set the 'tool_timeout' configuration item is returned
+        instead. The project 'timeout' is not used as it is the timeout of a
+        test simulation, which is usually much shorter than a synthesis
+        stage.
+        """
+        timeout = self.get_timeout(
+            'timeout_{0}_{1}'.format(tool_name, flow_name)
+        )
+        if timeout is None:
+            return self.get_timeout(ProjectAttributes.ATTRIBUTE_TOOL_TIMEOUT)
+        return timeout
+
+    def get_retry_policy(self):
+        """
+        Return the RetryPolicy for test runs, configured using the 'retries',
+        'infrastructure_retries' and 'infrastructure_pattern' configuration
+        items.
+        """
+        counts = []
+        for name in [
+            ProjectAttributes.ATTRIBUTE_RETRIES,
+            ProjectAttributes.ATTRIBUTE_INFRASTRUCTURE_RETRIES,
+        ]:
+            value = self.config.get(name, None)
+            try:
+                if value is None or len(str(value).strip()) == 0:
+                    counts.append(0)
+                else:
+                    counts.append(max(0, int(value)))
+            except ValueError:
+                log.warning(
+                    'Ignoring invalid {0} set to {1}'.format(name, value)
+                )
+                counts.append(0)
+        pattern = self.config.get(
+            ProjectAttributes.ATTRIBUTE_INFRASTRUCTURE_PATTERN,
+            None
+        )
+        return RetryPolicy(
+            retries=counts[0],
+            infrastructure_retries=counts[1],
+            infrastructure_patterns=[pattern] if pattern else None
+        )
+
     def get_reporter(self):
         """
         Return function pointer to a reporter function that is executed after a
@@ -265,13 +449,62 @@ class Project:
         """
         return self.tool_wrapper.synthesisers
 
-    def get_simulator_library_dependencies(self):
+    def get_simulator_library_dependencies(self, simulation_tool=None):
         """
         Return a dictionary of library_name : path where both are strings and
         the *library_name* defines a simulation library dependency name and
-        *path* provides the path to the dependency.
+        *path* provides the path to the dependency. If a *simulation_tool*
+        instance is supplied the vendor libraries that have been built for it
+        are included.
+        """
+        return self.options.get_simulator_library_dependencies(
+            simulation_tool
+        )
+
+    def build_vendor_libraries(
+        self,
+        tool_name=None,
+        libraries=None,
+        jobs=None,
+        force=False
+    ):
         """
-        return self.options.get_simulator_library_dependencies()
+        Compile the vendor libraries declared in the system configuration file
+        into the shared vendor library cache. The *libraries* input is an
+        optional list of library names to build, if None all declared vendor
+        libraries that are not already cached are built. Up to *jobs*
+        libraries are compiled in parallel. If *force* is True cached
+        libraries are rebuilt. Return True if the libraries were built.
+
+        The Simulation tool that is used is determined by the
+        *tool_name* input if supplied, otherwise the *Project* configuration
+        : 'simulator' tool name will be used instead.
+        """
+        simulation_tool = self.tool_wrapper.get_tool(
+            tool_type='simulation',
+            tool_name=tool_name
+        )
+        if simulation_tool is None or not simulation_tool.installed:
+            name = None if simulation_tool is None else simulation_tool.name
+            log.error(
+                "Vendor library build aborted, {0} is not available.".format(
+                    name
+                )
+            )
+            return False
+        return self.vendor_libraries.build(
+            simulation_tool,
+            libraries=libraries,
+            jobs=jobs,
+            force=force
+        )
+
+    def get_project_files(self):
+        """
+        Return a list of paths to the project XML files that were loaded into
+        the *Project*.
+        """
+        return self.project_files
 
     def get_system_config_path(self):
         """
@@ -306,14 +539,19 @@ class Project:
                 except:
                     log.error(traceback.format_exc())
 
-    def compile(self, tool_name=None):
+    def compile(self, tool_name=None, build_vendor_libraries=True):
         """
         Compile the libraries and files loaded into the *Project*.
         The Simulation tool that is used is determined by the
         *tool_name* input if supplied, otherwise the *Project* configuration
-        : 'simulator' tool name will be used instead.
+        : 'simulator' tool name will be used instead. Any missing vendor
+        libraries are built first unless *build_vendor_libraries* is False.
+        Return True if the compilation completed without errors.
         """
-        simulation_tool = self.tool_wrapper.get_tool(tool_type='simulation')
+        simulation_tool = self.tool_wrapper.get_tool(
+            tool_type='simulation',
+            tool_name=tool_name
+        )
         if simulation_tool is None or not simulation_tool.installed:
             name = None if simulation_tool is None else simulation_tool.name
             log.error(
@@ -321,14 +559,21 @@ class Project:
                     name
                 )
             )
-            return
+            return False
+        # Build any vendor libraries that are missing from the cache
+        if build_vendor_libraries:
+            self.vendor_libraries.build(simulation_tool)
         try:
             simulation_tool.compile_project(
-                includes=self.options.get_simulator_library_dependencies()
+                includes=self.get_simulator_library_dependencies(
+                    simulation_tool
+                )
             )
         except:
             log.error(traceback.format_exc())
             log.error("Compilation aborted due to previous error.")
+            return False
+        return True
 
     def simulate(self, library, entity, tool_name=None, **kwargs):
         """
@@ -351,16 +596,20 @@ class Project:
             )
             return
         # Do a compilation of the design to ensure the libraries are up to date
+        # Build any vendor libraries that are missing from the cache
+        self.vendor_libraries.build(simulation_tool)
         try:
             simulation_tool.compile_project(
-                includes=self.options.get_simulator_library_dependencies()
+                includes=self.get_simulator_library_dependencies(
+                    simulation_tool
+                )
             )
         except:
             log.error(traceback.format_exc())
             log.error("Compilation aborted due to previous error")
             return False
 
-        includes = self.options.get_simulator_library_dependencies()
+        includes = self.get_simulator_library_dependencies(simulation_tool)
         includes.update(kwargs.get('includes', {}))
         kwargs.update(
             {
@@ -371,6 +620,27 @@ class Project:
         log.info('Simulating entity ' + entity + ' in library ' + library)
         simulation_tool.simulate(library, entity, **kwargs)
 
+    def create_sandbox(self, tool_name=None, name='sandbox', keep=False):
+        """
+        Return a *SimulationSandbox* for the simulation tool: a private working
+        directory that shares the libraries compiled in the simulation
+        directory so that several simulations can run at the same time. The
+        sandbox directory is created when the sandbox is entered as a context
+        manager and deleted on exit, unless *keep* is True. Simulations should
+        be run using the *simulator* attribute of the sandbox.
+
+        The Simulation tool that is used is determined by the
+        *tool_name* input if supplied, otherwise the *Project* configuration
+        : 'simulator' tool name will be used instead.
+        """
+        simulation_tool = self.tool_wrapper.get_tool(
+            tool_type='simulation',
+            tool_name=tool_name
+        )
+        if simulation_tool is None:
+            return None
+        return SimulationSandbox(simulation_tool, name=name, keep=keep)
+
     def synthesise(self, library, entity, tool_name=None, fpga_part=None):
         """
         Synthesise the *Project* using the given *library* and *entity* as a
@@ -409,29 +679,240 @@ class Project:
 
     def get_tests(self):
         """
-        Return a list of TestSuite objects.
+        Return a list of TestSuite objects. Test files that have not been
+        loaded yet are imported.
         """
+        for unit in self.tests:
+            if not unit.loaded:
+                self.load_unittest(unit)
         files_with_tests = list(
             filter(lambda x: x.testsuite, self.tests)
         )
         return files_with_tests
 
-    def run_tests(self, ids=None, tool_name=None):
+    def get_test_index(self):
+        """
+        Return a list of (UnitTestFile, entries) tuples describing the tests
+        of each test file, where *entries* is the list of test dictionaries
+        recorded by the TestIndex. The entries are listed in the same order
+        as the integer test IDs used by *run_tests*. Test files are only
+        imported if they are not in the index or have changed since they
+        were indexed.
+        """
+        index = TestIndex(self.cache_path)
+        result = []
+        for unit in self.tests:
+            entries = None
+            if not unit.loaded:
+                entries = index.get_entries(unit.path)
+            if entries is None:
+                if not unit.loaded:
+                    self.load_unittest(unit)
+                if not unit.testsuite:
+                    continue
+                entries = index.add_suite(unit.path, unit.testsuite)
+            if len(entries) > 0:
+                result.append((unit, entries))
+        try:
+            index.save_cache()
+        except (IOError, OSError):
+            log.warning('The test index could not be saved.')
+            log.debug(traceback.format_exc())
+        return result
+
+    def get_dependency_graph(self):
+        """
+        Return a DependencyGraph of the project design files.
+        """
+        return DependencyGraph(self.get_files())
+
+    def get_test_fingerprint(self, test, simulation_tool, graph):
+        """
+        Return the TestResultCache fingerprint of the given *test* when run
+        on the *simulation_tool*. The design files covered by the fingerprint
+        are the dependencies of the test top level found in the *graph*, or
+        the whole design if the top level is not found, together with the
+        compile arguments of those files and the project compile and
+        simulate arguments.
+        """
+        paths = graph.get_dependencies(test.library, test.entity)
+        if len(paths) == 0:
+            design_fingerprint = simulation_tool.get_design_fingerprint()
+            files = self.get_files()
+        else:
+            design_fingerprint = simulation_tool.get_design_fingerprint(paths)
+            files = [
+                f for f in self.get_files()
+                if os.path.normpath(f.path) in paths
+            ]
+        # Tool arguments change the compiled design or the simulation
+        name = simulation_tool.name
+        tool_arguments = repr(
+            [
+                self.get_tool_arguments(name, 'compile'),
+                self.get_tool_arguments(name, 'simulate'),
+            ] +
+            [
+                (f.path, f.get_tool_arguments(name, 'compile'))
+                for f in files
+            ]
+        )
+        return TestResultCache.get_fingerprint(
+            test,
+            design_fingerprint,
+            tool_arguments
+        )
+
+    def select_affected_tests(self, tests, paths):
+        """
+        Return the list of tests from the given list of *tests* that are
+        affected by changes to the files in the list of *paths*. A test is
+        affected if its module or one of its stimulus files changed, or if
+        the top level library and entity of the test depend on a changed
+        design file. Tests whose top level cannot be found in the project
+        design files are always selected, as are all tests if a project file
+        changed.
+        """
+        paths = set(os.path.normpath(os.path.abspath(p)) for p in paths)
+        if len(paths & set(self.get_project_files())) > 0:
+            log.info('The project file changed, all tests are affected.')
+            return list(tests)
+        graph = self.get_dependency_graph()
+        result = []
+        for test in tests:
+            module_path = os.path.abspath(inspect.getfile(test.__class__))
+            test_paths = [module_path] + [
+                os.path.join(os.path.dirname(module_path), path)
+                for path in test.stimulus_files
+            ]
+            test_paths = set(os.path.normpath(p) for p in test_paths)
+            if len(test_paths & paths) > 0:
+                result.append(test)
+            elif not graph.has_unit(test.library, test.entity):
+                log.warning(
+                    'Top level {0}.{1} of {2} not found, '.format(
+                        test.library,
+                        test.entity,
+                        test.id()
+                    ) +
+                    'assuming the test is affected.'
+                )
+                result.append(test)
+            elif graph.is_affected(test.library, test.entity, paths):
+                result.append(test)
+        log.info(
+            '{0} of {1} test(s) affected by {2} changed file(s)'.format(
+                len(result),
+                len(tests),
+                len(paths)
+            )
+        )
+        return result
+
+    def run_tests(
+        self,
+        ids=None,
+        tool_name=None,
+        jobs=1,
+        cache=False,
+        shard=None,
+        shard_history=None,
+        results_path=None,
+        listen=None,
+        authkey=None,
+        affected_by=None,
+        report='html',
+        junit_path=None,
+        failed=False,
+        first_failed=False
+    ):
         """
         Run the Project unit tests. The *ids* input is an iterable containing
         integer IDs referencing test cases from the test suite. If *ids* is
         None all tests in the test suite will be executed, otherwise the
         *ids* will be used to select which tests in the test suite are run.
 
+        The *jobs* input sets the number of worker processes used to run the
+        tests. By default the tests are run serially in this process, if
+        *jobs* is greater than 1 the tests are distributed between worker
+        processes that each run in a private simulation sandbox. If *jobs* is
+        0 or None one worker per CPU is used. The duration of each test is
+        recorded so that parallel runs can start the longest tests first and
+        so that the run time can be compared against previous runs.
+
+        If *cache* is True tests that previously passed with unchanged
+        inputs (the design files the test depends on, the test module, the
+        generics and any stimulus files) are not run again and are reported
+        as cached passes.
+
+        If *affected_by* is given only the selected tests affected by the
+        changes are run. It is a list of changed file paths and git revision
+        ranges (see *select_affected_tests*).
+
+        Tests that do not pass are run again as allowed by the project
+        retry policy (see *get_retry_policy*), tests that pass on a retry
+        after failing are reported as flaky and the flakiness of each test
+        is recorded in the project FlakinessStore.
+
+        The outcome of each test is recorded by test ID in the project
+        LastRunStore. If *failed* is True only the selected tests that
+        failed, raised an error or timed out when they were last run are
+        run. If *first_failed* is True the selected tests that failed when
+        they were last run are started before the other tests.
+
+        The *shard* input is an optional (index, count) tuple used to split
+        the selected tests between several machines: only the tests that
+        belong to shard *index* (1 to *count*) are run. Tests are assigned
+        to shards by test ID so that each shard runs the same number of
+        tests. If *shard_history* is given (a list of result files of an
+        earlier run, glob patterns are expanded) the shards are balanced
+        using the durations that it records instead, every shard must be
+        given the same history. The local duration history is not used to
+        balance shards as it differs between machines, and the durations
+        measured by a shard are not added to it, they are added when the
+        shard results are merged.
+
+        The outcome of each test is written to the JSON Lines result file
+        given by *results_path*, by default 'results.jsonl' (or
+        'results_INDEX_of_COUNT.jsonl' for a shard) in the simulation
+        directory. Result files can be combined using
+        *chiptools.testing.results.merge_results*. A JUnit XML report is also
+        written to *junit_path*, by default 'results.xml' (or
+        'results_INDEX_of_COUNT.xml') in the simulation directory. Both files
+        are written as each test completes.
+
+        The *report* input selects the HTML report written to 'report.html'
+        in the simulation directory: 'html' generates the report when the
+        run completes, 'stream' writes each test to the report as it
+        completes and keeps only truncated test outputs in memory (the full
+        simulator output is linked from the report log files), 'text' only
+        prints the results to the console.
+
+        If a *listen* address ((host, port) tuple) is given the tests are
+        not run locally, instead this process becomes a coordinator that
+        distributes the tests to workers started with *run_test_worker* on
+        other hosts, using the *authkey* to authenticate the workers. The
+        coordinator does not need a simulator installation.
+
         The Simulation tool that is used is determined by the
         *tool_name* input if supplied, otherwise the *Project* configuration
         : 'simulator' tool name will be used instead.
         """
+        if report not in self.report_formats:
+            log.error(
+                'Unknown report {0}, expected one of: {1}'.format(
+                    report,
+                    ', '.join(self.report_formats)
+                )
+            )
+            return
         simulation_tool = self.tool_wrapper.get_tool(
             tool_type='simulation',
             tool_name=tool_name
         )
-        if simulation_tool is None or not simulation_tool.installed:
+        if simulation_tool is None or (
+            listen is None and not simulation_tool.installed
+        ):
             name = None if simulation_tool is None else simulation_tool.name
             log.error(
                 "Compilation aborted, {0} is not available.".format(
@@ -439,18 +920,32 @@ class Project:
                 )
             )
             return
-        # First compile the project
-        try:
-            simulation_tool.compile_project(
-                includes=self.options.get_simulator_library_dependencies()
+        if listen is None:
+            # First compile the project
+            # Build any vendor libraries that are missing from the cache
+            self.vendor_libraries.build(simulation_tool)
+            try:
+                simulation_tool.compile_project(
+                    includes=self.get_simulator_library_dependencies(
+                        simulation_tool
+                    )
+                )
+            except:
+                log.error(traceback.format_exc())
+                log.error("Compilation aborted due to previous error")
+                return
+        elif cache:
+            # The coordinator does not compile the design so the design
+            # fingerprints used by the cache are not available.
+            log.warning(
+                'The test result cache is not used when tests are run by ' +
+                'remote workers.'
             )
-        except:
-            log.error(traceback.format_exc())
-            log.error("Compilation aborted due to previous error")
-            return
+            cache = False
 
         suite = unittest.TestSuite()
         tests = []
+        includes = self.get_simulator_library_dependencies(simulation_tool)
 
         for file_object in self.get_tests():
             file_name = os.path.basename(file_object.path)
@@ -458,7 +953,7 @@ class Project:
                 for testId, test in enumerate(test_group):
                     # Patch in the simulation runtime data
                     test.postImport(
-                        self.options.get_simulator_library_dependencies(),
+                        includes,
                         self.get_simulation_directory(),
                         simulation_tool,
                     )
@@ -475,31 +970,404 @@ class Project:
         elif len(ids) == 0:
             ids = list(range(len(tests)))
 
-        for id in ids:
-            if id < len(tests):
-                fileName, test = tests[id]
-                log.info(
-                    str(test.id())
+        selection = [tests[id][1] for id in ids if id < len(tests)]
+        if affected_by is not None:
+            try:
+                changed = dependencies.get_changed_files(
+                    affected_by,
+                    self.root
+                )
+            except exceptions.ExecutionError as e:
+                log.error(str(e))
+                return
+            selection = self.select_affected_tests(selection, changed)
+            if len(selection) == 0:
+                log.info('No tests are affected by the changes.')
+                return
+        last_run = LastRunStore(self.cache_path)
+        priority = None
+        if failed:
+            selection = [
+                test for test in selection if last_run.is_failed(test.id())
+            ]
+            if len(selection) == 0:
+                log.info('No selected tests failed in the last run.')
+                return
+            log.info(
+                'Running {0} test(s) that failed in the last run'.format(
+                    len(selection)
                 )
-                suite.addTest(test)
-                log.info('Added ' + str(test) + ' to testsuite')
+            )
+        elif first_failed:
+            priority = set(
+                test.id() for test in selection
+                if last_run.is_failed(test.id())
+            )
+            # Serial runs follow the suite order
+            selection.sort(key=lambda test: test.id() not in priority)
+            log.info(
+                'Running {0} test(s) that failed in the last run first'.format(
+                    len(priority)
+                )
+            )
+        # The duration history is used to schedule the tests and to compare
+        # the run time of each test against its history.
+        duration_store = TestDurationStore(self.cache_path)
+        plan = shard_ids = None
+        if shard is not None:
+            index, count = shard
+            test_ids = [test.id() for test in selection]
+            # Every shard must see the same durations, so only an explicit
+            # shared history is used to balance the shards.
+            shard_durations = None
+            if shard_history is not None:
+                shard_durations = results.read_durations(shard_history)
+            shard_ids = results.select_shard(
+                test_ids,
+                index,
+                count,
+                shard_durations
+            )
+            plan = results.get_shard_plan(test_ids, count, shard_durations)
+            log.info(
+                'Running shard {0}/{1}: {2} of {3} test(s)'.format(
+                    index,
+                    count,
+                    len(shard_ids),
+                    len(selection)
+                )
+            )
+            selection = [test for test in selection if test.id() in shard_ids]
 
+        if cache:
+            result_cache = TestResultCache(self.cache_path)
+            graph = self.get_dependency_graph()
+        fingerprints = {}
+        cached = []
+        for test in selection:
+            log.info(
+                str(test.id())
+            )
+            if cache:
+                fingerprint = self.get_test_fingerprint(
+                    test,
+                    simulation_tool,
+                    graph
+                )
+                fingerprints[test.id()] = fingerprint
+                if result_cache.is_passed(test.id(), fingerprint):
+                    log.info('Using cached result for ' + str(test))
+                    cached.append(test)
+                    continue
+            suite.addTest(test)
+            log.info('Added ' + str(test) + ' to testsuite')
+
+        expected = duration_store.get_expected_durations(
+            test.id() for test in suite
+        )
+        if results_path is None:
+            results_path = os.path.join(
+                self.get_simulation_directory(),
+                'results.jsonl' if shard is None else
+                'results_{0}_of_{1}.jsonl'.format(*shard)
+            )
+        if junit_path is None:
+            junit_path = os.path.join(
+                self.get_simulation_directory(),
+                'results.xml' if shard is None else
+                'results_{0}_of_{1}.xml'.format(*shard)
+            )
+        # Results are written as each test completes
+        writers = [
+            results.ResultWriter(
+                results_path,
+                shard=None if shard is None else '{0}/{1}'.format(*shard),
+                plan=plan,
+                tests=None if shard_ids is None else sorted(shard_ids)
+            ),
+            results.JUnitWriter(junit_path),
+        ]
+        max_output = None
+        if report == 'stream':
+            max_output = HTMLReportWriter.max_output
+            writers.append(
+                HTMLReportWriter(
+                    os.path.join(
+                        self.get_simulation_directory(), 'report.html'
+                    ),
+                    max_output=max_output
+                )
+            )
+        retry_policy = self.get_retry_policy()
+        if not retry_policy.enabled:
+            retry_policy = None
+        for writer in writers:
+            writer.start()
         log.info('Running testsuite...')
+        start_time = datetime.datetime.now()
         try:
-            # TODO: Allow HTML or Console selection
-            if True:
+            if listen is not None:
+                result = DistributedTestRunner(
+                    self,
+                    simulation_tool,
+                    listen,
+                    authkey,
+                    verbosity=2,
+                    durations=expected,
+                    writers=writers,
+                    max_output=max_output,
+                    priority=priority,
+                    retry_policy=retry_policy
+                ).run(suite)
+            elif jobs == 1:
+                result = TimedTestResult(
+                    verbosity=2,
+                    writers=writers,
+                    max_output=max_output,
+                    retry_policy=retry_policy
+                )
+                suite(result)
+                # Retried tests are run after the rest of the suite
+                while len(result.retry_queue) > 0:
+                    result.retry_queue.pop(0)(result)
+            else:
+                result = ParallelTestRunner(
+                    self,
+                    simulation_tool,
+                    jobs=jobs,
+                    verbosity=2,
+                    durations=expected,
+                    writers=writers,
+                    max_output=max_output,
+                    priority=priority,
+                    retry_policy=retry_policy
+                ).run(suite)
+            for test in cached:
+                outcome = (
+                    parallel.RESULT_PASS,
+                    'Cached: passed with unchanged inputs\n',
+                    '',
+                    0,
+                    {}
+                )
+                ParallelTestRunner.add_outcome(result, test, outcome)
+                for writer in writers:
+                    writer.add_test(test, outcome, cached=True)
+            stop_time = datetime.datetime.now()
+            if report == 'html':
                 with open(
                     os.path.join(
                         self.get_simulation_directory(), 'report.html'
                     ), 'w'
-                ) as report:
-                    HTMLTestRunner.HTMLTestRunner(
+                ) as stream:
+                    runner = HTMLTestRunner.HTMLTestRunner(
                         verbosity=2,
-                        stream=report
-                    ).run(suite)
-            else:
-                unittest.TextTestRunner(verbosity=2).run(suite)
+                        stream=stream
+                    )
+                    runner.startTime = start_time
+                    runner.stopTime = stop_time
+                    runner.generateReport(suite, result)
+            log.info(
+                'Ran {0} test(s): Pass {1}, Failure {2}, Error {3}'.format(
+                    result.testsRun,
+                    result.success_count,
+                    result.failure_count,
+                    result.error_count
+                )
+            )
+            log.info('Time Elapsed: {0}'.format(stop_time - start_time))
+            if len(cached) > 0:
+                log.info(
+                    '{0} test(s) passed using cached results'.format(
+                        len(cached)
+                    )
+                )
+            if len(result.timeouts) > 0:
+                log.error(
+                    '{0} test(s) timed out: {1}'.format(
+                        len(result.timeouts),
+                        ', '.join(test.id() for test in result.timeouts)
+                    )
+                )
         except Exception:
             log.error('An error was encountered when running the TestSuite')
             log.error(traceback.format_exc())
+            return
+        finally:
+            for writer in writers:
+                writer.stop()
+            # Serial runs share a warm simulator session between tests
+            simulation_tool.close_session()
+        # Only the outcomes of tests that were actually run are recorded
+        ignored = set(test.id() for test, reason in result.skipped)
+        ignored |= set(test.id() for test in cached)
+        durations = dict(
+            (test_id, duration)
+            for test_id, duration in result.durations.items()
+            if test_id not in ignored
+        )
+        duration_store.report(durations, expected)
+        # Record the outcome of each test for reruns of the failed tests
+        skipped = set(test.id() for test, reason in result.skipped)
+        timeouts = set(test.id() for test in result.timeouts)
+        for code, test, output, error in result.result:
+            if test.id() in skipped:
+                code = parallel.RESULT_SKIP
+            elif test.id() in timeouts:
+                code = parallel.RESULT_TIMEOUT
+            last_run.add_outcome(test.id(), code)
+        last_run.save_cache()
+        flakiness = FlakinessStore(self.cache_path)
+        flaky = []
+        for test_id, outcome in result.outcomes.items():
+            if test_id in ignored:
+                continue
+            flakiness.add_outcome(test_id, outcome[4])
+            if outcome[4].get('flaky', False):
+                flaky.append(test_id)
+        flakiness.save_cache()
+        if len(flaky) > 0:
+            log.warning(
+                '{0} test(s) passed after failing: {1}'.format(
+                    len(flaky),
+                    ', '.join(sorted(flaky))
+                )
+            )
+        flakiness.report(durations.keys())
+        if shard is None:
+            for test_id, duration in durations.items():
+                duration_store.add_duration(test_id, duration)
+            duration_store.save_cache()
+        if cache:
+            # Update the cache with the outcome of the tests that were run
+            for code, test, output, error in result.result:
+                if test.id() in ignored:
+                    continue
+                result_cache.add_result(
+                    test.id(),
+                    fingerprints[test.id()],
+                    code == parallel.RESULT_PASS
+                )
+            result_cache.save_cache()
         log.info('...done')
+
+    def run_test_worker(self, address, authkey, tool_name=None, jobs=1):
+        """
+        Compile the project and run tests for the coordinator (see
+        *run_tests*) at the given *address* ((host, port) tuple), using
+        *jobs* worker processes that each run tests in a private simulation
+        sandbox. The *authkey* must match the key used by the coordinator.
+        This function returns when the coordinator has completed the test
+        run.
+        """
+        if not self.compile(tool_name):
+            return
+        simulation_tool = self.tool_wrapper.get_tool(
+            tool_type='simulation',
+            tool_name=tool_name
+        )
+        distributed.run_workers(
+            self,
+            simulation_tool,
+            address,
+            authkey,
+            jobs=jobs
+        )
+
+    def get_watch_paths(self):
+        """
+        Return a list of the paths monitored by *watch*: the project source
+        files, unit test files and project XML files.
+        """
+        paths = [f.path for f in self.get_files()]
+        paths += [unit.path for unit in self.tests]
+        paths += self.get_project_files()
+        return paths
+
+    def watch(
+        self,
+        tool_name=None,
+        run_tests=False,
+        interval=0.5,
+        debounce=0.3
+    ):
+        """
+        Monitor the project source files, unit test files and project XML
+        files and incrementally recompile the design whenever they change.
+        The *Project*, tool wrappers and file cache are kept in memory between
+        iterations so that only the modified files are processed. When a
+        project XML file changes the project data is reloaded from it.
+
+        If *run_tests* is True the unit tests are run after each successful
+        compilation: only the tests affected by the changed files are run
+        (refer to *select_affected_tests*).
+        The *interval* and *debounce* inputs set the polling interval and
+        the quiet time in seconds used to merge bursts of file changes.
+        This function blocks until interrupted with Ctrl+C.
+        """
+        watcher = FileWatcher(
+            self.get_watch_paths(),
+            interval=interval,
+            debounce=debounce
+        )
+        log.info(
+            'Watching {0} file(s) for changes, '.format(
+                len(watcher.paths)
+            ) +
+            'press Ctrl+C to stop...'
+        )
+        self.compile(tool_name=tool_name)
+        try:
+            while True:
+                changed = watcher.wait()
+                start_time = time.time()
+                for path in sorted(changed):
+                    log.info('Change detected: {0}'.format(path))
+                reloaded = any(
+                    p in changed for p in self.get_project_files()
+                )
+                if reloaded:
+                    # The project structure may have changed, reload it
+                    self.reload()
+                    watcher.set_paths(self.get_watch_paths())
+                else:
+                    for unit in self.tests:
+                        if unit.path in changed:
+                            log.info('Reloading tests: {0}'.format(unit.path))
+                            self.load_unittest(unit)
+                # Vendor libraries are only checked when the project changes
+                success = self.compile(
+                    tool_name=tool_name,
+                    build_vendor_libraries=reloaded
+                )
+                if success and run_tests:
+                    ids = self.get_affected_test_ids(changed)
+                    if len(ids) > 0:
+                        self.run_tests(ids=ids, tool_name=tool_name)
+                    else:
+                        log.info('No tests are affected by the changes.')
+                log.info(
+                    '...iteration completed in ' +
+                    utils.time_delta_string(start_time, time.time())
+                )
+        except KeyboardInterrupt:
+            log.info('...stopped watching')
+        finally:
+            watcher.stop()
+
+    def get_affected_test_ids(self, paths):
+        """
+        Return a list of the integer test IDs (as used by *run_tests*) of the
+        tests affected by changes to the files in the list of *paths* (refer
+        to *select_affected_tests*).
+        """
+        tests = [
+            test
+            for file_object in self.get_tests()
+            for test_group in file_object.testsuite
+            for test in test_group
+        ]
+        affected = set(
+            id(test) for test in self.select_affected_tests(tests, paths)
+        )
+        return [i for i, test in enumerate(tests) if id(test) in affected]
@@ -0,0 +1,110 @@
+"""
+Simulation sandboxes allow several simulations to run concurrently against
+the same compiled design.
+
+Simulator wrappers compile and simulate in the project simulation directory,
+and simulators and unit tests write fixed file names (isim.tcl, xsim.tcl,
+transcripts, stimulus and response files) into their working directory. A
+SimulationSandbox creates a private working directory that shares the
+compiled libraries of the simulation directory read-only (through links or
+library mapping files, as implemented by each wrapper's *prepare_sandbox*
+method) and provides a copy of the simulator wrapper that runs inside it.
+Sandboxes are removed when they are closed.
+"""
+
+import os
+import copy
+import shutil
+import logging
+import tempfile
+
+log = logging.getLogger(__name__)
+
+
+class SandboxProject:
+    """
+    A SandboxProject wraps a Project and redirects its simulation directory
+    to a sandbox directory. All other attributes are taken from the wrapped
+    Project.
+    """
+    def __init__(self, project, path):
+        self.project = project
+        self.path = path
+
+    def __getattr__(self, name):
+        return getattr(self.project, name)
+
+    def get_simulation_directory(self):
+        """
+        Return the path to the sandbox directory.
+        """
+        return self.path
+
+
+class SimulationSandbox:
+    """
+    A SimulationSandbox provides a private simulation working directory for
+    the given *simulator* instance. The sandbox is created inside *root*
+    (by default the 'sandboxes' directory in the project simulation
+    directory) using *name* as a prefix. Simulations should be run through
+    the *simulator* attribute of the sandbox, which is a copy of the original
+    wrapper that executes in the sandbox directory.
+
+    Sandboxes can be used as context managers:
+
+        with SimulationSandbox(simulator, name='worker0') as sandbox:
+            sandbox.simulator.simulate(library, entity)
+
+    Unless *keep* is True the sandbox directory is deleted when it is closed.
+    """
+    sandbox_directory_name = 'sandboxes'
+
+    def __init__(self, simulator, root=None, name='sandbox', keep=False):
+        self.source = simulator
+        self.project = simulator.project
+        if root is None:
+            root = os.path.join(
+                self.project.get_simulation_directory(),
+                self.sandbox_directory_name
+            )
+        self.root = root
+        self.name = name
+        self.keep = keep
+        self.path = None
+        self.simulator = None
+
+    def create(self):
+        """
+        Create the sandbox directory, prepare it with the compiled library
+        mappings and create the sandboxed simulator wrapper.
+        """
+        if not os.path.exists(self.root):
+            os.makedirs(self.root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=self.name + '_', dir=self.root)
+        try:
+            self.source.prepare_sandbox(self.path)
+        except:
+            shutil.rmtree(self.path, ignore_errors=True)
+            raise
+        self.simulator = copy.copy(self.source)
+        self.simulator.project = SandboxProject(self.project, self.path)
+        self.simulator.libraries = dict(self.source.libraries)
+        log.debug('Created simulation sandbox: ' + self.path)
+        return self
+
+    def close(self):
+        """
+        Delete the sandbox directory unless the sandbox was created with
+        *keep* set.
+        """
+        if self.path is not None and not self.keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+            log.debug('Removed simulation sandbox: ' + self.path)
+        self.simulator = None
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
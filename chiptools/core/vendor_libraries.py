@@ -0,0 +1,291 @@
+"""
+The VendorLibraryCache manages precompiled vendor simulation libraries
+(unisim, altera_mf, ...) that are declared in the *[vendor libraries]*
+section of the .chiptoolsconfig file. Each entry maps a library name to a
+comma separated list of source files (glob patterns and environment
+variables are expanded), listed in compile order:
+
+.. code-block:: ini
+
+    [vendor libraries]
+    unisim = $XILINX/vhdl/src/unisims/unisim_VCOMP.vhd,
+             $XILINX/vhdl/src/unisims/primitive/*.vhd
+
+    [vendor library cache]
+    path = /shared/chiptools/vendor_libraries
+
+Libraries are compiled once per simulator installation into a shared cache
+directory, defaulting to ~/.chiptools/vendor_libraries, and reused by every
+project (and every user, if the cache directory is shared). A cache entry is
+keyed by the simulator name, installation path and version and by a
+fingerprint of the library sources, so that upgrading the simulator (even
+in place) or editing the sources triggers a rebuild. GHDL libraries are
+used from the build directory, which is added to the GHDL library search
+path. Libraries are built in temporary directories and moved into place
+when complete, so concurrent builds of the same library by different users
+are safe, and a forced rebuild replaces the cached library instead of
+deleting it while it may be in use.
+"""
+
+import os
+import glob
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from chiptools.common import utils
+
+log = logging.getLogger(__name__)
+
+# Project instances create a file cache in the working directory when they are
+# constructed, so construction is serialised between build threads.
+_project_lock = threading.Lock()
+
+
+class VendorLibraryCache:
+    """
+    A VendorLibraryCache instance provides lookup and build functions for the
+    vendor libraries declared in the given *options* (an Options instance).
+    """
+    def __init__(self, options):
+        self.options = options
+        # Build directories are memoised as finding them globs and stats
+        # every library source, refer to *clear*.
+        self.build_directories = {}
+
+    def clear(self):
+        """
+        Forget the memoised build directories so that the library sources
+        are searched for and checked again.
+        """
+        self.build_directories = {}
+
+    @staticmethod
+    def get_sources(source_spec):
+        """
+        Return a list of source file paths described by the *source_spec*
+        string. The string is a comma or newline separated list of paths or
+        glob patterns, environment variables and ~ are expanded.
+        """
+        sources = []
+        for item in source_spec.replace('\n', ',').split(','):
+            item = item.strip()
+            if len(item) == 0:
+                continue
+            item = os.path.expanduser(os.path.expandvars(item))
+            matches = sorted(glob.glob(item))
+            if len(matches) == 0:
+                log.warning('No vendor library sources match: ' + item)
+            for path in matches:
+                path = os.path.abspath(path)
+                if path not in sources:
+                    sources.append(path)
+        return sources
+
+    @staticmethod
+    def get_fingerprint(simulator, sources):
+        """
+        Return a string that identifies the given *simulator* installation
+        and version and set of *sources*.
+        """
+        digest = hashlib.sha1()
+        digest.update(simulator.name.encode('utf-8'))
+        digest.update(os.path.abspath(simulator.path).encode('utf-8'))
+        digest.update(simulator.get_version().encode('utf-8'))
+        for path in sources:
+            digest.update(path.encode('utf-8'))
+            try:
+                stat = os.stat(path)
+                digest.update(
+                    '{0}:{1}'.format(stat.st_mtime, stat.st_size).encode(
+                        'utf-8'
+                    )
+                )
+            except OSError:
+                pass
+        return digest.hexdigest()[:16]
+
+    def get_build_directory(self, simulator, library):
+        """
+        Return the directory that the given *library* is compiled into for
+        the given *simulator*. The directory is memoised until *clear* is
+        called.
+        """
+        source_spec = self.options.get_vendor_libraries()[library]
+        key = (
+            simulator.name,
+            simulator.path,
+            simulator.get_version(),
+            library,
+            source_spec
+        )
+        if key not in self.build_directories:
+            sources = self.get_sources(source_spec)
+            self.build_directories[key] = os.path.join(
+                self.options.get_vendor_library_cache_path(),
+                simulator.name,
+                '{0}_{1}'.format(
+                    library,
+                    self.get_fingerprint(simulator, sources)
+                )
+            )
+        return self.build_directories[key]
+
+    def get_library_path(self, simulator, library):
+        """
+        Return the path to the compiled *library* for the given *simulator*
+        (refer to *Simulator.get_library_directory*), or None if it has not
+        been built.
+        """
+        build_directory = self.get_build_directory(simulator, library)
+        if (
+            os.path.isdir(build_directory) and
+            simulator.library_exists(library, build_directory)
+        ):
+            return simulator.get_library_directory(library, build_directory)
+        return None
+
+    def get_built_libraries(self, simulator):
+        """
+        Return a dictionary of library_name : path for each declared vendor
+        library that has been built for the given *simulator*.
+        """
+        result = {}
+        for library in self.options.get_vendor_libraries().keys():
+            path = self.get_library_path(simulator, library)
+            if path is not None:
+                result[library] = path
+        return result
+
+    def get_missing_libraries(self, simulator):
+        """
+        Return a list of the declared vendor library names that have not been
+        built for the given *simulator*.
+        """
+        return [
+            library for library in self.options.get_vendor_libraries().keys()
+            if self.get_library_path(simulator, library) is None
+        ]
+
+    def build(self, simulator, libraries=None, jobs=None, force=False):
+        """
+        Compile the given list of vendor *libraries* (or all declared
+        libraries if None) for the given *simulator* into the shared cache.
+        Libraries are compiled in parallel using up to *jobs* workers.
+        Libraries that are already present in the cache are skipped unless
+        *force* is True. Return True if all libraries were built.
+        """
+        declared = self.options.get_vendor_libraries()
+        if libraries is None:
+            libraries = list(declared.keys())
+        unknown = [lib for lib in libraries if lib not in declared]
+        for library in unknown:
+            log.error('Unknown vendor library: ' + library)
+        libraries = [lib for lib in libraries if lib in declared]
+        if not force:
+            libraries = [
+                lib for lib in libraries
+                if self.get_library_path(simulator, lib) is None
+            ]
+        if len(libraries) == 0:
+            return len(unknown) == 0
+        log.info(
+            'Building vendor libraries for {0}: {1}'.format(
+                simulator.name,
+                ', '.join(libraries)
+            )
+        )
+        start_time = time.time()
+        with ThreadPoolExecutor(
+            max_workers=jobs or min(len(libraries), os.cpu_count() or 1)
+        ) as executor:
+            results = list(executor.map(
+                lambda lib: self._build_library(simulator, lib, force),
+                libraries
+            ))
+        log.info(
+            '...vendor libraries processed in ' +
+            utils.time_delta_string(start_time, time.time())
+        )
+        return all(results) and len(unknown) == 0
+
+    def _build_library(self, simulator, library, force=False):
+        """
+        Compile a single vendor *library* in a temporary directory and move it
+        into the cache when complete. Return True on success.
+        """
+        # Imported here as the Project depends on the Options which use this
+        # module to register the cached libraries.
+        from chiptools.core.project import Project
+
+        sources = self.get_sources(
+            self.options.get_vendor_libraries()[library]
+        )
+        if len(sources) == 0:
+            log.error('Vendor library {0} has no sources.'.format(library))
+            return False
+        target = self.get_build_directory(simulator, library)
+        parent = os.path.dirname(target)
+        if not os.path.exists(parent):
+            os.makedirs(parent, exist_ok=True)
+        workdir = tempfile.mkdtemp(prefix='.' + library + '_', dir=parent)
+        try:
+            log.info('...compiling vendor library: ' + library)
+            with _project_lock:
+                project = Project()
+            project.set_cache_path(os.path.join(workdir, '.' + library))
+            project.add_config('simulation_directory', workdir)
+            project.add_config('simulator', simulator.name)
+            for path in sources:
+                project.add_file(path, library=library)
+            tool = project.tool_wrapper.get_tool(
+                tool_type='simulation',
+                tool_name=simulator.name
+            )
+            if tool is None or not tool.installed:
+                return False
+            tool.compile_project(
+                includes=self.options.get_simulator_library_dependencies()
+            )
+            if not tool.library_exists(library, workdir):
+                log.error('Vendor library {0} failed to build.'.format(
+                    library
+                ))
+                return False
+            previous = None
+            if force and os.path.exists(target):
+                # The cached library may be in use by other projects, so it
+                # is moved aside and replaced rather than deleted in place.
+                previous = tempfile.mkdtemp(
+                    prefix='.' + library + '_old_',
+                    dir=parent
+                )
+                os.rmdir(previous)
+                try:
+                    os.rename(target, previous)
+                except OSError:
+                    previous = None
+            try:
+                os.rename(workdir, target)
+            except OSError:
+                # Another process completed the same build first
+                log.debug('Vendor library already built: ' + target)
+            if previous is not None:
+                shutil.rmtree(previous, ignore_errors=True)
+            log.info('...built vendor library {0} in {1}'.format(
+                library,
+                target
+            ))
+            return True
+        except:
+            log.error('Vendor library {0} failed to build:'.format(library))
+            log.error(traceback.format_exc())
+            return False
+        finally:
+            if os.path.exists(workdir):
+                shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,135 @@
+"""
+The FileWatcher class monitors a set of files for modifications so that the
+Project can recompile and retest a design while the user edits it.
+
+If the optional *watchdog* package is installed it is used to receive native
+file system notifications (inotify, FSEvents, ReadDirectoryChangesW),
+otherwise the watched files are polled using os.stat. In both cases the file
+modification times and sizes are compared to determine which of the watched
+files actually changed.
+"""
+
+import os
+import time
+import logging
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+log = logging.getLogger(__name__)
+
+
+class _WakeHandler(FileSystemEventHandler):
+    """Watchdog event handler that wakes up the FileWatcher on any event."""
+    def __init__(self, event):
+        super(_WakeHandler, self).__init__()
+        self.event = event
+
+    def on_any_event(self, event):
+        self.event.set()
+
+
+class FileWatcher:
+    """
+    A FileWatcher instance tracks the modification state of a list of file
+    paths. The *wait* method blocks until one or more of the files change and
+    then returns the set of changed paths. Bursts of changes (for example an
+    editor saving several files at once) are merged into a single result by
+    waiting until no further changes are seen for *debounce* seconds.
+    """
+    def __init__(self, paths, interval=0.5, debounce=0.3):
+        self.interval = interval
+        self.debounce = debounce
+        self.observer = None
+        self.wake = threading.Event()
+        self.snapshot = {}
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """
+        Replace the set of watched files with the given *paths* and record
+        their current state.
+        """
+        self.paths = sorted(set(os.path.abspath(p) for p in paths))
+        self.snapshot = self.take_snapshot()
+        if Observer is not None:
+            self.stop()
+            self.observer = Observer()
+            handler = _WakeHandler(self.wake)
+            for directory in set(os.path.dirname(p) for p in self.paths):
+                if os.path.isdir(directory):
+                    self.observer.schedule(handler, directory)
+            self.observer.start()
+            log.debug('Using watchdog to monitor file changes')
+        else:
+            log.debug('Polling for file changes every {0}s'.format(
+                self.interval
+            ))
+
+    def take_snapshot(self):
+        """
+        Return a dictionary of path : (mtime, size) for the watched files.
+        Missing files are recorded as None.
+        """
+        result = {}
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                result[path] = (stat.st_mtime, stat.st_size)
+            except OSError:
+                result[path] = None
+        return result
+
+    def poll(self):
+        """
+        Return the set of watched paths that changed since the last call to
+        *poll* (or since the watcher was created).
+        """
+        snapshot = self.take_snapshot()
+        changed = set(
+            path for path in self.paths
+            if snapshot[path] != self.snapshot.get(path)
+        )
+        self.snapshot = snapshot
+        return changed
+
+    def _sleep(self, timeout):
+        """
+        Sleep for *timeout* seconds or until the watchdog observer reports a
+        file system event.
+        """
+        if self.observer is not None:
+            self.wake.wait(timeout)
+            self.wake.clear()
+        else:
+            time.sleep(timeout)
+
+    def wait(self):
+        """
+        Block until one or more watched files change and return the set of
+        changed paths once the changes have settled.
+        """
+        changed = set()
+        while len(changed) == 0:
+            self._sleep(self.interval)
+            changed = self.poll()
+        # Debounce: keep collecting changes until the files are quiet
+        while True:
+            time.sleep(self.debounce)
+            more = self.poll()
+            if len(more) == 0:
+                break
+            changed |= more
+        return changed
+
+    def stop(self):
+        """Stop the watchdog observer, if one is running."""
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
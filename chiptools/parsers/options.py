@@ -21,6 +21,12 @@ log = logging.getLogger(__name__)
 home = expanduser('~')
 # The chiptools config file resides in the user home directory
 options_path = os.path.join(home, '.chiptoolsconfig')
+# Default location of the shared cache of precompiled vendor libraries
+vendor_library_cache_path = os.path.join(
+    home,
+    '.chiptools',
+    'vendor_libraries'
+)
 
 
 class Options:
@@ -44,6 +50,9 @@ class Options:
         ])),
         ('synthesis executables', OrderedDict([
 
+        ])),
+        ('vendor libraries', OrderedDict([
+
         ])),
     ])
 
@@ -57,6 +66,9 @@ class Options:
         self.synthesisers = {}
         self.simulators = {}
         self.simulatorLibraryDependencies = {}
+        self.vendorLibraries = {}
+        self.vendorLibraryCachePath = vendor_library_cache_path
+        self.vendor_library_cache = None
         super(Options, self).__init__()
         self.options_md5 = None
         log.debug('Initialising options parser')
@@ -91,6 +103,15 @@ class Options:
                 self._options,
                 'simulation dependencies'
             )
+            self.vendorLibraries = Options.readOptionsPaths(
+                self._options,
+                'vendor libraries'
+            )
+            self.vendorLibraryCachePath = Options.readOptionsPaths(
+                self._options,
+                'vendor library cache',
+                transform=lambda x: os.path.expanduser(os.path.expandvars(x)),
+            ).get('path', vendor_library_cache_path)
             log.debug('...done loading options file')
         except (config.ParsingError):
             log.error(
@@ -192,12 +213,51 @@ class Options:
         log.error('Unknown synthesis tool: ' + toolName)
         return None
 
-    def get_simulator_library_dependencies(self):
+    def get_simulator_library_dependencies(self, simulator=None):
         """
-        Return the simulator library dependencies.
+        Return a dictionary of the simulator library dependencies.
+
+        If a *simulator* instance is supplied, any vendor libraries that have
+        been built for it in the vendor library cache are included.
 
         If the configuration file was modified since the last access it will be
         reloaded and the new entries returned.
         """
         self.refresh()
-        return self.simulatorLibraryDependencies
+        result = dict(self.simulatorLibraryDependencies)
+        if simulator is not None:
+            built = self.get_vendor_library_cache().get_built_libraries(
+                simulator
+            )
+            # Libraries that the user has mapped by hand take precedence
+            for libname, path in built.items():
+                result.setdefault(libname, path)
+        return result
+
+    def get_vendor_library_cache(self):
+        """
+        Return the VendorLibraryCache of these options, which memoises the
+        vendor library lookups for the lifetime of the options.
+        """
+        if self.vendor_library_cache is None:
+            # Imported here as the vendor library cache uses the Options
+            from chiptools.core.vendor_libraries import VendorLibraryCache
+            self.vendor_library_cache = VendorLibraryCache(self)
+        return self.vendor_library_cache
+
+    def get_vendor_libraries(self):
+        """
+        Return a dictionary of library_name : sources for the vendor libraries
+        declared in the configuration file, where *sources* is a comma
+        separated string of source paths or glob patterns.
+        """
+        self.refresh()
+        return self.vendorLibraries
+
+    def get_vendor_library_cache_path(self):
+        """
+        Return the path to the directory used to cache precompiled vendor
+        libraries.
+        """
+        self.refresh()
+        return os.path.abspath(self.vendorLibraryCachePath)
@@ -146,19 +146,58 @@ class XmlProjectParser:
 
     The following configuration items can be set in a project:
 
-    +----------------------+--------------------------------------------------+
-    | Config               | Description                                      |
-    +======================+==================================================+
-    | simulation_directory | Directory to use as simulation working directory.|
-    +----------------------+--------------------------------------------------+
-    | synthesis_directory  | Directory to use as synthesis working directory. |
-    +----------------------+--------------------------------------------------+
-    | simulator            | Default simulator to use for this project.       |
-    +----------------------+--------------------------------------------------+
-    | synthesiser          | Default synthesiser to use for this project.     |
-    +----------------------+--------------------------------------------------+
-    | part                 | FPGA part to target when performing synthesis.   |
-    +----------------------+--------------------------------------------------+
+    +------------------------+------------------------------------------------+
+    | Config                 | Description                                    |
+    +========================+================================================+
+    | simulation_directory   | Directory to use as simulation working         |
+    |                        | directory.                                     |
+    +------------------------+------------------------------------------------+
+    | synthesis_directory    | Directory to use as synthesis working          |
+    |                        | directory.                                     |
+    +------------------------+------------------------------------------------+
+    | simulator              | Default simulator to use for this project.     |
+    +------------------------+------------------------------------------------+
+    | synthesiser            | Default synthesiser to use for this project.   |
+    +------------------------+------------------------------------------------+
+    | part                   | FPGA part to target when performing synthesis. |
+    +------------------------+------------------------------------------------+
+    | simulation_echo        | (default True) Print simulator output to the   |
+    |                        | console while tests run. Output is always      |
+    |                        | saved to the test log files.                   |
+    +------------------------+------------------------------------------------+
+    | failure_pattern        | Regular expression that aborts a test          |
+    |                        | simulation and fails the test when it matches  |
+    |                        | a line of the simulator output, for example    |
+    |                        | '^Error:'.                                     |
+    +------------------------+------------------------------------------------+
+    | timeout                | Default number of seconds that a test          |
+    |                        | simulation may run for before it is killed. By |
+    |                        | default there is no timeout.                   |
+    +------------------------+------------------------------------------------+
+    | tool_timeout           | Default number of seconds that a compilation,  |
+    |                        | elaboration or synthesis stage may run for     |
+    |                        | before it is killed. By default there is no    |
+    |                        | timeout.                                       |
+    +------------------------+------------------------------------------------+
+    | retries                | (default 0) Number of times a test that fails  |
+    |                        | is run again, a test that passes on a retry is |
+    |                        | reported as flaky.                             |
+    +------------------------+------------------------------------------------+
+    | infrastructure_retries | (default 0) Number of times a test is run      |
+    |                        | again after an infrastructure failure: the     |
+    |                        | simulator exits with an error and the test     |
+    |                        | output matches the infrastructure_pattern.     |
+    +------------------------+------------------------------------------------+
+    | infrastructure_pattern | Regular expression identifying infrastructure  |
+    |                        | failures, by default licence checkout errors,  |
+    |                        | stale file handles and full disks.             |
+    +------------------------+------------------------------------------------+
+    | warm_simulation        | (default False) Keep the simulator running     |
+    |                        | between tests and restart the loaded design    |
+    |                        | instead of launching the simulator for each    |
+    |                        | test, where the simulator supports it          |
+    |                        | (ModelSim and Vivado).                         |
+    +------------------------+------------------------------------------------+
 
     In addition to the above configuration items, the *config* tag also allows
     tool-specific argument passing through the use of config attributes using
@@ -168,6 +207,12 @@ class XmlProjectParser:
     args_ise_par='-mt 4 -ol high -xe n' would pass the arguments
     *-mt 4 -ol high -xe n* to the place and route stage of an ISE synthesis
     flow. Each tool wrapper implements its own specific flow stage names.
+    Timeouts for specific flow stages can be set in the same way using config
+    attributes named *timeout_toolname_flowname*, for example:
+    timeout_ise_par='7200' would abort the place and route stage of an ISE
+    synthesis flow if it has not completed after two hours. Simulators use
+    the *compile* and *elaborate* flow names, for example
+    timeout_vivado_elaborate.
 
     .. note:: If a configuration item is already defined any new definitions
               will be ignored. A warning will be displayed if a
@@ -187,6 +232,16 @@ class XmlProjectParser:
         ProjectAttributes.ATTRIBUTE_SIM_TOOL: lambda x, root: x,
         ProjectAttributes.ATTRIBUTE_SYNTH_TOOL: lambda x, root: x,
         ProjectAttributes.ATTRIBUTE_SYNTH_PART: lambda x, root: x,
+        ProjectAttributes.ATTRIBUTE_SIM_ECHO:
+            lambda x, root: x.lower() != 'false',
+        ProjectAttributes.ATTRIBUTE_FAILURE_PATTERN: lambda x, root: x,
+        ProjectAttributes.ATTRIBUTE_TIMEOUT: lambda x, root: x,
+        ProjectAttributes.ATTRIBUTE_TOOL_TIMEOUT: lambda x, root: x,
+        ProjectAttributes.ATTRIBUTE_RETRIES: lambda x, root: x,
+        ProjectAttributes.ATTRIBUTE_INFRASTRUCTURE_RETRIES: lambda x, root: x,
+        ProjectAttributes.ATTRIBUTE_INFRASTRUCTURE_PATTERN: lambda x, root: x,
+        ProjectAttributes.ATTRIBUTE_WARM_SIMULATION:
+            lambda x, root: x.lower() != 'false',
     }
     FILE_DEFAULTS = {
         ProjectAttributes.XML_ATTRIBUTE_PATH: None,
@@ -198,6 +253,14 @@ class XmlProjectParser:
         ProjectAttributes.ATTRIBUTE_SIM_TOOL: None,
         ProjectAttributes.ATTRIBUTE_SYNTH_TOOL: None,
         ProjectAttributes.ATTRIBUTE_SYNTH_PART: None,
+        ProjectAttributes.ATTRIBUTE_SIM_ECHO: None,
+        ProjectAttributes.ATTRIBUTE_FAILURE_PATTERN: None,
+        ProjectAttributes.ATTRIBUTE_TIMEOUT: None,
+        ProjectAttributes.ATTRIBUTE_TOOL_TIMEOUT: None,
+        ProjectAttributes.ATTRIBUTE_RETRIES: None,
+        ProjectAttributes.ATTRIBUTE_INFRASTRUCTURE_RETRIES: None,
+        ProjectAttributes.ATTRIBUTE_INFRASTRUCTURE_PATTERN: None,
+        ProjectAttributes.ATTRIBUTE_WARM_SIMULATION: None,
     }
 
     @staticmethod
@@ -228,6 +291,7 @@ class XmlProjectParser:
         log.info('Parsing: ' + str(filepath) + ' synthesis=' + str(synthesise))
         start_time = time.time()
         project_root = os.path.dirname(os.path.realpath(filepath))
+        project_object.add_project_file(filepath)
         try:
             xml_obj = minidom.parse(filepath)
             for project_node in xml_obj.getElementsByTagName(
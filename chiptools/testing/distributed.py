@@ -0,0 +1,515 @@
+"""
+Distributed test execution.
+
+A coordinator (the *DistributedTestRunner*) holds the queue of tests of a
+test run and listens for workers on a TCP port. Workers run on any host that
+has a copy of the project and a simulator installation: each worker compiles
+the project locally, connects to the coordinator and then repeatedly
+requests a test, runs it in a private simulation sandbox (using the same
+worker implementation as the ParallelTestRunner) and sends the outcome back.
+
+Connections are authenticated using a shared key (see
+multiprocessing.connection), the key should be kept secret as the messages
+exchanged between the coordinator and the workers are pickled. For the same
+reason the coordinator listens on localhost unless the address of another
+interface is given explicitly.
+
+The coordinator and workers exchange the following messages:
+
+    * Worker: ('hello', name, tool name, fingerprint), the coordinator
+      replies with ('accepted',) or ('rejected', reason). Workers whose
+      simulator or design fingerprint differs from the coordinator are
+      rejected.
+    * Worker: ('request',), the coordinator replies with
+      ('test', index, module path, test ID), ('wait', seconds) if all
+      remaining tests are running on other workers, or ('done',).
+    * Worker: ('heartbeat',), sent periodically while a test runs.
+    * Worker: ('result', index, test ID, outcome).
+
+Tests are never lost: if a worker disconnects or stops sending heartbeats
+the tests that it was running are returned to the front of the queue. A
+worker that loses its connection reconnects and resends any results that
+could not be delivered, duplicate results are ignored.
+"""
+
+import os
+import time
+import shutil
+import socket
+import hashlib
+import inspect
+import logging
+import tempfile
+import threading
+import traceback
+import collections
+import multiprocessing
+from multiprocessing.connection import Listener
+from multiprocessing.connection import Client
+
+from chiptools.core.sandbox import SimulationSandbox
+from chiptools.testing import parallel
+from chiptools.testing.parallel import ParallelTestRunner
+from chiptools.testing.parallel import iterate_tests
+from chiptools.testing.durations import TimedTestResult
+
+log = logging.getLogger(__name__)
+
+# Environment variable holding the default authentication key
+AUTHKEY_VARIABLE = 'CHIPTOOLS_AUTHKEY'
+
+
+def parse_address(address, default_host='localhost'):
+    """
+    Return a (host, port) tuple for the given *address* string, given as
+    HOST:PORT or PORT. A ValueError is raised if the address is invalid.
+    """
+    host, _, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Invalid address {0}, expected HOST:PORT'.format(
+            address
+        ))
+    return (host if host else default_host, port)
+
+
+def get_authkey(authkey=None):
+    """
+    Return the authentication key as bytes: the given *authkey* or the value
+    of the CHIPTOOLS_AUTHKEY environment variable. A ValueError is raised if
+    no key is available.
+    """
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_VARIABLE, None)
+    if not authkey:
+        raise ValueError(
+            'An authentication key is required, use --authkey or set ' +
+            AUTHKEY_VARIABLE
+        )
+    if not isinstance(authkey, bytes):
+        authkey = authkey.encode('utf-8')
+    return authkey
+
+
+def get_source_fingerprint(project, tool_name):
+    """
+    Return a string that identifies the design and test sources of the
+    *project* for the simulator given by *tool_name*. Paths are taken
+    relative to the project root so that copies of the project in different
+    locations have the same fingerprint.
+    """
+    items = [tool_name]
+    for file_object in project.get_files():
+        items.append(file_object.library)
+        items.append(os.path.relpath(file_object.path, project.root))
+    for unit in project.tests:
+        items.append(os.path.relpath(unit.path, project.root))
+    digest = hashlib.sha1()
+    for item in items:
+        digest.update('{0}\n'.format(item).encode('utf-8'))
+    for path in [f.path for f in project.get_files()] + [
+        unit.path for unit in project.tests
+    ]:
+        try:
+            with open(path, 'rb') as f:
+                digest.update(hashlib.md5(f.read()).hexdigest().encode(
+                    'utf-8'
+                ))
+        except (IOError, OSError):
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+
+class DistributedTestRunner(ParallelTestRunner):
+    """
+    A DistributedTestRunner is a coordinator that distributes the tests of a
+    suite to remote workers connecting to the given *address* (a (host,
+    port) tuple) with the given *authkey*. The *run* method blocks until the
+    outcome of every test has been received and returns a result object
+    compatible with the HTMLTestRunner report generator.
+
+    Workers must send a heartbeat at least every *lease_timeout* seconds or
+    they are considered lost and their tests are run by another worker.
+    """
+    def __init__(
+        self,
+        project,
+        simulator,
+        address,
+        authkey,
+        verbosity=1,
+        durations=None,
+        lease_timeout=60,
+        writers=(),
+        max_output=None,
+        priority=None,
+        retry_policy=None
+    ):
+        super(DistributedTestRunner, self).__init__(
+            project,
+            simulator,
+            jobs=1,
+            verbosity=verbosity,
+            durations=durations,
+            writers=writers,
+            max_output=max_output,
+            priority=priority,
+            retry_policy=retry_policy
+        )
+        self.address = address
+        self.authkey = authkey
+        self.lease_timeout = lease_timeout
+        self.fingerprint = get_source_fingerprint(project, simulator.name)
+        self.condition = threading.Condition()
+        self.finished = False
+        self.tests = []
+        self.pending = collections.deque()
+        self.outcomes = {}
+        self.threads = []
+
+    def get_test_message(self, index):
+        """Return the 'test' message for the test at *index*."""
+        test = self.tests[index]
+        return (
+            'test',
+            index,
+            os.path.relpath(
+                inspect.getfile(test.__class__),
+                self.project.root
+            ),
+            test.id()
+        )
+
+    def add_result(self, index, test_id, outcome, name):
+        """
+        Record the *outcome* of the test at *index* received from the worker
+        *name*. Must be called with the condition held.
+        """
+        if index >= len(self.tests) or self.tests[index].id() != test_id:
+            log.warning('Ignoring result for unknown test: ' + test_id)
+            return
+        if index in self.outcomes:
+            log.debug('Ignoring duplicate result for test: ' + test_id)
+            return
+        if index in self.pending:
+            self.pending.remove(index)
+        log.debug('Result of {0} from worker {1}'.format(test_id, name))
+        if self.retry(self.tests[index], index, outcome):
+            # Queue the test behind the tests already waiting
+            self.pending.append(index)
+        else:
+            self.outcomes[index] = self.get_final_outcome(index, outcome)
+            self.complete(self.tests, self.outcomes, index)
+        self.condition.notify_all()
+
+    def serve(self, conn):
+        """
+        Handle the messages from a connected worker until the run finishes
+        or the worker is lost.
+        """
+        name = 'unknown'
+        running = set()
+        try:
+            message = conn.recv()
+            if message[0] != 'hello':
+                raise ValueError('Unexpected message: ' + repr(message))
+            _, name, tool_name, fingerprint = message
+            if tool_name != self.simulator.name:
+                conn.send(('rejected', 'the coordinator uses {0}'.format(
+                    self.simulator.name
+                )))
+                log.error('Rejected worker {0} using {1}'.format(
+                    name,
+                    tool_name
+                ))
+                return
+            if fingerprint != self.fingerprint:
+                conn.send((
+                    'rejected',
+                    'the project sources differ from the coordinator'
+                ))
+                log.error('Rejected worker {0}: '.format(name) +
+                          'the project sources differ from the coordinator')
+                return
+            conn.send(('accepted',))
+            log.info('Worker connected: ' + name)
+            last_message = time.time()
+            while True:
+                if not conn.poll(1.0):
+                    if self.finished:
+                        break
+                    if time.time() - last_message > self.lease_timeout:
+                        raise socket.timeout(
+                            'no message for {0}s'.format(self.lease_timeout)
+                        )
+                    continue
+                message = conn.recv()
+                last_message = time.time()
+                with self.condition:
+                    if message[0] == 'request':
+                        if self.finished:
+                            reply = ('done',)
+                        elif len(self.pending) > 0:
+                            index = self.pending.popleft()
+                            running.add(index)
+                            reply = self.get_test_message(index)
+                        else:
+                            reply = ('wait', 1.0)
+                    elif message[0] == 'result':
+                        _, index, test_id, outcome = message
+                        running.discard(index)
+                        self.add_result(index, test_id, outcome, name)
+                        reply = None
+                    else:
+                        reply = None
+                if reply is not None:
+                    conn.send(reply)
+                    if reply[0] == 'done':
+                        break
+        except (EOFError, OSError, ValueError) as e:
+            log.warning('Lost worker {0}: {1}'.format(name, e))
+        except:
+            log.error('Error serving worker {0}:'.format(name))
+            log.error(traceback.format_exc())
+        finally:
+            with self.condition:
+                # Return unfinished tests to the front of the queue
+                for index in sorted(running, reverse=True):
+                    if index not in self.outcomes:
+                        log.warning(
+                            'Requeueing test: ' + self.tests[index].id()
+                        )
+                        self.pending.appendleft(index)
+                self.condition.notify_all()
+            conn.close()
+
+    def accept(self, listener):
+        """Accept worker connections until the listener is closed."""
+        while not self.finished:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                if self.finished:
+                    break
+                # Failed authentication or a dropped connection attempt
+                log.warning('Worker connection failed:')
+                log.warning(traceback.format_exc())
+                continue
+            thread = threading.Thread(target=self.serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self, suite):
+        """
+        Run the tests in the given *suite* on the connected workers and
+        return a result object. Test outcomes are reported in the order that
+        the tests appear in the suite.
+        """
+        self.tests = list(iterate_tests(suite))
+        self.pending = collections.deque(self.schedule(self.tests))
+        self.outcomes = {}
+        self.attempts = {}
+        self.finished = False
+        result = TimedTestResult(self.verbosity)
+        listener = Listener(self.address, authkey=self.authkey)
+        log.info(
+            'Waiting for workers on {0}:{1} to run {2} test(s)...'.format(
+                self.address[0],
+                listener.address[1],
+                len(self.tests)
+            )
+        )
+        start_time = time.time()
+        thread = threading.Thread(target=self.accept, args=(listener,))
+        thread.daemon = True
+        thread.start()
+        try:
+            with self.condition:
+                while len(self.outcomes) < len(self.tests):
+                    self.condition.wait(1.0)
+        finally:
+            self.finished = True
+            listener.close()
+        # Give the connected workers a chance to request another test so
+        # that they are told that the run is complete.
+        deadline = time.time() + 5
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.time()))
+        for index, test in enumerate(self.tests):
+            self.add_outcome(result, test, self.outcomes[index])
+        log.info(
+            '...{0} test(s) completed in {1:.1f}s'.format(
+                len(self.tests),
+                time.time() - start_time
+            )
+        )
+        return result
+
+
+class _Heartbeat(threading.Thread):
+    """Send heartbeat messages on *conn* until stopped."""
+    def __init__(self, conn, lock, interval):
+        super(_Heartbeat, self).__init__()
+        self.daemon = True
+        self.conn = conn
+        self.lock = lock
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.lock:
+                    self.conn.send(('heartbeat',))
+            except (OSError, EOFError):
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_worker(
+    state,
+    address,
+    authkey,
+    name,
+    heartbeat_interval=10,
+    reconnect_timeout=300
+):
+    """
+    Worker process main function: create the worker from the project
+    *state* (see ParallelTestRunner.get_worker_state) and run tests from the
+    coordinator at *address* until the coordinator reports that the run is
+    complete. If the connection is lost the worker tries to reconnect for up
+    to *reconnect_timeout* seconds.
+    """
+    try:
+        parallel._initialise_worker(state)
+    except:
+        log.error('Worker {0} could not be initialised:'.format(name))
+        log.error(traceback.format_exc())
+        return
+    undelivered = []
+    last_contact = time.time()
+    delay = 1
+    try:
+        while True:
+            try:
+                conn = Client(address, authkey=authkey)
+            except (OSError, EOFError) as e:
+                if time.time() - last_contact > reconnect_timeout:
+                    log.error(
+                        'Worker {0} could not connect to {1}: {2}'.format(
+                            name,
+                            address,
+                            e
+                        )
+                    )
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            lock = threading.Lock()
+            try:
+                conn.send((
+                    'hello',
+                    name,
+                    state['tool_name'],
+                    state['fingerprint']
+                ))
+                reply = conn.recv()
+                if reply[0] == 'rejected':
+                    log.error('Worker {0} rejected: {1}'.format(
+                        name,
+                        reply[1]
+                    ))
+                    return
+                last_contact = time.time()
+                delay = 1
+                while len(undelivered) > 0:
+                    conn.send(undelivered[0])
+                    undelivered.pop(0)
+                while True:
+                    with lock:
+                        conn.send(('request',))
+                    message = conn.recv()
+                    last_contact = time.time()
+                    if message[0] == 'done':
+                        log.info('Worker {0} finished'.format(name))
+                        return
+                    if message[0] == 'wait':
+                        time.sleep(message[1])
+                        continue
+                    _, index, module_path, test_id = message
+                    log.info('Worker {0} running {1}'.format(name, test_id))
+                    heartbeat = _Heartbeat(conn, lock, heartbeat_interval)
+                    heartbeat.start()
+                    try:
+                        outcome = parallel._run_test(
+                            os.path.join(state['root'], module_path),
+                            test_id
+                        )
+                    finally:
+                        heartbeat.stop()
+                    undelivered.append(('result', index, test_id, outcome))
+                    with lock:
+                        conn.send(undelivered[0])
+                    undelivered.pop(0)
+            except (OSError, EOFError) as e:
+                log.warning(
+                    'Worker {0} lost the connection to the coordinator '
+                    '({1}), reconnecting...'.format(name, e)
+                )
+            finally:
+                conn.close()
+    finally:
+        parallel._worker.sandbox.close()
+
+
+def run_workers(project, simulator, address, authkey, jobs=1):
+    """
+    Start *jobs* worker processes that run tests from the coordinator at
+    *address* using the given *project* and *simulator*, and wait for them
+    to finish. The project should have been compiled before the workers are
+    started.
+    """
+    sandbox_root = os.path.join(
+        project.get_simulation_directory(),
+        SimulationSandbox.sandbox_directory_name
+    )
+    if not os.path.exists(sandbox_root):
+        os.makedirs(sandbox_root, exist_ok=True)
+    run_root = tempfile.mkdtemp(prefix='worker_', dir=sandbox_root)
+    state = ParallelTestRunner(project, simulator).get_worker_state(run_root)
+    state['fingerprint'] = get_source_fingerprint(project, simulator.name)
+    jobs = jobs if jobs else (os.cpu_count() or 1)
+    processes = []
+    try:
+        for index in range(jobs):
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(
+                    state,
+                    address,
+                    authkey,
+                    '{0}:{1}'.format(socket.gethostname(), index)
+                )
+            )
+            process.daemon = True
+            process.start()
+            processes.append(process)
+        log.info('Started {0} worker(s) for coordinator {1}:{2}'.format(
+            jobs,
+            address[0],
+            address[1]
+        ))
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        shutil.rmtree(run_root, ignore_errors=True)
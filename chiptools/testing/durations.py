@@ -0,0 +1,269 @@
+"""
+The TestDurationStore keeps a history of the wall time taken by each test
+(simulation plus the Python checks in the test case) so that test runs can
+be scheduled using the expected duration of each test and so that the actual
+duration of a run can be compared against the expected duration.
+"""
+
+import time
+import logging
+
+from chiptools.core.cache import PickleStore
+from chiptools.common import utils
+from chiptools.common import exceptions
+from chiptools.testing.custom_runners import HTMLTestRunner
+
+log = logging.getLogger(__name__)
+
+
+def get_test_details(test):
+    """
+    Return a dictionary of details of the simulation run by the given
+    *test*: the simulator 'return_code' (None if the simulation did not
+    complete) and the 'logs' list of simulator output log files. An empty
+    dictionary is returned for tests that did not run a simulation.
+    """
+    get_log_files = getattr(test, 'get_log_files', None)
+    if get_log_files is None or getattr(test, 'sim_log_path', None) is None:
+        return {}
+    return dict(
+        return_code=getattr(test, 'sim_ret_val', None),
+        logs=get_log_files()
+    )
+
+
+def truncate_outcome(outcome, max_output=None):
+    """
+    Return the *outcome* tuple of (result code, output, error, duration,
+    details) with the output and error truncated to *max_output* characters
+    each. The *outcome* is returned unchanged if *max_output* is None.
+    """
+    if max_output is None:
+        return outcome
+    code, output, error, duration, details = outcome
+    return (
+        code,
+        utils.truncate_text(output, max_output),
+        utils.truncate_text(error, max_output),
+        duration,
+        details
+    )
+
+
+class TimedTestResult(HTMLTestRunner._TestResult):
+    """
+    A TimedTestResult is an HTMLTestRunner result that also records the
+    duration of each test in the *durations* dictionary of test ID : seconds.
+    Tests that raised an ExecutionTimeout are reported as errors and are
+    also added to the *timeouts* list.
+
+    When each test completes its outcome tuple of (result code, output,
+    error, duration, details) is stored in the *outcomes* dictionary and
+    passed to the *add_test* method of each of the given *writers*, so that
+    results can be written as the tests complete.
+
+    If *max_output* is given the outputs and errors kept by the result are
+    truncated to *max_output* characters once they have been passed to the
+    writers, so that the memory used by a long run does not grow with the
+    test output.
+
+    If a *retry_policy* is given (see *chiptools.testing.retry*) tests that
+    the policy retries are withdrawn from the result when they complete and
+    added to the *retry_queue* list, the caller is responsible for running
+    them again.
+    """
+    def __init__(
+        self,
+        verbosity=1,
+        writers=(),
+        max_output=None,
+        retry_policy=None
+    ):
+        super(TimedTestResult, self).__init__(verbosity)
+        self.durations = {}
+        self.timeouts = []
+        self.outcomes = {}
+        self.writers = list(writers)
+        self.max_output = max_output
+        self.retry_policy = retry_policy
+        # Test ID : failure classification of each retried attempt
+        self.attempts = {}
+        self.retry_queue = []
+        self.start_time = None
+
+    def addError(self, test, err):
+        super(TimedTestResult, self).addError(test, err)
+        if issubclass(err[0], exceptions.ExecutionTimeout):
+            self.timeouts.append(test)
+
+    def startTest(self, test):
+        self.start_time = time.time()
+        super(TimedTestResult, self).startTest(test)
+
+    def stopTest(self, test):
+        super(TimedTestResult, self).stopTest(test)
+        duration = 0
+        if self.start_time is not None:
+            duration = time.time() - self.start_time
+            self.durations[test.id()] = duration
+            self.start_time = None
+        outcome = self.get_outcome(test, duration)
+        if outcome is not None:
+            if self.retry_policy is not None:
+                failures = self.attempts.setdefault(test.id(), [])
+                if self.retry_policy.retry(test, outcome, failures):
+                    self.withdraw(test)
+                    self.retry_queue.append(test)
+                    return
+                outcome = self.retry_policy.get_outcome(outcome, failures)
+            self.outcomes[test.id()] = outcome
+            for writer in self.writers:
+                writer.add_test(test, outcome)
+            if self.max_output is not None:
+                self.truncate_outputs(test)
+
+    def withdraw(self, test):
+        """
+        Remove the result of the *test* that has just completed so that it
+        can be run again.
+        """
+        code, _, output, error = self.result.pop()
+        if code == 0:
+            self.success_count -= 1
+        elif code == 1:
+            self.failure_count -= 1
+            self.failures.pop()
+        else:
+            self.error_count -= 1
+            self.errors.pop()
+        if len(self.timeouts) > 0 and self.timeouts[-1] is test:
+            self.timeouts.pop()
+        self.testsRun -= 1
+
+    def truncate_outputs(self, test):
+        """
+        Truncate the output and error stored for the *test* that has just
+        completed to *max_output* characters.
+        """
+        test_id = test.id()
+        if test_id in self.outcomes:
+            self.outcomes[test_id] = truncate_outcome(
+                self.outcomes[test_id],
+                self.max_output
+            )
+        if len(self.result) > 0 and self.result[-1][1] is test:
+            code, _, output, error = self.result[-1]
+            self.result[-1] = (
+                code,
+                test,
+                utils.truncate_text(output, self.max_output),
+                utils.truncate_text(error, self.max_output)
+            )
+        for results in [self.failures, self.errors]:
+            if len(results) > 0 and results[-1][0] is test:
+                results[-1] = (
+                    test,
+                    utils.truncate_text(results[-1][1], self.max_output)
+                )
+
+    def get_outcome(self, test, duration):
+        """
+        Return the outcome tuple of the *test* that has just completed, or
+        None if no outcome was recorded for it.
+        """
+        # Imported here as the parallel module imports this module.
+        from chiptools.testing import parallel
+        details = get_test_details(test)
+        if len(self.skipped) > 0 and self.skipped[-1][0] is test:
+            return (
+                parallel.RESULT_SKIP,
+                'Skipped: {0}\n'.format(self.skipped[-1][1]),
+                '',
+                duration,
+                details
+            )
+        if len(self.result) == 0 or self.result[-1][1] is not test:
+            return None
+        code, _, output, error = self.result[-1]
+        if len(self.timeouts) > 0 and self.timeouts[-1] is test:
+            code = parallel.RESULT_TIMEOUT
+        return (code, output, error, duration, details)
+
+
+class TestDurationStore(PickleStore):
+    """
+    A TestDurationStore stores the most recent durations of each test, keyed
+    by test ID.
+    """
+    cache_file_name = '_durations.cache'
+    store_name = 'test duration store'
+    # Number of durations kept for each test
+    history_length = 10
+
+    def add_duration(self, test_id, duration):
+        """
+        Add the *duration* in seconds of a run of the test given by *test_id*
+        to the history.
+        """
+        history = self.cache.setdefault(test_id, [])
+        history.append(duration)
+        del history[:-self.history_length]
+
+    def get_expected_duration(self, test_id):
+        """
+        Return the expected duration in seconds of the test given by
+        *test_id*: the mean of its recorded durations, or None if the test
+        has no history.
+        """
+        history = self.cache.get(test_id, [])
+        if len(history) == 0:
+            return None
+        return sum(history) / len(history)
+
+    def get_expected_durations(self, test_ids):
+        """
+        Return a dictionary of test ID : expected duration for each of the
+        given *test_ids* that have a history.
+        """
+        result = {}
+        for test_id in test_ids:
+            expected = self.get_expected_duration(test_id)
+            if expected is not None:
+                result[test_id] = expected
+        return result
+
+    def report(self, durations, expected):
+        """
+        Log a comparison of the actual *durations* of a test run against the
+        *expected* durations (both dictionaries of test ID : seconds). Tests
+        that took more than twice as long as expected are reported as
+        warnings.
+        """
+        for test_id in sorted(durations.keys()):
+            if test_id not in expected:
+                log.debug('{0}: {1:.1f}s (no history)'.format(
+                    test_id,
+                    durations[test_id]
+                ))
+                continue
+            message = '{0}: {1:.1f}s (expected {2:.1f}s)'.format(
+                test_id,
+                durations[test_id],
+                expected[test_id]
+            )
+            if durations[test_id] > 2 * expected[test_id] + 1:
+                log.warning('Test took longer than expected: ' + message)
+            else:
+                log.debug(message)
+        known = [test_id for test_id in durations if test_id in expected]
+        if len(known) > 0:
+            log.info(
+                'Test time: {0:.1f}s, expected {1:.1f}s '.format(
+                    sum(durations[test_id] for test_id in known),
+                    sum(expected[test_id] for test_id in known)
+                ) +
+                'for {0} of {1} test(s) with history'.format(
+                    len(known),
+                    len(durations)
+                )
+            )
@@ -0,0 +1,53 @@
+"""
+The LastRunStore records the most recent outcome of each test so that a
+test run can be limited to the tests that failed in the previous run, or can
+start with them.
+
+Outcomes are keyed by test ID (module, class and method names) so that the
+store remains valid when tests are added to or removed from the project. The
+outcome of a test is only replaced when the test is run again, a test that
+is not selected by a run keeps its previous outcome.
+"""
+
+import logging
+
+from chiptools.core.cache import PickleStore
+from chiptools.testing.parallel import RESULT_FAIL
+from chiptools.testing.parallel import RESULT_ERROR
+from chiptools.testing.parallel import RESULT_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+
+class LastRunStore(PickleStore):
+    """
+    A LastRunStore stores a dictionary of test ID : result code (see
+    *chiptools.testing.parallel*) of the most recent run of each test.
+    """
+    cache_file_name = '_last_run.cache'
+    store_name = 'last run store'
+    # Result codes of tests that are considered to have failed
+    failed_codes = [RESULT_FAIL, RESULT_ERROR, RESULT_TIMEOUT]
+
+    def add_outcome(self, test_id, code):
+        """
+        Record the result *code* of the latest run of the test given by
+        *test_id*.
+        """
+        self.cache[test_id] = code
+
+    def is_failed(self, test_id):
+        """
+        Return True if the test given by *test_id* failed, raised an error or
+        timed out when it was last run.
+        """
+        return self.cache.get(test_id, None) in self.failed_codes
+
+    def get_failed(self):
+        """
+        Return the sorted list of test IDs that failed when they were last
+        run.
+        """
+        return sorted(
+            test_id for test_id in self.cache if self.is_failed(test_id)
+        )
@@ -0,0 +1,456 @@
+"""
+The ParallelTestRunner runs ChipToolsTest cases in a pool of worker
+processes. Each worker recreates the Project from a picklable snapshot, opens
+a SimulationSandbox for the selected simulator and then imports and runs the
+test cases that it is given inside the sandbox. The outcome of each test is
+sent back to the parent process and collected into a single result that can
+be passed to a report generator such as the HTMLTestRunner.
+
+When the expected durations of the tests are known they are scheduled
+longest first so that long running tests do not delay the end of the run.
+Tests are submitted to the pool one at a time as workers become idle, and a
+worker that completes a test is given the next waiting test that simulates
+the same top level with the same generics, if there is one. The worker can
+then reuse the design that it has elaborated (and its warm simulator session)
+instead of elaborating another design, while the other workers elaborate
+different designs in parallel.
+"""
+
+import os
+import time
+import shutil
+import inspect
+import logging
+import datetime
+import tempfile
+import traceback
+import unittest
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from chiptools.core.sandbox import SimulationSandbox
+from chiptools.testing import testloader
+from chiptools.testing.durations import TimedTestResult
+from chiptools.testing.durations import truncate_outcome
+
+log = logging.getLogger(__name__)
+
+# Result codes used by the HTMLTestRunner result tuples
+RESULT_PASS = 0
+RESULT_FAIL = 1
+RESULT_ERROR = 2
+# Skipped tests are reported as passes
+RESULT_SKIP = 3
+# Tests that timed out are reported as errors
+RESULT_TIMEOUT = 4
+
+# Per-process state of a worker, set by _initialise_worker
+_worker = None
+
+
+class _Worker:
+    """
+    Runtime state of a test worker process: the recreated Project, the
+    simulator wrapper and the sandbox that tests are executed in.
+    """
+    def __init__(self, state):
+        # Imported here as the Project imports this module.
+        from chiptools.core.project import Project
+        self.project = Project()
+        # The compilation cache identifies the compiled design, which is used
+        # to match elaborated designs.
+        self.project.set_cache_path(state['cache_path'])
+        self.project.root = state['root']
+        self.project.config = state['config']
+        self.project.project_data = state['project_data']
+        self.project.file_list = state['file_list']
+        self.project.generics = state['generics']
+        self.includes = state['includes']
+        simulator = self.project.tool_wrapper.get_tool(
+            tool_type='simulation',
+            tool_name=state['tool_name']
+        )
+        self.sandbox = SimulationSandbox(
+            simulator,
+            root=state['sandbox_root'],
+            name='worker{0}'.format(os.getpid())
+        ).create()
+        self.modules = {}
+
+    def get_test(self, module_path, test_id):
+        """
+        Return the test case with the given *test_id* from the test module
+        at *module_path*, importing the module if required.
+        """
+        if module_path not in self.modules:
+            suite = testloader.load_tests(
+                module_path,
+                self.sandbox.path,
+                simulation_libraries=self.includes
+            )
+            self.modules[module_path] = {
+                test.id(): test for test in iterate_tests(suite)
+            }
+        test = self.modules[module_path][test_id]
+        # Tests are instantiated once per module import, create a fresh
+        # instance so that state does not leak between runs.
+        parameters = getattr(test, 'parameters', None)
+        if parameters is None:
+            test = test.__class__(test._testMethodName)
+        else:
+            test = test.__class__(test._testMethodName, parameters=parameters)
+        test.postImport(
+            self.includes,
+            self.sandbox.path,
+            self.sandbox.simulator,
+        )
+        return test
+
+    def close(self):
+        """Close the warm simulator session of the worker, if any."""
+        self.sandbox.simulator.close_session()
+
+
+def iterate_tests(suite):
+    """
+    Return a generator yielding each test case in the (possibly nested)
+    *suite*.
+    """
+    if suite is None:
+        return
+    if isinstance(suite, unittest.TestCase):
+        yield suite
+        return
+    for item in suite:
+        for test in iterate_tests(item):
+            yield test
+
+
+def _initialise_worker(state):
+    """Process pool initialiser: create the worker state."""
+    global _worker
+    _worker = _Worker(state)
+    # Warm simulator sessions are closed when the worker process exits.
+    multiprocessing.util.Finalize(_worker, _worker.close, exitpriority=10)
+
+
+def _run_test(module_path, test_id):
+    """
+    Run a single test in the worker process and return a tuple of
+    (result code, output, error string, duration in seconds, details), where
+    *details* is a dictionary of the simulator return code and log files
+    (see *durations.get_test_details*).
+    """
+    start_time = time.time()
+    try:
+        test = _worker.get_test(module_path, test_id)
+        result = TimedTestResult(verbosity=1)
+        test(result)
+    except:
+        return (RESULT_ERROR, '', traceback.format_exc(),
+                time.time() - start_time, {})
+    if test_id not in result.outcomes:
+        return (RESULT_ERROR, '', 'The test did not report a result.',
+                time.time() - start_time, {})
+    return result.outcomes[test_id]
+
+
+class ParallelTestRunner:
+    """
+    A ParallelTestRunner runs the test cases of a suite concurrently in
+    *jobs* worker processes, using the given *project* and *simulator* (a
+    Simulator instance) to configure the workers. Each worker runs its tests
+    in a private simulation sandbox. The *run* method returns a result object
+    compatible with the HTMLTestRunner report generator.
+    The optional *durations* dictionary of test ID : expected duration in
+    seconds is used to schedule the longest tests first.
+    The outcome of each test is passed to the *add_test* method of each of
+    the given *writers* as soon as the test completes. If *max_output* is
+    given the outputs kept for the result object are then truncated to
+    *max_output* characters.
+    Tests with an ID in the optional *priority* set are started before the
+    other tests.
+    Tests that do not pass are run again as allowed by the optional
+    *retry_policy* (see *chiptools.testing.retry*), retried tests are put
+    back into the queue of tests waiting for a worker.
+    """
+    def __init__(
+        self,
+        project,
+        simulator,
+        jobs=None,
+        verbosity=1,
+        durations=None,
+        writers=(),
+        max_output=None,
+        priority=None,
+        retry_policy=None
+    ):
+        self.project = project
+        self.simulator = simulator
+        self.jobs = jobs if jobs else (os.cpu_count() or 1)
+        self.verbosity = verbosity
+        self.durations = durations if durations is not None else {}
+        self.writers = list(writers)
+        self.max_output = max_output
+        self.priority = priority if priority is not None else set()
+        self.retry_policy = retry_policy
+        # Test index : failure classification of each retried attempt
+        self.attempts = {}
+
+    def get_worker_state(self, sandbox_root):
+        """
+        Return a picklable dictionary describing the project, used by the
+        worker processes to recreate it.
+        """
+        return dict(
+            root=self.project.root,
+            cache_path=self.project.cache_path,
+            config=self.project.config,
+            project_data=self.project.get_libraries(),
+            file_list=self.project.get_files(),
+            generics=self.project.get_generics(),
+            includes=self.project.get_simulator_library_dependencies(
+                self.simulator
+            ),
+            tool_name=self.simulator.name,
+            sandbox_root=sandbox_root,
+        )
+
+    def schedule(self, tests):
+        """
+        Return the indices of the given list of *tests* in the order that
+        they should be started: priority tests first, then longest expected
+        duration first. Tests without a duration history may be long running
+        so they are started before the others, in suite order.
+        """
+        def key(index):
+            test_id = tests[index].id()
+            first = 0 if test_id in self.priority else 1
+            expected = self.durations.get(test_id, None)
+            if expected is None:
+                return (first, 0, 0)
+            return (first, 1, -expected)
+        return sorted(range(len(tests)), key=key)
+
+    @staticmethod
+    def get_design(test):
+        """
+        Return a key identifying the design simulated by the given *test*:
+        its top level library and entity and its generics.
+        """
+        generics = getattr(test, 'generics', None) or {}
+        return (
+            str(getattr(test, 'library', '')).lower(),
+            str(getattr(test, 'entity', '')).lower(),
+            tuple(sorted((str(k), str(v)) for k, v in generics.items())),
+        )
+
+    def take_next(self, tests, pending, running, design=None):
+        """
+        Remove and return the index of the next test to start from the
+        *pending* list of test indices, in schedule order. A test that
+        simulates the given *design* (the design of the test that the idle
+        worker has just run) is preferred, then a test whose design is not
+        simulated by any of the *running* test indices.
+        """
+        if design is not None:
+            for position, index in enumerate(pending):
+                if self.get_design(tests[index]) == design:
+                    return pending.pop(position)
+        busy = set(self.get_design(tests[index]) for index in running)
+        for position, index in enumerate(pending):
+            if self.get_design(tests[index]) not in busy:
+                return pending.pop(position)
+        return pending.pop(0)
+
+    def run(self, suite):
+        """
+        Run the tests in the given *suite* and return a result object. Test
+        outcomes are reported in the order that the tests appear in the
+        suite.
+        """
+        tests = list(iterate_tests(suite))
+        result = TimedTestResult(self.verbosity)
+        outcomes = {}
+        self.attempts = {}
+        sandbox_root = os.path.join(
+            self.project.get_simulation_directory(),
+            SimulationSandbox.sandbox_directory_name
+        )
+        if not os.path.exists(sandbox_root):
+            os.makedirs(sandbox_root, exist_ok=True)
+        # All worker sandboxes are created inside a directory owned by this
+        # run so that they can be removed together.
+        run_root = tempfile.mkdtemp(prefix='run_', dir=sandbox_root)
+        log.info(
+            'Running {0} test(s) using {1} worker(s)...'.format(
+                len(tests),
+                self.jobs
+            )
+        )
+        start_time = time.time()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=_initialise_worker,
+                initargs=(self.get_worker_state(run_root),)
+            ) as executor:
+                futures = {}
+                pending = self.schedule(tests)
+
+                def submit(design=None):
+                    index = self.take_next(
+                        tests,
+                        pending,
+                        futures.values(),
+                        design
+                    )
+                    future = executor.submit(
+                        _run_test,
+                        inspect.getfile(tests[index].__class__),
+                        tests[index].id()
+                    )
+                    futures[future] = index
+
+                # Only one test per worker is submitted so that each idle
+                # worker takes the test chosen for it.
+                while len(futures) < self.jobs and len(pending) > 0:
+                    submit()
+                while len(futures) > 0:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = futures.pop(future)
+                        try:
+                            outcome = future.result()
+                        except:
+                            outcome = (
+                                RESULT_ERROR,
+                                '',
+                                traceback.format_exc(),
+                                0,
+                                {}
+                            )
+                        design = self.get_design(tests[index])
+                        if self.retry(tests[index], index, outcome):
+                            # Queue the test behind the tests already waiting
+                            pending.append(index)
+                            design = None
+                        else:
+                            outcomes[index] = self.get_final_outcome(
+                                index,
+                                outcome
+                            )
+                            self.complete(tests, outcomes, index)
+                        if len(pending) > 0:
+                            submit(design)
+        finally:
+            shutil.rmtree(run_root, ignore_errors=True)
+        for index, test in enumerate(tests):
+            self.add_outcome(result, test, outcomes[index])
+        log.info(
+            '...{0} test(s) completed in {1}'.format(
+                len(tests),
+                datetime.timedelta(seconds=int(time.time() - start_time))
+            )
+        )
+        return result
+
+    def retry(self, test, index, outcome):
+        """
+        Return True if the *test* at *index* should be run again after an
+        attempt with the given *outcome*, as allowed by the retry policy.
+        """
+        if self.retry_policy is None:
+            return False
+        return self.retry_policy.retry(
+            test,
+            outcome,
+            self.attempts.setdefault(index, [])
+        )
+
+    def get_final_outcome(self, index, outcome):
+        """
+        Return the *outcome* of the final attempt of the test at *index*
+        with the retry details added (see *RetryPolicy.get_outcome*).
+        """
+        if self.retry_policy is None:
+            return outcome
+        return self.retry_policy.get_outcome(
+            outcome,
+            self.attempts.get(index, [])
+        )
+
+    def complete(self, tests, outcomes, index):
+        """
+        Write and report the outcome of the completed test at *index* of the
+        *tests* list, then truncate the outcome kept in *outcomes*.
+        """
+        self.write_outcome(tests[index], outcomes[index])
+        self.report_progress(
+            tests[index],
+            outcomes[index],
+            len(outcomes),
+            len(tests)
+        )
+        outcomes[index] = truncate_outcome(outcomes[index], self.max_output)
+
+    def write_outcome(self, test, outcome):
+        """
+        Pass the *outcome* of a completed *test* to the result writers.
+        """
+        for writer in self.writers:
+            try:
+                writer.add_test(test, outcome)
+            except:
+                log.error(traceback.format_exc())
+
+    def report_progress(self, test, outcome, completed, total):
+        """
+        Log the *outcome* of a completed *test*.
+        """
+        code, output, error, duration, details = outcome
+        status = ['pass', 'FAIL', 'ERROR', 'skip', 'TIMEOUT'][code]
+        expected = self.durations.get(test.id(), None)
+        message = '[{0}/{1}] {2} {3} ({4:.1f}s{5})'.format(
+            completed,
+            total,
+            status,
+            test.id(),
+            duration,
+            '' if expected is None else ', expected {0:.1f}s'.format(
+                expected
+            )
+        )
+        if code in [RESULT_PASS, RESULT_SKIP]:
+            log.info(message)
+        else:
+            log.error(message)
+
+    @staticmethod
+    def add_outcome(result, test, outcome):
+        """
+        Add the *outcome* tuple of a *test* to the HTMLTestRunner *result*.
+        """
+        code, output, error, duration, details = outcome
+        if hasattr(result, 'durations'):
+            result.durations[test.id()] = duration
+        if hasattr(result, 'outcomes'):
+            result.outcomes[test.id()] = outcome
+        if code == RESULT_SKIP:
+            result.skipped.append((test, output))
+            code = RESULT_PASS
+        elif code == RESULT_TIMEOUT:
+            if hasattr(result, 'timeouts'):
+                result.timeouts.append(test)
+            code = RESULT_ERROR
+        if code == RESULT_PASS:
+            result.success_count += 1
+        elif code == RESULT_FAIL:
+            result.failure_count += 1
+            result.failures.append((test, error))
+        else:
+            result.error_count += 1
+            result.errors.append((test, error))
+        result.testsRun += 1
+        result.result.append((code, test, output, error))
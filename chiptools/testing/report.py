@@ -0,0 +1,257 @@
+"""
+Streaming HTML test reports.
+
+The HTMLTestRunner report is generated from the complete test result once a
+run has finished, so every test output is held in memory and inlined into the
+report. The *HTMLReportWriter* is a result writer (see
+*chiptools.testing.results*) that instead writes a row to the report as each
+test completes:
+
+    * Test outputs longer than *max_output* characters are truncated, the
+      simulator output is linked to the test log files rather than inlined.
+    * Test outputs are collapsed and can be expanded for each test.
+    * Rows can be filtered by test class and by status, a summary of each
+      class is written when the run completes.
+
+Only the per-class totals are kept in memory, so the memory used does not
+grow with the test output. A report of an interrupted run contains the rows
+of the tests that completed.
+"""
+
+import os
+import datetime
+from urllib.request import pathname2url
+from xml.sax import saxutils
+
+from chiptools.common import utils
+from chiptools.testing import testloader
+from chiptools.testing.parallel import RESULT_PASS
+from chiptools.testing.parallel import RESULT_FAIL
+from chiptools.testing.parallel import RESULT_ERROR
+from chiptools.testing.parallel import RESULT_SKIP
+from chiptools.testing.parallel import RESULT_TIMEOUT
+
+# Status names and row styles of each result code
+STATUS = {
+    RESULT_PASS: 'pass',
+    RESULT_FAIL: 'fail',
+    RESULT_ERROR: 'error',
+    RESULT_SKIP: 'skip',
+    RESULT_TIMEOUT: 'timeout',
+}
+
+HEADER_TMPL = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="UTF-8"/>
+<title>%(title)s</title>
+<style type="text/css">
+body { font-family: verdana, arial, helvetica, sans-serif; font-size: 80%%; }
+h1 { font-size: 16pt; color: gray; }
+table { border-collapse: collapse; border: 1px solid #777; width: 90%%; }
+td, th { border: 1px solid #777; padding: 2px 4px; vertical-align: top; }
+th { color: white; background-color: #777; text-align: left; }
+pre { font-family: "Lucida Console", "Courier New", monospace;
+      font-size: 8pt; background-color: #E6E6D6; padding: 4px;
+      white-space: pre-wrap; }
+.pass { color: #393; }
+.skip { color: #777; }
+.fail { color: #c60; font-weight: bold; }
+.error, .timeout { color: #c00; font-weight: bold; }
+</style>
+<script type="text/javascript">
+/* Show the rows of the given test class (all classes if empty) and status
+   ('failed' shows failures, errors and timeouts, empty shows all). */
+function filterRows(cls, status) {
+    var rows = document.getElementsByClassName('test');
+    for (var i = 0; i < rows.length; i++) {
+        var row = rows[i];
+        var show = (cls == '' || row.getAttribute('data-class') == cls);
+        if (status == 'failed') {
+            var s = row.getAttribute('data-status');
+            show = show && (s == 'fail' || s == 'error' || s == 'timeout');
+        }
+        row.style.display = show ? '' : 'none';
+    }
+}
+</script>
+</head>
+<body>
+<h1>%(title)s</h1>
+<p><strong>Start Time:</strong> %(start)s</p>
+<p>Show <a href="javascript:filterRows('', '')">All</a>
+<a href="javascript:filterRows('', 'failed')">Failed</a></p>
+<table id="result_table">
+<tr><th>#</th><th>Test</th><th>Status</th><th>Duration</th>
+<th>Return Code</th><th>Details</th></tr>
+"""
+
+ROW_TMPL = """<tr class="test" data-class=%(cls)s data-status="%(status)s">
+<td>%(index)s</td>
+<td>%(cls_name)s.<strong>%(name)s</strong>%(desc)s</td>
+<td class="%(status)s">%(status)s%(cached)s%(attempts)s</td>
+<td>%(duration).1fs</td>
+<td>%(return_code)s</td>
+<td>%(logs)s%(output)s</td>
+</tr>
+"""
+
+SUMMARY_TMPL = """</table>
+<h2>Summary</h2>
+<p><strong>Stop Time:</strong> %(stop)s<br/>
+<strong>Duration:</strong> %(duration)s<br/>
+<strong>Status:</strong> %(status)s</p>
+<table id="summary_table">
+<tr><th>Test Class</th><th>Count</th><th>Pass</th><th>Fail</th>
+<th>Error</th><th>Skip</th><th>Timeout</th><th>View</th></tr>
+%(rows)s</table>
+</body>
+</html>
+"""
+
+SUMMARY_ROW_TMPL = """<tr><td>%(cls_name)s%(doc)s</td><td>%(count)s</td>
+<td>%(pass)s</td><td>%(fail)s</td><td>%(error)s</td><td>%(skip)s</td>
+<td>%(timeout)s</td>
+<td><a href=%(show_all)s>All</a> <a href=%(show_failed)s>Failed</a></td></tr>
+"""
+
+
+class HTMLReportWriter:
+    """
+    An HTMLReportWriter writes an HTML report to *path* as each test
+    completes. Test outputs and errors are truncated to *max_output*
+    characters and the simulator output log files of each test are linked
+    from the report.
+    """
+    max_output = 10000
+
+    def __init__(self, path, title='Unit Test Report', max_output=None):
+        self.path = path
+        self.title = title
+        if max_output is not None:
+            self.max_output = max_output
+        self.stream = None
+        self.start_time = None
+        self.count = 0
+        # Test class name : (class docstring, {status : count})
+        self.classes = {}
+
+    def write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def start(self):
+        """Open the report and write the header."""
+        self.stream = open(self.path, 'w')
+        self.start_time = datetime.datetime.now()
+        self.count = 0
+        self.classes = {}
+        self.write(HEADER_TMPL % dict(
+            title=saxutils.escape(self.title),
+            start=str(self.start_time)[:19],
+        ))
+
+    def get_link(self, path):
+        """
+        Return a link to the file at *path*, relative to the report if
+        possible.
+        """
+        try:
+            target = os.path.relpath(
+                path,
+                os.path.dirname(os.path.abspath(self.path))
+            )
+        except ValueError:
+            # Paths on different drives cannot be made relative
+            target = os.path.abspath(path)
+        return '<a href={0}>{1}</a>'.format(
+            saxutils.quoteattr(pathname2url(target)),
+            saxutils.escape(os.path.basename(path))
+        )
+
+    def add_test(self, test, outcome, cached=False):
+        """
+        Write the *outcome* tuple of (result code, output, error, duration,
+        details) of the given *test* as a row of the report.
+        """
+        code, output, error, duration, details = outcome
+        status = STATUS.get(code, 'error')
+        cls = test.__class__
+        cls_name = '{0}.{1}'.format(cls.__module__, cls.__name__)
+        doc, counts = self.classes.setdefault(
+            cls_name,
+            ((cls.__doc__ or '').strip().split('\n')[0], {})
+        )
+        counts[status] = counts.get(status, 0) + 1
+        self.count += 1
+        text = (output or '') + (error or '')
+        if len(text) > 0:
+            text = (
+                '<details><summary>Output</summary><pre>{0}</pre>' +
+                '</details>'
+            ).format(
+                saxutils.escape(utils.truncate_text(text, self.max_output))
+            )
+        description = test.shortDescription()
+        return_code = details.get('return_code', None)
+        self.write(ROW_TMPL % dict(
+            index=self.count,
+            cls=saxutils.quoteattr(cls_name),
+            cls_name=saxutils.escape(cls_name),
+            name=saxutils.escape(testloader.split_test_id(test.id())[1]),
+            desc='' if not description else '<br/>' + saxutils.escape(
+                description
+            ),
+            status=status,
+            cached=' (cached)' if cached else '',
+            attempts='' if details.get('attempts', 1) == 1 else (
+                '<br/>{0} after {1} attempts'.format(
+                    'flaky' if details.get('flaky', False) else 'retried',
+                    details['attempts']
+                )
+            ),
+            duration=duration,
+            return_code='' if return_code is None else return_code,
+            logs=' '.join(
+                self.get_link(path) for path in details.get('logs', [])
+            ),
+            output=text,
+        ))
+
+    def stop(self):
+        """Write the summary of each test class and close the report."""
+        stop_time = datetime.datetime.now()
+        rows = []
+        totals = {}
+        for cls_name in sorted(self.classes.keys()):
+            doc, counts = self.classes[cls_name]
+            for status, count in counts.items():
+                totals[status] = totals.get(status, 0) + count
+            rows.append(SUMMARY_ROW_TMPL % dict(
+                cls_name=saxutils.escape(cls_name),
+                doc='' if not doc else ': ' + saxutils.escape(doc),
+                count=sum(counts.values()),
+                show_all=saxutils.quoteattr(
+                    'javascript:filterRows({0!r}, \'\')'.format(cls_name)
+                ),
+                show_failed=saxutils.quoteattr(
+                    'javascript:filterRows({0!r}, \'failed\')'.format(
+                        cls_name
+                    )
+                ),
+                **dict(
+                    (status, counts.get(status, 0))
+                    for status in STATUS.values()
+                )
+            ))
+        self.write(SUMMARY_TMPL % dict(
+            stop=str(stop_time)[:19],
+            duration=str(stop_time - self.start_time),
+            status=' '.join(
+                '{0} {1}'.format(status.capitalize(), totals[status])
+                for status in STATUS.values() if status in totals
+            ) or 'none',
+            rows=''.join(rows),
+        ))
+        self.stream.close()
+        self.stream = None
@@ -0,0 +1,152 @@
+"""
+The TestResultCache records the tests that passed together with a
+fingerprint of everything that the test outcome depends on, so that a test
+can be skipped when it is run again with unchanged inputs.
+
+A test fingerprint covers:
+
+    * The compiled state of the design files that the test top level depends
+      on (or the whole design if the dependencies cannot be determined).
+    * The source of the test module and of the helper modules that it
+      imports, excluding the standard library, installed packages and
+      ChipTools itself.
+    * The test ID, top level library and entity, generics and duration.
+    * The simulator name and the simulation library dependencies.
+    * The compile and simulate tool arguments set in the project and on the
+      design files.
+    * The contents of the files listed in the test *stimulus_files*.
+"""
+
+import os
+import sys
+import types
+import hashlib
+import inspect
+import logging
+import sysconfig
+
+from chiptools.core.cache import PickleStore
+
+log = logging.getLogger(__name__)
+
+
+class TestResultCache(PickleStore):
+    """
+    A TestResultCache stores a dictionary of test ID : fingerprint for each
+    test that passed.
+    """
+    cache_file_name = '_results.cache'
+    store_name = 'test result cache'
+
+    @staticmethod
+    def md5(path):
+        """
+        Return the MD5 sum of the file at *path* or None if it cannot be
+        read.
+        """
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.md5(f.read()).hexdigest()
+        except (IOError, OSError):
+            return None
+
+    @staticmethod
+    def get_helper_paths(module):
+        """
+        Return a sorted list of the source paths of the modules imported,
+        directly or through other helper modules, by the given test
+        *module*. Modules of the standard library, installed packages and
+        ChipTools are not included.
+        """
+        excluded = [os.path.dirname(os.path.dirname(os.path.abspath(
+            __file__
+        )))]
+        for name in ['stdlib', 'platstdlib', 'purelib', 'platlib']:
+            path = sysconfig.get_paths().get(name, None)
+            if path is not None:
+                excluded.append(os.path.abspath(path))
+        excluded = [os.path.normcase(path) + os.sep for path in excluded]
+        paths = set()
+        pending = [module]
+        seen = set([module.__name__])
+        while len(pending) > 0:
+            for value in list(vars(pending.pop()).values()):
+                if isinstance(value, types.ModuleType):
+                    imported = value
+                else:
+                    # Functions and classes imported from helper modules
+                    name = getattr(value, '__module__', None)
+                    if not isinstance(name, str):
+                        continue
+                    imported = sys.modules.get(name, None)
+                if imported is None or imported.__name__ in seen:
+                    continue
+                seen.add(imported.__name__)
+                path = getattr(imported, '__file__', None)
+                if path is None or not path.endswith('.py'):
+                    continue
+                path = os.path.abspath(path)
+                if any(
+                    os.path.normcase(path).startswith(root)
+                    for root in excluded
+                ):
+                    continue
+                paths.add(path)
+                pending.append(imported)
+        return sorted(paths)
+
+    @staticmethod
+    def get_fingerprint(test, design_fingerprint, tool_arguments=''):
+        """
+        Return the fingerprint of the given ChipToolsTest *test* instance,
+        using the *design_fingerprint* string to identify the compiled
+        design and the *tool_arguments* string to identify the compile and
+        simulate arguments.
+        """
+        module_path = inspect.getfile(test.__class__)
+        module_root = os.path.dirname(os.path.abspath(module_path))
+        simulator = getattr(test, 'simulator', None)
+        libraries = getattr(test, 'simulation_libraries', {}) or {}
+        items = [
+            design_fingerprint,
+            test.id(),
+            TestResultCache.md5(module_path),
+            str(test.library),
+            str(test.entity),
+            str(test.duration),
+            repr(sorted((str(k), str(v)) for k, v in test.generics.items())),
+            None if simulator is None else simulator.name,
+            repr(sorted((str(k), str(v)) for k, v in libraries.items())),
+            tool_arguments,
+        ]
+        module = inspect.getmodule(test.__class__)
+        if module is not None:
+            for path in TestResultCache.get_helper_paths(module):
+                items.append(path)
+                items.append(TestResultCache.md5(path))
+        for path in test.stimulus_files:
+            path = os.path.join(module_root, path)
+            items.append(path)
+            items.append(TestResultCache.md5(path))
+        digest = hashlib.sha1()
+        for item in items:
+            digest.update('{0}\n'.format(item).encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_passed(self, test_id, fingerprint):
+        """
+        Return True if the test given by *test_id* passed with the given
+        *fingerprint*.
+        """
+        return self.cache.get(test_id, None) == fingerprint
+
+    def add_result(self, test_id, fingerprint, passed):
+        """
+        Record the outcome of the test given by *test_id*. Passing tests are
+        stored with their *fingerprint*, other outcomes remove the test from
+        the cache.
+        """
+        if passed:
+            self.cache[test_id] = fingerprint
+        elif test_id in self.cache:
+            del self.cache[test_id]
@@ -0,0 +1,600 @@
+"""
+Test result files and sharding.
+
+A test run can be split into shards that run on different machines. Each
+shard selects a deterministic subset of the tests using *select_shard* and
+writes its outcomes to a result file. The result files of all shards can
+then be combined into a single report using *merge_results*.
+
+Shards hold the same number of tests unless a shared duration history (the
+result files of an earlier run, see *read_durations*) is given to every
+shard, the local duration history of each machine is not used because the
+machines would disagree on the assignment. Each shard records a fingerprint
+of its shard plan (the selected tests, the shard count and the duration
+history) and the tests assigned to it, *merge_results* uses them to check
+that every test was run by exactly one shard.
+
+Results are written by result writers as each test completes, so the
+results of an interrupted run are kept and the progress of a run can be
+followed by reading the files. A result writer provides *start*, *add_test*
+and *stop* methods, two writers are provided:
+
+    * The *ResultWriter* writes JSON Lines result files.
+    * The *JUnitWriter* writes JUnit XML reports for continuous integration
+      servers. The closing tags of the report are rewritten after each
+      test, so the report of an interrupted run is a complete document.
+
+JSON Lines result files contain one JSON object per line with an *event*
+field:
+
+    * *start*: the start of a run, with the *time*, the *shard*, the shard
+      *plan* fingerprint and the *tests* assigned to the shard.
+    * *test*: the outcome of a test, with the test *id*, *module*, *class*,
+      *class_doc*, *description*, result *code* (0: pass, 1: fail, 2: error,
+      3: skipped, 4: timed out), *output*, *error*, *duration* in seconds,
+      a *cached* flag set for tests that passed using the test result
+      cache, the simulator *return_code*, the simulator output *logs*, the
+      number of *attempts* (more than 1 if the test was retried) and a
+      *flaky* flag set for tests that passed after failing.
+    * *stop*: the end of a run, with the *time*.
+"""
+
+import re
+import json
+import time
+import glob
+import hashlib
+import socket
+import logging
+import datetime
+from xml.sax import saxutils
+
+from chiptools.testing import testloader
+from chiptools.testing.custom_runners import HTMLTestRunner
+from chiptools.testing.durations import TimedTestResult
+from chiptools.testing.parallel import ParallelTestRunner
+from chiptools.testing.parallel import RESULT_PASS
+from chiptools.testing.parallel import RESULT_FAIL
+from chiptools.testing.parallel import RESULT_SKIP
+from chiptools.testing.parallel import RESULT_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+# Terminal escape sequences, such as colour codes in simulator output
+ESCAPE_SEQUENCE_RE = re.compile(r'\x1b\[[0-9;?]*[ -/]*[@-~]')
+# Characters that are not allowed in XML 1.0 documents
+XML_ILLEGAL_RE = re.compile(
+    '[^\x09\x0a\x0d\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]'
+)
+
+
+def parse_shard(shard):
+    """
+    Return the (index, count) tuple described by the *shard* string, which
+    is given as INDEX/COUNT where INDEX is in the range 1 to COUNT. A
+    ValueError is raised if the string is not a valid shard.
+    """
+    try:
+        index, count = [int(x) for x in shard.split('/')]
+    except ValueError:
+        raise ValueError(
+            'Invalid shard {0}, expected INDEX/COUNT'.format(shard)
+        )
+    if count < 1 or index < 1 or index > count:
+        raise ValueError(
+            'Invalid shard {0}, INDEX must be in the range 1 to COUNT'.format(
+                shard
+            )
+        )
+    return index, count
+
+
+def select_shard(test_ids, index, count, durations=None):
+    """
+    Return the set of test IDs from the given *test_ids* that belong to
+    shard *index* (1 to *count*). Tests are assigned to the shards in a
+    deterministic order, so every shard must be given the same *test_ids* and
+    *durations*.
+
+    If the *durations* dictionary of test ID : expected duration contains
+    any of the tests, the tests are assigned longest first to the shard with
+    the lowest total expected duration (tests without a history are assumed
+    to take the mean duration). Otherwise the tests are distributed so that
+    each shard has the same number of tests.
+    """
+    test_ids = sorted(set(test_ids))
+    durations = dict(
+        (test_id, durations[test_id]) for test_id in test_ids
+        if durations is not None and test_id in durations
+    )
+    if len(durations) == 0:
+        return set(test_ids[index - 1::count])
+    mean = sum(durations.values()) / len(durations)
+    order = sorted(
+        test_ids,
+        key=lambda test_id: (-durations.get(test_id, mean), test_id)
+    )
+    loads = [0.0] * count
+    result = set()
+    for test_id in order:
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        loads[shard] += durations.get(test_id, mean)
+        if shard == index - 1:
+            result.add(test_id)
+    return result
+
+
+def get_shard_plan(test_ids, count, durations=None):
+    """
+    Return a fingerprint of the assignment of the *test_ids* to *count*
+    shards using the *durations* dictionary (see *select_shard*). Shards
+    that were given different inputs have different fingerprints.
+    """
+    durations = durations or {}
+    digest = hashlib.sha1()
+    digest.update('{0}\n'.format(count).encode('utf-8'))
+    for test_id in sorted(set(test_ids)):
+        digest.update(
+            '{0} {1!r}\n'.format(
+                test_id,
+                durations.get(test_id, None)
+            ).encode('utf-8')
+        )
+    return digest.hexdigest()
+
+
+def read_durations(paths):
+    """
+    Return a dictionary of test ID : duration read from the result files
+    given by *paths* (glob patterns are expanded) for use as a shared
+    duration history by *select_shard*. Skipped tests and cached passes are
+    not included.
+    """
+    durations = {}
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            log.warning('No result files match: ' + pattern)
+        for path in matches:
+            for record in read_results(path)[2]:
+                if record['code'] != RESULT_SKIP and not record['cached']:
+                    durations[record['id']] = record['duration']
+    return durations
+
+
+class ResultWriter:
+    """
+    A ResultWriter writes test outcomes to the JSON Lines result file at
+    *path*. The *shard* string is recorded in the file to identify the
+    shard that produced it, together with the shard *plan* fingerprint (see
+    *get_shard_plan*) and the list of *tests* IDs assigned to the shard.
+    """
+    def __init__(self, path, shard=None, plan=None, tests=None):
+        self.path = path
+        self.shard = shard
+        self.plan = plan
+        self.tests = tests
+        self.stream = None
+
+    def write(self, record):
+        self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+    def start(self):
+        """Open the result file and record the start of the run."""
+        self.stream = open(self.path, 'w')
+        self.write(dict(
+            event='start',
+            time=time.time(),
+            shard=self.shard,
+            plan=self.plan,
+            tests=self.tests
+        ))
+
+    def add_test(self, test, outcome, cached=False):
+        """
+        Record the *outcome* tuple of (result code, output, error, duration,
+        details) of the given *test*.
+        """
+        code, output, error, duration, details = outcome
+        cls = test.__class__
+        self.write({
+            'event': 'test',
+            'id': test.id(),
+            'module': cls.__module__,
+            'class': cls.__name__,
+            'class_doc': cls.__doc__,
+            'description': test.shortDescription(),
+            'code': code,
+            'output': output,
+            'error': error,
+            'duration': duration,
+            'cached': cached,
+            'return_code': details.get('return_code', None),
+            'logs': details.get('logs', []),
+            'attempts': details.get('attempts', 1),
+            'flaky': details.get('flaky', False),
+        })
+
+    def stop(self):
+        """Record the end of the run and close the result file."""
+        self.write(dict(event='stop', time=time.time()))
+        self.stream.close()
+        self.stream = None
+
+
+def xml_text(text):
+    """
+    Return the given *text* with terminal escape sequences removed and any
+    other characters that are not allowed in XML replaced with U+FFFD, so
+    that simulator output can be written to an XML document.
+    """
+    return XML_ILLEGAL_RE.sub(
+        '\ufffd',
+        ESCAPE_SEQUENCE_RE.sub('', str(text))
+    )
+
+
+def xml_escape(text):
+    """Return the given *text* escaped for XML element content."""
+    return saxutils.escape(xml_text(text))
+
+
+def xml_quoteattr(text):
+    """Return the given *text* quoted as an XML attribute value."""
+    return saxutils.quoteattr(xml_text(text))
+
+
+class JUnitWriter:
+    """
+    A JUnitWriter writes test outcomes to the JUnit XML report at *path*.
+    Each test is written as a *testcase* element as soon as it completes,
+    so the test totals are not given as attributes of the *testsuite*
+    element (they are derived from the test cases by continuous integration
+    servers). The simulator return code and log files of each test are
+    written as *properties* of the test case. The report is named using
+    the *name* input.
+
+    The closing tags of the report are written after each element and
+    overwritten by the next one, so the report is a well-formed document
+    even if the run is killed.
+    """
+    footer = '</testsuite>\n</testsuites>\n'
+
+    def __init__(self, path, name='chiptools'):
+        self.path = path
+        self.name = name
+        self.stream = None
+        # Position of the closing tags in the report
+        self.position = 0
+
+    def write(self, text):
+        """
+        Write the *text* in place of the closing tags of the report, then
+        write the closing tags after it.
+        """
+        self.stream.seek(self.position)
+        self.stream.write(text)
+        self.position = self.stream.tell()
+        self.stream.write(self.footer)
+        self.stream.truncate()
+        self.stream.flush()
+
+    def start(self):
+        """Open the report and write the testsuite header."""
+        self.stream = open(self.path, 'w', encoding='utf-8')
+        self.position = 0
+        self.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n' +
+            '<testsuites>\n' +
+            '<testsuite name={0} timestamp={1} hostname={2}>\n'.format(
+                xml_quoteattr(self.name),
+                saxutils.quoteattr(
+                    datetime.datetime.now().isoformat(timespec='seconds')
+                ),
+                saxutils.quoteattr(socket.gethostname())
+            )
+        )
+
+    def add_test(self, test, outcome, cached=False):
+        """
+        Write the *outcome* tuple of (result code, output, error, duration,
+        details) of the given *test* as a testcase element.
+        """
+        code, output, error, duration, details = outcome
+        test_id = test.id()
+        classname, name = testloader.split_test_id(test_id)
+        element = '<testcase classname={0} name={1} time="{2:.3f}">\n'.format(
+            xml_quoteattr(classname),
+            xml_quoteattr(name),
+            duration
+        )
+        properties = []
+        if details.get('return_code', None) is not None:
+            properties.append(('return_code', details['return_code']))
+        for path in details.get('logs', []):
+            properties.append(('log', path))
+        if cached:
+            properties.append(('cached', 'true'))
+        if details.get('attempts', 1) > 1:
+            properties.append(('attempts', details['attempts']))
+        if details.get('flaky', False):
+            properties.append(('flaky', 'true'))
+        if len(properties) > 0:
+            element += '<properties>\n'
+            for name, value in properties:
+                element += '<property name={0} value={1}/>\n'.format(
+                    xml_quoteattr(name),
+                    xml_quoteattr(str(value))
+                )
+            element += '</properties>\n'
+        message = error.strip().splitlines()[-1] if error.strip() else ''
+        if code == RESULT_SKIP:
+            element += '<skipped message={0}/>\n'.format(
+                xml_quoteattr(output.strip())
+            )
+        elif code == RESULT_FAIL:
+            element += '<failure message={0}>{1}</failure>\n'.format(
+                xml_quoteattr(message),
+                xml_escape(error)
+            )
+        elif code == RESULT_TIMEOUT:
+            element += (
+                '<error type="timeout" message={0}>{1}</error>\n'.format(
+                    xml_quoteattr(message),
+                    xml_escape(error)
+                )
+            )
+        elif code != RESULT_PASS:
+            element += '<error message={0}>{1}</error>\n'.format(
+                xml_quoteattr(message),
+                xml_escape(error)
+            )
+        if output and code != RESULT_SKIP:
+            element += '<system-out>{0}</system-out>\n'.format(
+                xml_escape(output)
+            )
+        element += '</testcase>\n'
+        self.write(element)
+
+    def stop(self):
+        """Close the report, the closing tags have already been written."""
+        self.stream.close()
+        self.stream = None
+
+
+class RecordedTest:
+    """
+    A RecordedTest stands in for a test case that was loaded from a result
+    file so that it can be passed to the HTMLTestRunner report generator.
+    """
+    # Test classes are recreated from the result files so that the report
+    # groups tests by class.
+    classes = {}
+
+    def __init__(self, record):
+        self.record = record
+
+    @staticmethod
+    def create(record):
+        """Return a RecordedTest for the given result file *record*."""
+        key = (record['module'], record['class'])
+        if key not in RecordedTest.classes:
+            RecordedTest.classes[key] = type(
+                record['class'],
+                (RecordedTest,),
+                {
+                    '__module__': record['module'],
+                    '__doc__': record['class_doc'],
+                }
+            )
+        return RecordedTest.classes[key](record)
+
+    def id(self):
+        return self.record['id']
+
+    def shortDescription(self):
+        return self.record['description']
+
+    def __str__(self):
+        return self.record['id']
+
+
+def read_results(path):
+    """
+    Return a tuple of (start record, stop time, test records) read from the
+    result file at *path*. The stop time is returned as seconds since the
+    epoch. The start record or stop time is None if the file does not record
+    it (for example if the run was interrupted). If a test appears more than
+    once the last record is used.
+    """
+    start = stop = None
+    records = {}
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f):
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                log.warning(
+                    'Ignoring invalid record on line {0} of {1}'.format(
+                        line_number + 1,
+                        path
+                    )
+                )
+                continue
+            event = record.get('event', None)
+            if event == 'start':
+                start = record
+            elif event == 'stop':
+                stop = record['time']
+            elif event == 'test':
+                records[record['id']] = record
+    return start, stop, list(records.values())
+
+
+def check_shards(headers, test_ids):
+    """
+    Check that the shards that wrote the result files with the given
+    *headers* (dictionary of path : start record) were planned from the same
+    inputs, that every shard of the run is present once and that each test
+    assigned to a shard has a result in the *test_ids* set. Errors are
+    logged and False is returned if the check fails.
+    """
+    valid = True
+    plans = set()
+    shards = {}
+    assigned = {}
+    count = None
+    for path, header in sorted(headers.items()):
+        if header.get('shard', None) is None:
+            continue
+        index, count = parse_shard(header['shard'])
+        plans.add(header.get('plan', None))
+        if index in shards:
+            log.error(
+                'Shard {0} was written to both {1} and {2}'.format(
+                    header['shard'],
+                    shards[index],
+                    path
+                )
+            )
+            valid = False
+        shards[index] = path
+        for test_id in header.get('tests', None) or []:
+            if test_id in assigned:
+                log.error(
+                    'Test {0} was assigned to both {1} and {2}'.format(
+                        test_id,
+                        assigned[test_id],
+                        path
+                    )
+                )
+                valid = False
+            assigned[test_id] = path
+    if len(shards) == 0:
+        return valid
+    if len(plans) > 1:
+        log.error(
+            'The shards were planned from different test selections, ' +
+            'shard counts or duration histories.'
+        )
+        valid = False
+    for index in range(1, count + 1):
+        if index not in shards:
+            log.error('Missing result file for shard {0}/{1}'.format(
+                index,
+                count
+            ))
+            valid = False
+    for test_id in sorted(set(assigned.keys()) - test_ids):
+        log.error('Missing result for test: ' + test_id)
+        valid = False
+    return valid
+
+
+def merge_results(
+    paths,
+    report_path=None,
+    duration_store=None,
+    junit_path=None
+):
+    """
+    Combine the result files given by *paths* (glob patterns are expanded)
+    into a single result object. If a *report_path* is given an HTML report
+    of the combined results is written to it, if a *junit_path* is given a
+    JUnit XML report of the combined results is written to it. If a
+    TestDurationStore is given as the *duration_store* the durations of the
+    tests that were run are added to it. Return the combined result, or
+    None if no result files were found or the shards do not cover the
+    tests exactly once (see *check_shards*).
+    """
+    files = []
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            log.warning('No result files match: ' + pattern)
+        files += [path for path in matches if path not in files]
+    if len(files) == 0:
+        log.error('No result files to merge.')
+        return None
+    starts = []
+    stops = []
+    headers = {}
+    records = {}
+    duplicates = set()
+    for path in files:
+        log.info('Reading results: ' + path)
+        start, stop, file_records = read_results(path)
+        if start is not None:
+            starts.append(start['time'])
+            headers[path] = start
+        if stop is not None:
+            stops.append(stop)
+        for record in file_records:
+            if record['id'] in records:
+                duplicates.add(record['id'])
+            records[record['id']] = record
+    valid = check_shards(headers, set(records.keys()))
+    for test_id in sorted(duplicates):
+        log.error('Duplicate result for test: ' + test_id)
+    if not valid or len(duplicates) > 0:
+        log.error('The result files were not merged.')
+        return None
+    result = TimedTestResult()
+    junit = None
+    if junit_path is not None:
+        junit = JUnitWriter(junit_path)
+        junit.start()
+    for test_id in sorted(records.keys()):
+        record = records[test_id]
+        test = RecordedTest.create(record)
+        outcome = (
+            record['code'],
+            record['output'],
+            record['error'],
+            record['duration'],
+            dict(
+                return_code=record.get('return_code', None),
+                logs=record.get('logs', []),
+                attempts=record.get('attempts', 1),
+                flaky=record.get('flaky', False)
+            )
+        )
+        ParallelTestRunner.add_outcome(result, test, outcome)
+        if junit is not None:
+            junit.add_test(test, outcome, cached=record['cached'])
+        if duration_store is not None:
+            if record['code'] != RESULT_SKIP and not record['cached']:
+                duration_store.add_duration(test_id, record['duration'])
+    if junit is not None:
+        junit.stop()
+        log.info('Merged JUnit report written to: ' + junit_path)
+    if duration_store is not None:
+        duration_store.save_cache()
+    log.info(
+        'Merged {0} test result(s) from {1} file(s): '.format(
+            len(records),
+            len(files)
+        ) +
+        'Pass {0}, Failure {1}, Error {2}'.format(
+            result.success_count,
+            result.failure_count,
+            result.error_count
+        )
+    )
+    if report_path is not None:
+        with open(report_path, 'w') as report:
+            runner = HTMLTestRunner.HTMLTestRunner(verbosity=2, stream=report)
+            now = time.time()
+            runner.startTime = datetime.datetime.fromtimestamp(
+                min(starts) if len(starts) > 0 else now
+            )
+            runner.stopTime = datetime.datetime.fromtimestamp(
+                max(stops) if len(stops) > 0 else now
+            )
+            runner.generateReport(None, result)
+        log.info('Merged report written to: ' + report_path)
+    return result
@@ -0,0 +1,204 @@
+"""
+Automatic retries of failed tests and flakiness statistics.
+
+A RetryPolicy decides whether a test that did not pass is run again. Test
+failures are classified as:
+
+    * *infrastructure* failures: the test raised an error after the
+      simulator exited with a non-zero return code and the test output
+      matches one of the infrastructure patterns (for example a licence
+      checkout failure or a stale NFS file handle). The test itself is not at
+      fault, so these are retried up to *infrastructure_retries* times.
+    * *test* failures: assertion failures, errors and timeouts. These are
+      retried up to *retries* times to detect flaky tests, for example
+      randomised testbenches with seed-dependent bugs. A test that fails and
+      then passes on a retry is reported as a flaky pass.
+
+Retried tests are put back into the test queue, so a parallel run does not
+block a worker while waiting to retry a test. The FlakinessStore records the
+number of runs, flaky passes and infrastructure retries of each test so that
+flaky tests can be identified across runs.
+"""
+
+import re
+import logging
+
+from chiptools.core.cache import PickleStore
+from chiptools.testing.parallel import RESULT_PASS
+from chiptools.testing.parallel import RESULT_ERROR
+from chiptools.testing.parallel import RESULT_SKIP
+
+log = logging.getLogger(__name__)
+
+# Failure classifications
+FAILURE_INFRASTRUCTURE = 'infrastructure'
+FAILURE_TEST = 'test'
+
+
+class RetryPolicy:
+    """
+    A RetryPolicy retries tests with test failures up to *retries* times and
+    tests with infrastructure failures up to *infrastructure_retries* times.
+    Infrastructure failures are identified by the list of regular
+    expression *infrastructure_patterns*, by default the
+    *default_infrastructure_patterns*. The patterns are searched in the
+    whole test output, including the simulator banner, so they must only
+    match error messages: the ModelSim and Questa banners state that the
+    tool is 'SUBJECT TO LICENSE TERMS'.
+    """
+    default_infrastructure_patterns = [
+        # Licence checkout failures
+        r'(?i)unable to check ?out',
+        r'(?i)licen[cs]e checkout failed',
+        r'(?i)failed to check ?out (a )?licen[cs]e',
+        r'(?i)cannot connect to (the )?licen[cs]e server',
+        r'(?i)a valid licen[cs]e was not found',
+        r'(?i)no licen[cs]e(s)? (is |are )?available',
+        r'(?i)\b(flexlm|flexnet licensing) error',
+        r'(?i)\blmgrd\b.*\b(not running|down|error)',
+        # File system failures
+        r'(?i)stale (nfs )?file handle',
+        r'(?i)no space left on device',
+    ]
+
+    def __init__(
+        self,
+        retries=0,
+        infrastructure_retries=0,
+        infrastructure_patterns=None
+    ):
+        self.retries = retries
+        self.infrastructure_retries = infrastructure_retries
+        if infrastructure_patterns is None:
+            infrastructure_patterns = self.default_infrastructure_patterns
+        self.infrastructure_patterns = [
+            re.compile(pattern) for pattern in infrastructure_patterns
+        ]
+
+    @property
+    def enabled(self):
+        """True if the policy retries any tests."""
+        return self.retries > 0 or self.infrastructure_retries > 0
+
+    def classify(self, outcome):
+        """
+        Return the failure classification of the *outcome* tuple of (result
+        code, output, error, duration, details): FAILURE_INFRASTRUCTURE,
+        FAILURE_TEST or None if the test passed or was skipped.
+        """
+        code, output, error, duration, details = outcome
+        if code in [RESULT_PASS, RESULT_SKIP]:
+            return None
+        if code == RESULT_ERROR and details.get('return_code', None):
+            text = (output or '') + (error or '')
+            for pattern in self.infrastructure_patterns:
+                if pattern.search(text):
+                    return FAILURE_INFRASTRUCTURE
+        return FAILURE_TEST
+
+    def should_retry(self, outcome, failures):
+        """
+        Return True if a test with the given *outcome* should be run again.
+        The *failures* list holds the classifications of the earlier
+        attempts of the test.
+        """
+        failure = self.classify(outcome)
+        if failure is None:
+            return False
+        if failure == FAILURE_INFRASTRUCTURE:
+            limit = self.infrastructure_retries
+        else:
+            limit = self.retries
+        return failures.count(failure) < limit
+
+    def retry(self, test, outcome, failures):
+        """
+        Return True if the *test* should be run again after an attempt with
+        the given *outcome*, in which case the classification of the attempt
+        is added to the *failures* list of earlier attempts.
+        """
+        if not self.should_retry(outcome, failures):
+            return False
+        failure = self.classify(outcome)
+        failures.append(failure)
+        log.warning(
+            'Retrying {0} after {1} failure (attempt {2})'.format(
+                test.id(),
+                failure,
+                len(failures) + 1
+            )
+        )
+        return True
+
+    @staticmethod
+    def get_outcome(outcome, failures):
+        """
+        Return the final *outcome* tuple of a test with its details extended
+        with the number of *attempts*, the number of *infrastructure_retries*
+        and a *flaky* flag, which is set if the test passed after an earlier
+        attempt had a test failure. The *failures* list holds the
+        classifications of the earlier attempts. The *outcome* is returned
+        unchanged if the test was only run once.
+        """
+        if len(failures) == 0:
+            return outcome
+        code, output, error, duration, details = outcome
+        details = dict(details)
+        details['attempts'] = len(failures) + 1
+        details['infrastructure_retries'] = failures.count(
+            FAILURE_INFRASTRUCTURE
+        )
+        details['flaky'] = (
+            code == RESULT_PASS and FAILURE_TEST in failures
+        )
+        return (code, output, error, duration, details)
+
+
+class FlakinessStore(PickleStore):
+    """
+    A FlakinessStore records a dictionary of test ID : [runs, flaky passes,
+    infrastructure retries] counts.
+    """
+    cache_file_name = '_flakiness.cache'
+    store_name = 'flakiness store'
+
+    def add_outcome(self, test_id, details):
+        """
+        Record a run of the test given by *test_id* using the *details* of
+        its final outcome (see *RetryPolicy.get_outcome*).
+        """
+        stats = self.cache.setdefault(test_id, [0, 0, 0])
+        stats[0] += 1
+        if details.get('flaky', False):
+            stats[1] += 1
+        stats[2] += details.get('infrastructure_retries', 0)
+
+    def get_flakiness(self, test_id):
+        """
+        Return the fraction of the recorded runs of the test given by
+        *test_id* that were flaky passes, or None if the test has no runs.
+        """
+        runs, flaky, infrastructure = self.cache.get(test_id, [0, 0, 0])
+        if runs == 0:
+            return None
+        return flaky / runs
+
+    def report(self, test_ids):
+        """
+        Log the flakiness statistics of the given *test_ids* that have had
+        flaky passes.
+        """
+        for test_id in sorted(test_ids):
+            runs, flaky, infrastructure = self.cache.get(
+                test_id,
+                [0, 0, 0]
+            )
+            if flaky > 0:
+                log.warning(
+                    'Flaky test {0}: {1} flaky pass(es) in {2} run(s) '.format(
+                        test_id,
+                        flaky,
+                        runs
+                    ) +
+                    '({0:.0%})'.format(flaky / runs)
+                )
@@ -0,0 +1,98 @@
+"""
+The TestIndex records the tests found in each test module so that the tests
+of a project can be listed without importing the test modules, which may
+import slow packages such as plotting libraries.
+
+Each module is stored with the MD5 sums of its source and of the helper
+modules that it imports (refer to *TestResultCache.get_helper_paths*), the
+module is only imported again when one of these sources changes. For each
+test the index records:
+
+    * The test *id*, method *name* and *description* (first line of the
+      test docstring).
+    * The test *class* name and the class docstring, *class_doc*.
+    * The *library* and *entity* targeted by the test.
+
+Tests are stored in the order that they are run, so the position of a test
+in the index matches the integer test IDs used by *Project.run_tests*.
+"""
+
+import inspect
+import logging
+
+from chiptools.core.cache import PickleStore
+from chiptools.testing import testloader
+from chiptools.testing.parallel import iterate_tests
+from chiptools.testing.result_cache import TestResultCache
+
+log = logging.getLogger(__name__)
+
+
+class TestIndex(PickleStore):
+    """
+    A TestIndex stores a dictionary of module path : (MD5 sum, dictionary of
+    helper module path : MD5 sum, list of test entries).
+    """
+    cache_file_name = '_tests.cache'
+    store_name = 'test index'
+
+    def __init__(self, cache_path):
+        super(TestIndex, self).__init__(cache_path)
+        self.modified = False
+
+    def save_cache(self):
+        """
+        Store the local index dictionary into the linked cache file if it
+        has been modified.
+        """
+        if not self.modified:
+            return
+        super(TestIndex, self).save_cache()
+        self.modified = False
+
+    def get_entries(self, path):
+        """
+        Return the list of test entries of the test module at *path*, or
+        None if the module is not in the index or if the module or one of
+        its helper modules has changed since it was indexed.
+        """
+        record = self.cache.get(path, None)
+        if record is None or len(record) != 3:
+            return None
+        md5, helpers, entries = record
+        if md5 != TestResultCache.md5(path):
+            return None
+        for helper_path, helper_md5 in helpers.items():
+            if helper_md5 != TestResultCache.md5(helper_path):
+                return None
+        return entries
+
+    def add_suite(self, path, suite):
+        """
+        Index the tests of the *suite* loaded from the test module at *path*
+        and return the list of test entries.
+        """
+        entries = []
+        modules = {}
+        for test in iterate_tests(suite):
+            cls = test.__class__
+            module = inspect.getmodule(cls)
+            if module is not None:
+                modules[module.__name__] = module
+            entries.append(dict(
+                id=test.id(),
+                name=testloader.split_test_id(test.id())[1],
+                description=test.shortDescription(),
+                module=cls.__module__,
+                class_name=cls.__name__,
+                class_doc=cls.__doc__,
+                library=getattr(test, 'library', None),
+                entity=getattr(test, 'entity', None),
+            ))
+        helpers = {}
+        for module in modules.values():
+            for helper_path in TestResultCache.get_helper_paths(module):
+                helpers[helper_path] = TestResultCache.md5(helper_path)
+        self.cache[path] = (TestResultCache.md5(path), helpers, entries)
+        self.modified = True
+        return entries
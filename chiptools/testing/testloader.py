@@ -1,10 +1,14 @@
+import re
 import unittest
+import hashlib
 import logging
 import traceback
 import os
+import itertools
 import importlib.machinery
 
 from chiptools.common import utils
+from chiptools.common import exceptions
 
 log = logging.getLogger(__name__)
 
@@ -20,8 +24,20 @@ class ChipToolsTest(unittest.TestCase):
         * self.sim_ret_val (simulator return code)
         * self.sim_stdout (simulator stdout as string)
         * self.sim_stderr (simulator stderr as string)
+        * self.sim_stdout_log (simulator stdout as an OutputLog)
+        * self.sim_stderr_log (simulator stderr as an OutputLog)
         * self.simulation_root (path to the simulator working directory)
 
+    The simulator output is written to log files in the 'logs' directory of
+    the simulation directory, named using the test ID. Only the first and
+    last lines of the output are kept in memory, the *sim_stdout* and
+    *sim_stderr* strings are read from the log files when they are accessed.
+    If there is no simulation directory the output is kept in memory.
+    For verbose simulations use the *sim_stdout_log* object instead, which
+    can be searched or iterated line by line without loading the complete
+    output:
+        self.assertIsNone(self.sim_stdout_log.search('Error:'))
+
     Additional attibutes belonging to the ChipToolsTest class that you should
     override are:
         * self.duration (a float number of seconds to run the simulation for,
@@ -32,6 +48,30 @@ class ChipToolsTest(unittest.TestCase):
         * self.entity (the name of the entity that this testcase targets)
         * self.library (the library in which the entity targeted by this
             testcase resides)
+        * self.timeout (the number of seconds that the simulator may run
+            for before it is killed and the test is reported as timed out,
+            if None the project 'timeout' configuration item is used)
+            (*this is an optional attribute*)
+        * self.failure_patterns (a list of regular expressions, if any line
+            of the simulator output matches one of them the simulation is
+            aborted and the test fails. Patterns set by the project
+            'failure_pattern' configuration item are also applied)
+            (*this is an optional attribute*)
+        * self.stimulus_files (a list of paths to input files read by the
+            testcase, relative paths are relative to the test module. These
+            files are used to detect changes when test results are cached)
+            (*this is an optional attribute*)
+        * self.generic_matrix (a dictionary of name:list of values, the test
+            is run once for every combination of the values. Each
+            combination is reported as a separate test with the generic
+            values appended to the test ID, for example
+            'test_output[data_width=8]'. Generics in the matrix override
+            those in self.generics) (*this is an optional attribute*)
+        * self.seeds (a list of seeds, each combination of generics is run
+            once with each seed. The seed of the test case is stored in
+            self.seed for use in simulationSetUp, and is passed to the
+            testbench as the generic named by self.seed_generic if it is
+            set) (*this is an optional attribute*)
 
     Refer to the *examples* directory for demonstrations on how to create unit
     tests.
@@ -41,9 +81,149 @@ class ChipToolsTest(unittest.TestCase):
     generics = {}
     entity = ''
     library = ''
-    sim_stdout = ''
-    sim_stderr = ''
+    stimulus_files = []
+    failure_patterns = []
+    timeout = None
+    sim_stdout_log = utils.OutputLog()
+    sim_stderr_log = utils.OutputLog()
+    sim_log_path = None
     sim_ret_val = 0
+    generic_matrix = {}
+    seeds = []
+    seed_generic = None
+    seed = None
+    parameters = None
+    # Maximum length of the log file names derived from the test ID
+    max_log_name = 120
+
+    def __init__(self, methodName='runTest', parameters=None):
+        """
+        Create the test case for the test method *methodName*. The
+        *parameters* tuple of (generics, seed) selects one case of the
+        *generic_matrix* and *seeds* of the test class, see
+        *get_parameter_sets*.
+        """
+        super(ChipToolsTest, self).__init__(methodName)
+        if parameters is None:
+            return
+        self.parameters = parameters
+        generics, seed = parameters
+        self.generics = dict(self.generics)
+        self.generics.update(generics)
+        if seed is not None:
+            self.seed = seed
+            if self.seed_generic is not None:
+                self.generics[self.seed_generic] = seed
+
+    @classmethod
+    def get_parameter_sets(cls):
+        """
+        Return the list of (generics, seed) tuples for every combination of
+        the *generic_matrix* values and *seeds* of this class, or an empty
+        list if the class is not parametrised. Seeds vary fastest so that
+        cases sharing a set of generics are adjacent, which lets the
+        simulator reuse the elaborated design between them.
+        """
+        if len(cls.generic_matrix) == 0 and len(cls.seeds) == 0:
+            return []
+        names = sorted(cls.generic_matrix.keys())
+        values = [list(cls.generic_matrix[name]) for name in names]
+        seeds = list(cls.seeds) if len(cls.seeds) > 0 else [None]
+        return [
+            (dict(zip(names, combination)), seed)
+            for combination in itertools.product(*values)
+            for seed in seeds
+        ]
+
+    def get_parameter_string(self):
+        """
+        Return the parameter suffix of the test ID, for example
+        '[data_width=8,seed=1]', or an empty string if the test case is not
+        parametrised.
+        """
+        if self.parameters is None:
+            return ''
+        generics, seed = self.parameters
+        items = [
+            '{0}={1}'.format(name, generics[name])
+            for name in sorted(generics.keys())
+        ]
+        if seed is not None:
+            items.append('seed={0}'.format(seed))
+        return '[' + ','.join(items) + ']'
+
+    def id(self):
+        return (
+            super(ChipToolsTest, self).id() + self.get_parameter_string()
+        )
+
+    def __str__(self):
+        return '{0}{1} ({2})'.format(
+            self._testMethodName,
+            self.get_parameter_string(),
+            self.id()
+        )
+
+    def __eq__(self, other):
+        if not super(ChipToolsTest, self).__eq__(other):
+            return False
+        return self.get_parameter_string() == other.get_parameter_string()
+
+    def __hash__(self):
+        return hash((
+            super(ChipToolsTest, self).__hash__(),
+            self.get_parameter_string()
+        ))
+
+    @property
+    def sim_stdout(self):
+        return str(self.sim_stdout_log)
+
+    @sim_stdout.setter
+    def sim_stdout(self, value):
+        self.sim_stdout_log = value
+
+    @property
+    def sim_stderr(self):
+        return str(self.sim_stderr_log)
+
+    @sim_stderr.setter
+    def sim_stderr(self, value):
+        self.sim_stderr_log = value
+
+    def get_log_path(self):
+        """
+        Return the prefix of the log files that the simulator output of this
+        test is written to, or None if there is no simulation directory.
+        The file name is derived from the test ID, characters that are not
+        safe in file names (for example in the generic values of a
+        parametrised test) are replaced and a hash of the ID is added so
+        that different tests cannot share a log file.
+        """
+        directory = self.simulator.project.get_simulation_log_directory()
+        if directory is None:
+            return None
+        test_id = self.id()
+        name = re.sub(r'[^\w.,=+\-\[\]]+', '_', test_id)
+        if name != test_id or len(name) > self.max_log_name:
+            name = '{0}_{1}'.format(
+                name[:self.max_log_name],
+                hashlib.sha1(test_id.encode('utf-8')).hexdigest()[:8]
+            )
+        return os.path.join(directory, name)
+
+    def get_log_files(self):
+        """
+        Return the list of simulator output log files written by the last
+        simulation of this test.
+        """
+        if self.sim_log_path is None:
+            return []
+        paths = [
+            self.sim_log_path + suffix
+            for suffix in ['.stdout.log', '.stderr.log']
+        ]
+        return [path for path in paths if os.path.exists(path)]
 
     def postImport(
         self,
@@ -71,6 +251,26 @@ class ChipToolsTest(unittest.TestCase):
         files in this method."""
         pass
 
+    def get_failure_patterns(self):
+        """
+        Return the list of failure patterns for this test: the patterns set
+        in the project configuration followed by the *failure_patterns* of
+        the test.
+        """
+        return (
+            self.simulator.project.get_failure_patterns() +
+            list(self.failure_patterns)
+        )
+
+    def get_timeout(self):
+        """
+        Return the simulation timeout in seconds for this test: the
+        *timeout* of the test if it is set, otherwise the project timeout.
+        """
+        if self.timeout is not None:
+            return self.timeout
+        return self.simulator.project.get_timeout()
+
     def setUp(self):
         # Run user setup first
         self.simulationSetUp()
@@ -92,17 +292,37 @@ class ChipToolsTest(unittest.TestCase):
             )
             return
 
-        ret_val, stdout, stderr = self.simulator.simulate(
-            library=self.library,
-            entity=self.entity,
-            includes=self.simulation_libraries,
-            duration=self.duration,
-            generics=self.generics,
-            gui=False
-        )
+        self.sim_log_path = self.get_log_path()
+        self.sim_ret_val = None
+        try:
+            ret_val, stdout, stderr = self.simulator.simulate(
+                library=self.library,
+                entity=self.entity,
+                includes=self.simulation_libraries,
+                duration=self.duration,
+                generics=self.generics,
+                gui=False,
+                log_path=self.sim_log_path,
+                failure_patterns=self.get_failure_patterns(),
+                timeout=self.get_timeout()
+            )
+        except exceptions.AbortedError as e:
+            # Report the aborted simulation as a test failure
+            raise self.failureException(
+                'Simulation aborted. ' + str(e)
+            ) from None
+        except exceptions.ExecutionTimeout as e:
+            raise exceptions.ExecutionTimeout(
+                'Simulation timed out after {0} seconds'.format(e.timeout),
+                timeout=e.timeout
+            ) from None
+        except exceptions.ExecutionError as e:
+            # Keep the simulator return code for the test details
+            self.sim_ret_val = e.return_code
+            raise
         self.sim_ret_val = ret_val
-        self.sim_stdout = stdout
-        self.sim_stderr = stderr
+        self.sim_stdout_log = stdout
+        self.sim_stderr_log = stderr
 
     def tearDown(self):
         # Run user teardown
@@ -128,8 +348,8 @@ def load_tests(
             path
         )
         test_loader = unittest.TestLoader()
-        suite = test_loader.loadTestsFromModule(
-            module_loader.load_module()
+        suite = expand_parameters(
+            test_loader.loadTestsFromModule(module_loader.load_module())
         )
     except:
         log.error(
@@ -140,3 +360,39 @@ def load_tests(
         return None
 
     return suite
+
+
+def expand_parameters(suite):
+    """
+    Return a copy of the (possibly nested) *suite* where every ChipToolsTest
+    case of a parametrised class is replaced by one test case for each of
+    its parameter sets (see *ChipToolsTest.get_parameter_sets*).
+    """
+    if isinstance(suite, unittest.TestCase):
+        if not isinstance(suite, ChipToolsTest):
+            return [suite]
+        parameter_sets = suite.get_parameter_sets()
+        if len(parameter_sets) == 0:
+            return [suite]
+        return [
+            suite.__class__(suite._testMethodName, parameters=parameters)
+            for parameters in parameter_sets
+        ]
+    expanded = unittest.TestSuite()
+    for item in suite:
+        if isinstance(item, unittest.TestCase):
+            expanded.addTests(expand_parameters(item))
+        else:
+            expanded.addTest(expand_parameters(item))
+    return expanded
+
+
+def split_test_id(test_id):
+    """
+    Return the (class name, test name) tuple of the given *test_id*. The
+    parameter suffix of a parametrised test is kept in the test name, its
+    generic values may contain dots.
+    """
+    base, bracket, parameters = test_id.partition('[')
+    classname, _, name = base.rpartition('.')
+    return classname, name + bracket + parameters
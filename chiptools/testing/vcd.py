@@ -0,0 +1,412 @@
+"""
+A streaming parser for Value Change Dump (VCD) waveform files.
+
+Simulators can dump the signals of a testbench to a VCD file (for example
+using the GHDL *--vcd* option or the ModelSim and xsim *vcd* commands) so
+that unit tests can check the behaviour of an interface from its waveform
+after the simulation has completed. VCD files of long simulations can be
+many gigabytes, so the VcdFile does not build the waveform in memory: the
+file is memory-mapped and the value changes of the selected signals are
+streamed by generators.
+
+    vcd = VcdFile(os.path.join(self.simulation_root, 'waves.vcd'))
+    for time, values in vcd.states(['tb.clock', 'tb.valid', 'tb.ready']):
+        ...
+
+Times are integers in units of the file timescale, *VcdFile.timescale* is
+the timescale in seconds. Scalar values are returned as the strings '0',
+'1', 'x' or 'z', vector values as strings of bits (with leading zeros
+removed as written by the simulator) and real values as floats.
+
+A time window can be selected with the *start* and *end* arguments. The
+start of the window is found by a binary search of the file, the values of
+the signals at the start of the window are found by searching backwards from
+it, and reading stops at the end of the window.
+"""
+
+import os
+import re
+import mmap
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from chiptools.testing.vectors import release_pages
+
+log = logging.getLogger(__name__)
+
+# Time units of the $timescale declaration in seconds
+TIME_UNITS = {
+    's': 1, 'ms': 1e-3, 'us': 1e-6, 'ns': 1e-9, 'ps': 1e-12, 'fs': 1e-15
+}
+# Size of the region of the file that is searched from the start once the
+# binary search for the start of a time window has narrowed it down.
+SEARCH_SIZE = 65536
+# Number of bytes read between releases of the pages of the file that have
+# been searched, see *vectors.release_pages*.
+RELEASE_SIZE = 16 * 1024 * 1024
+
+
+class VcdSignal:
+    """
+    A VcdSignal describes a variable declared in a VCD file: its full
+    hierarchical *name* (scope names joined with '.'), the *code* that
+    identifies its value changes, the variable *type* (for example 'wire'
+    or 'real') and its *width* in bits.
+    """
+    def __init__(self, name, code, type, width):
+        self.name = name
+        self.code = code
+        self.type = type
+        self.width = width
+
+    def __repr__(self):
+        return 'VcdSignal({0}, {1} {2})'.format(
+            self.name,
+            self.type,
+            self.width
+        )
+
+
+class VcdFile:
+    """
+    A VcdFile reads the declarations of the VCD file at *path* when it is
+    created, the value changes are streamed from the file by the *changes*
+    and *states* generators. The *signals* dictionary holds the VcdSignal of
+    each signal name.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.timescale = 1e-9
+        self.signals = {}
+        # Offset of the value change data that follows the declarations
+        self.data_offset = 0
+        with open(path, 'rb') as f:
+            self.parse_declarations(f)
+
+    def parse_declarations(self, f):
+        """
+        Read the declarations of the VCD file *f* up to $enddefinitions.
+        """
+        scopes = []
+        command = None
+        arguments = []
+        for line in iter(f.readline, b''):
+            for token in line.decode(errors='replace').split():
+                if command is None:
+                    command = token
+                    arguments = []
+                    continue
+                if token != '$end':
+                    arguments.append(token)
+                    continue
+                if command == '$scope':
+                    scopes.append(arguments[-1])
+                elif command == '$upscope':
+                    scopes.pop()
+                elif command == '$timescale':
+                    self.set_timescale(''.join(arguments))
+                elif command == '$var':
+                    self.add_signal(scopes, arguments)
+                elif command == '$enddefinitions':
+                    self.data_offset = f.tell()
+                    return
+                command = None
+        raise ValueError(
+            'No $enddefinitions found in {0}'.format(self.path)
+        )
+
+    def set_timescale(self, text):
+        """
+        Set the *timescale* in seconds from the $timescale declaration
+        *text*, for example '1ns' or '10ps'.
+        """
+        number = text.rstrip('abcdefghijklmnopqrstuvwxyz')
+        unit = text[len(number):]
+        if unit not in TIME_UNITS:
+            raise ValueError('Invalid timescale: ' + text)
+        self.timescale = int(number or '1') * TIME_UNITS[unit]
+
+    def add_signal(self, scopes, arguments):
+        """
+        Add the signal given by the *arguments* of a $var declaration (type,
+        width, code, reference and an optional bit range) in the given list
+        of *scopes*.
+        """
+        type, width, code, reference = arguments[:4]
+        # Bit selects of a vector are declared as separate variables, for
+        # example 'data [0]', keep the index to give each a unique name.
+        if len(arguments) > 4 and ':' not in arguments[4]:
+            reference += arguments[4]
+        name = '.'.join(scopes + [reference])
+        self.signals[name] = VcdSignal(name, code.encode(), type, int(width))
+
+    def get_signal(self, name):
+        """
+        Return the VcdSignal with the given *name*, a KeyError is raised if
+        there is no such signal.
+        """
+        if name not in self.signals:
+            raise KeyError(
+                'Signal {0} is not in {1}'.format(name, self.path)
+            )
+        return self.signals[name]
+
+    def find_time(self, data, start):
+        """
+        Return a (low, high) tuple of offsets of the memory-mapped *data*
+        found by a binary search for the first time step at or after the
+        time *start*: that time step is the first one after *low* and is
+        declared on or after the first line that starts after *high*.
+        """
+        low = self.data_offset
+        high = len(data)
+        while high - low > SEARCH_SIZE:
+            middle = (low + high) // 2
+            position = data.find(b'\n#', middle, high)
+            if position < 0:
+                high = middle
+                continue
+            end = data.find(b'\n', position + 1)
+            if end < 0:
+                end = len(data)
+            try:
+                time = int(data[position + 2:end].split()[0])
+            except (ValueError, IndexError):
+                high = middle
+                continue
+            if time < start:
+                low = position + 1
+            else:
+                high = middle
+        return low, high
+
+    @staticmethod
+    def get_pattern(codes):
+        """
+        Return a compiled regular expression matching the value change lines
+        of the given list of signal *codes*, or of any signal if *codes* is
+        None. Group 1 is a scalar value, group 2 a vector or real value and
+        group 3 the signal code.
+        """
+        if codes is None:
+            code = rb'(\S+)'
+        else:
+            # Longer codes first so that a code is not matched by its prefix
+            codes = sorted(codes, key=len, reverse=True)
+            code = b'(' + b'|'.join(re.escape(code) for code in codes) + b')'
+        return re.compile(
+            rb'^(?:([01xXzZuUwWlLhH-])|([bBrR]\S+)[ \t]+)' + code +
+            rb'[ \t]*\r?$',
+            re.M
+        )
+
+    def find_values(self, data, pattern, codes, offset):
+        """
+        Return a dictionary of code : value of the last change of each of
+        the *codes* matched by *pattern* before the *offset* of the
+        memory-mapped *data*. The file is searched backwards in regions of
+        increasing size until a value is found for each code.
+        """
+        values = {}
+        end = offset
+        size = SEARCH_SIZE
+        while end > self.data_offset and len(values) < len(codes):
+            # Start the region at the beginning of a line
+            begin = data.rfind(
+                b'\n',
+                self.data_offset,
+                max(end - size, self.data_offset)
+            )
+            begin = self.data_offset if begin < 0 else begin + 1
+            found = {}
+            for match in pattern.finditer(data, begin, end):
+                code = match.group(3)
+                if code in codes and code not in values:
+                    found[code] = match.group(1) or match.group(2)
+            values.update(found)
+            end = begin
+            size *= 2
+        return dict(
+            (code, self.decode_value(value)) for code, value in values.items()
+        )
+
+    def changes(self, signals=None, start=None, end=None, initial=False):
+        """
+        Return a generator yielding a (time, name, value) tuple for each
+        value change of the given list of *signals* names (all signals if
+        None) with a time between *start* and *end* inclusive. If *initial*
+        is set a value change is also yielded at the *start* time for the
+        value of each signal at the start of the window.
+
+        The value change lines are found by a regular expression search of
+        the file, so value changes are expected to be written one per line
+        as simulators do.
+        """
+        if signals is None:
+            names = list(self.signals.keys())
+        else:
+            names = signals
+        # Signals with the same code are aliases of the same net
+        selected = {}
+        for name in names:
+            selected.setdefault(self.get_signal(name).code, []).append(name)
+        pattern = self.get_pattern(
+            None if signals is None else list(selected.keys())
+        )
+        current = {}
+        started = start is None
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= self.data_offset:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = self.data_offset
+                if start is not None:
+                    offset = self.find_time(data, start)[0]
+                    if initial:
+                        current = self.find_values(
+                            data,
+                            pattern,
+                            selected,
+                            offset
+                        )
+                limit = len(data)
+                if end is not None:
+                    limit = data.find(b'\n#', self.find_time(data, end + 1)[1])
+                    if limit < 0:
+                        limit = len(data)
+                time = 0
+                # Time steps are searched for backwards from each value
+                # change, starting after the last time step found.
+                last = offset - 1
+                released = 0
+                for match in pattern.finditer(data, offset, limit):
+                    position = data.rfind(b'\n#', last, match.start())
+                    if position >= 0:
+                        line_end = data.find(b'\n', position + 1)
+                        time = int(data[position + 2:line_end].split()[0])
+                        last = position + 1
+                        if position - released > RELEASE_SIZE:
+                            released = release_pages(
+                                data,
+                                released,
+                                position
+                            )
+                    # Changes at the start time are included in the
+                    # initial values rather than yielded after them.
+                    if not started and (
+                        time > start or (time == start and not initial)
+                    ):
+                        started = True
+                        for code in sorted(current):
+                            for name in selected[code]:
+                                yield start, name, current[code]
+                    if end is not None and time > end:
+                        return
+                    code = match.group(3)
+                    if code not in selected:
+                        continue
+                    value = self.decode_value(match.group(1) or match.group(2))
+                    if not started:
+                        if initial:
+                            current[code] = value
+                        continue
+                    for name in selected[code]:
+                        yield time, name, value
+                if not started:
+                    for code in sorted(current):
+                        for name in selected[code]:
+                            yield start, name, current[code]
+
+    @staticmethod
+    def decode_value(token):
+        """
+        Return the value of a value change *token*: a float for real values,
+        otherwise a lower case string.
+        """
+        first = token[:1]
+        if first in b'rR':
+            return float(token[1:])
+        if first in b'bB':
+            token = token[1:]
+        return token.decode().lower()
+
+    def states(self, signals, start=None, end=None):
+        """
+        Return a generator yielding a (time, values) tuple for each time
+        step between *start* and *end* inclusive at which any of the given
+        list of *signals* names changes. The *values* dictionary holds the
+        value of each signal after the changes of the time step, signals
+        that have not been assigned are None. The dictionary is updated in
+        place, copy it to keep the values of a time step.
+        """
+        values = dict((name, None) for name in signals)
+        step = None
+        for time, name, value in self.changes(
+            signals,
+            start=start,
+            end=end,
+            initial=start is not None
+        ):
+            if step is not None and time != step:
+                yield step, values
+            step = time
+            values[name] = value
+        if step is not None:
+            yield step, values
+
+    def get_values(self, name, start=None, end=None):
+        """
+        Return the (times, values) lists of the value changes of the signal
+        *name* between *start* and *end*. If *start* is given the first
+        value is the value of the signal at *start*.
+        """
+        times = []
+        values = []
+        for time, _, value in self.changes(
+            [name],
+            start=start,
+            end=end,
+            initial=start is not None
+        ):
+            times.append(time)
+            values.append(value)
+        return times, values
+
+    def get_arrays(self, name, start=None, end=None):
+        """
+        Return the (times, values) NumPy arrays of the value changes of the
+        signal *name* between *start* and *end* (see *get_values*). The
+        values of real signals are returned as a float array, other values
+        are returned as an integer masked array in which values containing
+        'x', 'z' or other non-binary bits are masked. The signal must be at
+        most 63 bits wide. An ImportError is raised if NumPy is not
+        installed.
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required to read VCD arrays')
+        signal = self.get_signal(name)
+        times, values = self.get_values(name, start=start, end=end)
+        times = numpy.array(times, dtype=numpy.int64)
+        if signal.type == 'real':
+            return times, numpy.array(values, dtype=numpy.float64)
+        if signal.width > 63:
+            raise ValueError(
+                'Signal {0} is too wide ({1} bits) for an integer '.format(
+                    name,
+                    signal.width
+                ) +
+                'array, use get_values instead'
+            )
+        mask = [value.strip('01') != '' for value in values]
+        integers = [
+            0 if unknown else int(value, 2)
+            for unknown, value in zip(mask, values)
+        ]
+        return times, numpy.ma.masked_array(
+            numpy.array(integers, dtype=numpy.int64),
+            mask=numpy.array(mask, dtype=bool)
+        )
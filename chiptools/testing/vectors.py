@@ -0,0 +1,629 @@
+"""
+Readers and writers for testbench stimulus and response files.
+
+Testbenches commonly read their stimulus from, and write their response to,
+files of one value per line or of several space separated values per line.
+The following formats are supported:
+
+    * Text files of binary (*radix* 2) or hexadecimal (*radix* 16) strings,
+      see *write_text* and *read_text*. Each value is written using the
+      number of digits needed for *width* bits, as written by the VHDL
+      *write* and *hwrite* procedures.
+    * Raw binary files of integers stored using the smallest whole number
+      of bytes that holds *width* bits, in little or big endian *byteorder*,
+      see *write_binary* and *read_binary*.
+
+Large response files can be read in chunks using *iter_text* and
+*iter_binary*, which memory-map the file and decode one chunk at a time.
+The chunks can be compared against a model with *find_mismatch*, which
+stops reading at the first mismatch.
+
+Values are unsigned integers by default. If *signed* is set the values are
+encoded in two's complement. If *frac_bits* is non-zero the values are
+fixed-point numbers with *frac_bits* fractional bits: they are scaled by
+2**frac_bits and rounded to the nearest integer when they are written, and
+are returned as floats when they are read.
+
+When NumPy is installed, values of up to NUMPY_MAX_WIDTH bits are encoded
+and decoded using vectorised NumPy operations and the readers return NumPy
+arrays. Wider values, or all values if NumPy is not installed, are processed
+in pure Python and the readers return lists.
+"""
+
+import os
+import mmap
+import logging
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+# Widest value processed using NumPy, values are held in int64 arrays and
+# 1 << width must fit in an int64.
+NUMPY_MAX_WIDTH = 62
+# Number of lines or values encoded and decoded at a time using NumPy, this
+# bounds the size of the intermediate arrays.
+CHUNK_SIZE = 65536
+# Number of bits encoded by each digit of the supported radixes
+RADIX_BITS = {2: 1, 16: 4}
+DIGITS = b'0123456789abcdef'
+
+
+def use_numpy(widths):
+    """
+    Return True if values of the given list of *widths* are processed using
+    NumPy.
+    """
+    return numpy is not None and max(widths) <= NUMPY_MAX_WIDTH
+
+
+def get_radix_bits(radix):
+    """
+    Return the number of bits encoded by each digit of the given *radix*. A
+    ValueError is raised if the radix is not supported.
+    """
+    if radix not in RADIX_BITS:
+        raise ValueError(
+            'Unsupported radix {0}, expected 2 or 16'.format(radix)
+        )
+    return RADIX_BITS[radix]
+
+
+def get_digits(width, radix):
+    """
+    Return the number of *radix* digits used to encode a value of *width*
+    bits.
+    """
+    bits = get_radix_bits(radix)
+    return (width + bits - 1) // bits
+
+
+def get_range(width, signed=False):
+    """
+    Return the (minimum, maximum) integers that can be encoded in *width*
+    bits.
+    """
+    if signed:
+        return -(1 << (width - 1)), (1 << (width - 1)) - 1
+    return 0, (1 << width) - 1
+
+
+def get_widths(width, columns):
+    """
+    Return the list of widths of *columns* columns given a *width* that is
+    either a single width for all columns or a list of widths.
+    """
+    if isinstance(width, int):
+        return [width] * columns
+    if len(width) != columns:
+        raise ValueError(
+            'Expected {0} widths, got {1}'.format(columns, len(width))
+        )
+    return list(width)
+
+
+def to_integers(values, width, signed=False, frac_bits=0):
+    """
+    Return the given *values* as unsigned integers of *width* bits: scaled
+    by 2 ** *frac_bits* and rounded, and masked to *width* bits if they are
+    *signed*. A ValueError is raised if a value does not fit in *width*
+    bits. The *values* may be a NumPy array or a list.
+    """
+    minimum, maximum = get_range(width, signed)
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        if frac_bits != 0:
+            values = numpy.round(values * 2.0 ** frac_bits)
+        values = values.astype(numpy.int64)
+        if len(values) > 0 and (
+            values.min() < minimum or values.max() > maximum
+        ):
+            raise ValueError(
+                'Values must be in the range {0} to {1}'.format(
+                    minimum,
+                    maximum
+                )
+            )
+        return values & ((1 << width) - 1)
+    integers = []
+    for value in values:
+        if frac_bits != 0:
+            value = round(value * 2 ** frac_bits)
+        value = int(value)
+        if value < minimum or value > maximum:
+            raise ValueError(
+                'Value {0} is not in the range {1} to {2}'.format(
+                    value,
+                    minimum,
+                    maximum
+                )
+            )
+        integers.append(value & ((1 << width) - 1))
+    return integers
+
+
+def from_integers(integers, width, signed=False, frac_bits=0):
+    """
+    Return the given unsigned *integers* of *width* bits as two's complement
+    values if they are *signed*, divided by 2 ** *frac_bits* if *frac_bits* is
+    non-zero. The *integers* may be a NumPy array or a list.
+    """
+    if numpy is not None and isinstance(integers, numpy.ndarray):
+        values = integers & ((1 << width) - 1)
+        if signed:
+            values = numpy.where(
+                values >> (width - 1) != 0,
+                values - (1 << width),
+                values
+            )
+        if frac_bits != 0:
+            values = values / 2.0 ** frac_bits
+        return values
+    values = []
+    for value in integers:
+        value &= (1 << width) - 1
+        if signed and value >> (width - 1):
+            value -= 1 << width
+        if frac_bits != 0:
+            value = value / 2 ** frac_bits
+        values.append(value)
+    return values
+
+
+def encode_text(integers, digits, radix):
+    """
+    Return the bytes of the text lines encoding the 2D NumPy array of
+    unsigned *integers*, one line per row. Each column is encoded using the
+    number of *radix* digits given by the *digits* list.
+    """
+    bits = RADIX_BITS[radix]
+    symbols = numpy.frombuffer(DIGITS, dtype=numpy.uint8)
+    parts = []
+    for column, count in enumerate(digits):
+        shifts = numpy.arange(count - 1, -1, -1, dtype=numpy.int64) * bits
+        parts.append(
+            symbols[(integers[:, column, None] >> shifts) & (radix - 1)]
+        )
+        separator = ' ' if column < len(digits) - 1 else '\n'
+        parts.append(
+            numpy.full((len(integers), 1), ord(separator), dtype=numpy.uint8)
+        )
+    return numpy.concatenate(parts, axis=1).tobytes()
+
+
+def decode_text(data, digits, radix):
+    """
+    Return a 2D NumPy array of the unsigned integers encoded by the text
+    *data* bytes, one row per line, or None if the lines of the data do not
+    all contain columns of the number of *radix* digits given by the
+    *digits* list. The data must end with a newline. A ValueError is raised
+    if a line contains an invalid digit.
+    """
+    bits = RADIX_BITS[radix]
+    line_length = sum(digits) + len(digits)
+    chars = numpy.frombuffer(data, dtype=numpy.uint8)
+    if len(chars) % line_length != 0:
+        return None
+    chars = chars.reshape(-1, line_length)
+    # Map each character to its digit value, invalid characters (including
+    # metavalues such as 'U' and 'X') map to 255.
+    table = numpy.full(256, 255, dtype=numpy.uint8)
+    for value, symbol in enumerate(DIGITS[:radix]):
+        table[symbol] = value
+        table[ord(chr(symbol).upper())] = value
+    integers = numpy.zeros((len(chars), len(digits)), dtype=numpy.int64)
+    for first in range(0, len(chars), CHUNK_SIZE):
+        lines = chars[first:first + CHUNK_SIZE]
+        start = 0
+        for column, count in enumerate(digits):
+            separator = ' ' if column < len(digits) - 1 else '\n'
+            if numpy.any(lines[:, start + count] != ord(separator)):
+                return None
+            values = table[lines[:, start:start + count]]
+            invalid = numpy.nonzero(numpy.any(values >= radix, axis=1))[0]
+            if len(invalid) > 0:
+                raise ValueError(
+                    'Invalid digit in column {0} of line {1}'.format(
+                        column + 1,
+                        first + invalid[0] + 1
+                    )
+                )
+            shifts = numpy.arange(count - 1, -1, -1, dtype=numpy.int64)
+            integers[first:first + CHUNK_SIZE, column] = (
+                values.astype(numpy.int64) << (shifts * bits)
+            ).sum(axis=1)
+            start += count + 1
+    return integers
+
+
+def write_text(path, values, width, radix=2, signed=False, frac_bits=0):
+    """
+    Write the *values* to a text file at *path* as *radix* 2 (binary) or 16
+    (hexadecimal) strings of *width* bits, one value per line. If *values*
+    is a 2D array or a list of rows each row is written as a line of space
+    separated values, the *width* can then be a list of column widths. A
+    ValueError is raised if a value does not fit in its width.
+    """
+    if numpy is not None and not isinstance(values, numpy.ndarray):
+        values = numpy.asarray(values, dtype=object)
+    if numpy is not None and len(values) > 0:
+        rows = values.reshape(len(values), -1)
+        widths = get_widths(width, rows.shape[1])
+        digits = [get_digits(w, radix) for w in widths]
+        if use_numpy(widths):
+            if rows.dtype == object:
+                rows = rows.astype(float if frac_bits != 0 else numpy.int64)
+            with open(path, 'wb') as f:
+                for start in range(0, len(rows), CHUNK_SIZE):
+                    chunk = rows[start:start + CHUNK_SIZE]
+                    integers = numpy.stack(
+                        [
+                            to_integers(chunk[:, i], w, signed, frac_bits)
+                            for i, w in enumerate(widths)
+                        ],
+                        axis=1
+                    )
+                    f.write(encode_text(integers, digits, radix))
+            return
+        rows = rows.tolist()
+    else:
+        rows = [
+            list(row) if isinstance(row, (list, tuple)) else [row]
+            for row in values
+        ]
+    widths = get_widths(width, len(rows[0]) if len(rows) > 0 else 1)
+    formats = [
+        '{0:0' + str(get_digits(w, radix)) + ('b' if radix == 2 else 'x') + '}'
+        for w in widths
+    ]
+    columns = [
+        to_integers(column, w, signed, frac_bits)
+        for column, w in zip(zip(*rows), widths)
+    ]
+    with open(path, 'w') as f:
+        for row in zip(*columns):
+            f.write(
+                ' '.join(fmt.format(v) for fmt, v in zip(formats, row)) + '\n'
+            )
+
+
+def decode_columns(integers, widths, signed=False, frac_bits=0):
+    """
+    Return the values of the 2D NumPy array of unsigned *integers* with
+    columns of the given *widths*: a 1D array if there is a single column,
+    otherwise a 2D array.
+    """
+    columns = [
+        from_integers(integers[:, i], width, signed, frac_bits)
+        for i, width in enumerate(widths)
+    ]
+    if len(columns) == 1:
+        return columns[0]
+    return numpy.stack(columns, axis=1)
+
+
+def decode_rows(rows, width, signed=False, frac_bits=0):
+    """
+    Return the values of the list of *rows* of unsigned integers: a list of
+    values if there is a single column, otherwise a list of rows. A NumPy
+    array is returned instead if the values are processed using NumPy.
+    """
+    widths = get_widths(width, len(rows[0]) if len(rows) > 0 else 1)
+    columns = [
+        from_integers(column, w, signed, frac_bits)
+        for column, w in zip(zip(*rows), widths)
+    ]
+    if len(columns) == 1:
+        values = columns[0]
+    else:
+        values = [list(row) for row in zip(*columns)]
+    if use_numpy(widths):
+        return numpy.array(values)
+    return values
+
+
+def parse_line(line, radix):
+    """
+    Return the list of *radix* integers in the *line* of bytes.
+    """
+    return [int(token, radix) for token in line.decode().split()]
+
+
+def get_layout(line, width, radix):
+    """
+    Return the (column widths, column digits) of the lines of a text file
+    given its first *line*, or None if the lines are not decoded using
+    NumPy.
+    """
+    tokens = line.split()
+    if numpy is None or len(tokens) == 0:
+        return None
+    widths = get_widths(width, len(tokens))
+    digits = [len(token) for token in tokens]
+    bits = get_radix_bits(radix)
+    if not use_numpy(widths + [count * bits for count in digits]):
+        return None
+    return widths, digits
+
+
+def read_text(path, width, radix=2, signed=False, frac_bits=0):
+    """
+    Read the *radix* 2 (binary) or 16 (hexadecimal) values of *width* bits
+    from the text file at *path*. If the lines hold a single value a 1D
+    array (or list) of values is returned, otherwise a 2D array (or list of
+    rows) is returned and the *width* can be a list of column widths. Blank
+    lines are ignored. A ValueError is raised if a value cannot be decoded,
+    for example if the testbench wrote a 'U' or 'X' metavalue.
+    """
+    get_radix_bits(radix)
+    with open(path, 'rb') as f:
+        data = f.read().replace(b'\r', b'')
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    # Files where every line has the layout of the first line are decoded
+    # using NumPy.
+    layout = get_layout(data.split(b'\n', 1)[0], width, radix)
+    if layout is not None:
+        widths, digits = layout
+        integers = decode_text(data, digits, radix)
+        if integers is not None:
+            return decode_columns(integers, widths, signed, frac_bits)
+    rows = [
+        parse_line(line, radix) for line in data.splitlines() if line.strip()
+    ]
+    return decode_rows(rows, width, signed, frac_bits)
+
+
+def release_pages(data, start, end):
+    """
+    Release the pages of the memory-mapped *data* between the offsets
+    *start* and *end* once they have been decoded, so that the resident
+    memory of a sequential read does not grow with the file size. Return
+    the offset of the first page that was not released.
+    """
+    end -= end % mmap.PAGESIZE
+    if end <= start or not hasattr(mmap, 'MADV_DONTNEED'):
+        return start
+    data.madvise(mmap.MADV_DONTNEED, start, end - start)
+    return end
+
+
+def iter_text(
+    path,
+    width,
+    radix=2,
+    signed=False,
+    frac_bits=0,
+    chunk_size=CHUNK_SIZE
+):
+    """
+    Return a generator yielding the values of the text file at *path* in
+    chunks of up to *chunk_size* lines, see *read_text* for the arguments
+    and chunk types. The file is memory-mapped and only one chunk is decoded
+    at a time, so files larger than memory can be compared against a model
+    with constant memory use.
+    """
+    get_radix_bits(radix)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = 0
+            released = 0
+            first = data.readline()
+            layout = get_layout(first, width, radix)
+            if layout is not None:
+                widths, digits = layout
+                # Windows line endings are removed before decoding
+                line_length = sum(digits) + len(digits)
+                window = chunk_size * (
+                    line_length + (1 if first.endswith(b'\r\n') else 0)
+                )
+                while position < len(data):
+                    chunk = data[position:position + window].replace(
+                        b'\r',
+                        b''
+                    )
+                    if not chunk.endswith(b'\n'):
+                        chunk += b'\n'
+                    integers = decode_text(chunk, digits, radix)
+                    if integers is None:
+                        # The line layout changed, decode the rest of the
+                        # file line by line.
+                        break
+                    position += window
+                    released = release_pages(data, released, position)
+                    yield decode_columns(integers, widths, signed, frac_bits)
+            data.seek(min(position, len(data)))
+            rows = []
+            for line in iter(data.readline, b''):
+                if line.strip():
+                    rows.append(parse_line(line, radix))
+                if len(rows) == chunk_size:
+                    released = release_pages(data, released, data.tell())
+                    yield decode_rows(rows, width, signed, frac_bits)
+                    rows = []
+            if len(rows) > 0:
+                yield decode_rows(rows, width, signed, frac_bits)
+
+
+def to_scalar(value):
+    """
+    Return the given *value* as a Python scalar if it is a NumPy scalar,
+    otherwise return it unchanged.
+    """
+    if numpy is not None and isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+def find_mismatch(chunks, expected, tolerance=0):
+    """
+    Compare the single column values yielded in *chunks* (see *iter_text*
+    and *iter_binary*) with the *expected* values, which may be a list, a
+    NumPy array or any iterable such as a generator of model values. Return
+    a tuple of (index, actual value, expected value) for the first value
+    that differs by more than *tolerance*, or None if all of the values
+    match. The index and values are returned as Python scalars. If there
+    are more actual than expected values (or fewer) the missing value is
+    reported as None. Comparison stops at the first mismatch, so the
+    remaining chunks are not read.
+    """
+    expected = iter(expected)
+    index = 0
+    for chunk in chunks:
+        model = list(itertools.islice(expected, len(chunk)))
+        count = min(len(chunk), len(model))
+        if numpy is not None and isinstance(chunk, numpy.ndarray):
+            errors = numpy.abs(
+                chunk[:count] - numpy.array(model[:count])
+            )
+            differ = numpy.nonzero(errors > tolerance)[0]
+            if len(differ) > 0:
+                i = int(differ[0])
+                return index + i, to_scalar(chunk[i]), to_scalar(model[i])
+        else:
+            for i in range(count):
+                if abs(chunk[i] - model[i]) > tolerance:
+                    return index + i, to_scalar(chunk[i]), to_scalar(model[i])
+        if count < len(chunk):
+            return index + count, to_scalar(chunk[count]), None
+        if count < len(model):
+            return index + count, None, to_scalar(model[count])
+        index += count
+    for value in expected:
+        return index, None, to_scalar(value)
+    return None
+
+
+def write_binary(
+    path,
+    values,
+    width,
+    signed=False,
+    frac_bits=0,
+    byteorder='little'
+):
+    """
+    Write the *values* to a raw binary file at *path* as integers of *width*
+    bits, each stored in the smallest whole number of bytes in the given
+    *byteorder*. A ValueError is raised if a value does not fit in *width*
+    bits.
+    """
+    size = (width + 7) // 8
+    with open(path, 'wb') as f:
+        if use_numpy([width]):
+            values = numpy.asarray(values)
+            shifts = numpy.arange(size, dtype=numpy.int64) * 8
+            if byteorder == 'big':
+                shifts = shifts[::-1]
+            for start in range(0, len(values), CHUNK_SIZE):
+                integers = to_integers(
+                    values[start:start + CHUNK_SIZE],
+                    width,
+                    signed,
+                    frac_bits
+                )
+                f.write(
+                    ((integers[:, None] >> shifts) & 0xFF).astype(
+                        numpy.uint8
+                    ).tobytes()
+                )
+            return
+        for value in to_integers(values, width, signed, frac_bits):
+            f.write(value.to_bytes(size, byteorder))
+
+
+def decode_binary(chars, width, byteorder='little'):
+    """
+    Return a 1D NumPy array of the unsigned integers encoded by the 2D NumPy
+    array of bytes *chars*, one row per value in the given *byteorder*.
+    """
+    shifts = numpy.arange(chars.shape[1], dtype=numpy.int64) * 8
+    if byteorder == 'big':
+        shifts = shifts[::-1]
+    integers = numpy.zeros(len(chars), dtype=numpy.int64)
+    for start in range(0, len(chars), CHUNK_SIZE):
+        integers[start:start + CHUNK_SIZE] = (
+            chars[start:start + CHUNK_SIZE].astype(numpy.int64) << shifts
+        ).sum(axis=1)
+    return integers
+
+
+def check_binary_size(path, size):
+    """
+    Raise a ValueError if the size of the file at *path* is not a multiple
+    of the value *size* in bytes.
+    """
+    if os.path.getsize(path) % size != 0:
+        raise ValueError(
+            'The size of {0} is not a multiple of {1} bytes'.format(
+                path,
+                size
+            )
+        )
+
+
+def read_binary(path, width, signed=False, frac_bits=0, byteorder='little'):
+    """
+    Read the values of *width* bits from the raw binary file at *path*, each
+    value is stored in the smallest whole number of bytes in the given
+    *byteorder*. A ValueError is raised if the file size is not a multiple
+    of the value size.
+    """
+    size = (width + 7) // 8
+    check_binary_size(path, size)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if use_numpy([width]):
+        chars = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, size)
+        integers = decode_binary(chars, width, byteorder)
+        return from_integers(integers, width, signed, frac_bits)
+    integers = [
+        int.from_bytes(data[i:i + size], byteorder)
+        for i in range(0, len(data), size)
+    ]
+    return from_integers(integers, width, signed, frac_bits)
+
+
+def iter_binary(
+    path,
+    width,
+    signed=False,
+    frac_bits=0,
+    byteorder='little',
+    chunk_size=CHUNK_SIZE
+):
+    """
+    Return a generator yielding the values of the raw binary file at *path*
+    in chunks of up to *chunk_size* values, see *read_binary* for the
+    arguments. The file is memory-mapped and only one chunk is decoded at a
+    time.
+    """
+    size = (width + 7) // 8
+    check_binary_size(path, size)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            released = 0
+            window = chunk_size * size
+            for position in range(0, len(data), window):
+                chunk = data[position:position + window]
+                if use_numpy([width]):
+                    chars = numpy.frombuffer(chunk, dtype=numpy.uint8)
+                    integers = decode_binary(
+                        chars.reshape(-1, size),
+                        width,
+                        byteorder
+                    )
+                else:
+                    integers = [
+                        int.from_bytes(chunk[i:i + size], byteorder)
+                        for i in range(0, len(chunk), size)
+                    ]
+                released = release_pages(data, released, position + window)
+                yield from_integers(integers, width, signed, frac_bits)
@@ -0,0 +1,241 @@
+"""
+A SimulatorSession keeps a simulator process running between simulations so
+that the cost of starting the simulator, checking out its licence and
+loading the design is only paid once per worker.
+
+The simulator is started as a console application that reads TCL commands
+from its standard input. Each simulation is run by writing a script to the
+command pipe; the script is wrapped so that the simulator prints a marker
+line with the number of the run and the TCL status of the script to each of
+its output streams when the script completes. The run completes when the
+marker is received on the standard output stream; the marker of the standard
+error stream is then waited for for at most *drain_timeout* seconds, so the
+run does not hang if the simulator redirects its standard error stream (in
+which case both markers are received on the standard output stream). The
+output received before the markers is captured in the same way as
+*utils.popen*: it is written to log files, searched for failure patterns and
+returned with a return code, which is the TCL status of the script (0 if it
+completed, 1 if a command failed) or the exit code of the simulator if it
+exited while running the script.
+"""
+
+import re
+import sys
+import logging
+import threading
+import subprocess
+
+from chiptools.common import utils
+from chiptools.common import exceptions
+
+log = logging.getLogger(__name__)
+
+
+class SimulatorSession:
+    """
+    A SimulatorSession runs the simulator *command* (a list of arguments)
+    in the working directory *cwd* and runs TCL scripts in it using *run*.
+    The *design* attribute is set by the simulator wrapper to identify the
+    design that is loaded in the simulator.
+    """
+    marker = 'CHIPTOOLS_SESSION_STATUS'
+    streams = ['stdout', 'stderr']
+    # Seconds to wait for the standard error marker after the run completes
+    drain_timeout = 5
+
+    def __init__(self, command, cwd=None):
+        self.command = command
+        self.cwd = cwd
+        self.design = None
+        self.status = None
+        self.run_number = 0
+        self.pattern = re.compile(
+            re.escape(self.marker) + r' (\d+) (stdout|stderr) (-?\d+)\s*$'
+        )
+        self.lock = threading.Lock()
+        self.files = dict((name, []) for name in self.streams)
+        self.events = dict(
+            (name, threading.Event()) for name in self.streams
+        )
+        self.readers = None
+        kwargs = {}
+        # Start the simulator in a new process group so that any processes
+        # that it creates can be killed with it.
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True
+        self.process = subprocess.Popen(
+            command,
+            cwd=cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **kwargs
+        )
+
+    def alive(self):
+        """Return True if the simulator process is running."""
+        return self.process.poll() is None
+
+    def read(self, name):
+        """
+        Read the lines of the output stream *name* of the simulator and
+        write them to the files of the current run until the stream closes.
+        """
+        stream = getattr(self.process, name)
+        for line in iter(stream.readline, b''):
+            line = line.decode('utf-8', errors='replace')
+            match = self.pattern.search(line)
+            if match is not None:
+                # The marker names the stream it was printed to, which is
+                # not the stream it is read from if the simulator redirects
+                # its standard error stream. Markers of an earlier run that
+                # was aborted are ignored.
+                with self.lock:
+                    current = int(match.group(1)) == self.run_number
+                if current:
+                    if match.group(2) == 'stdout':
+                        self.status = int(match.group(3))
+                    self.events[match.group(2)].set()
+                continue
+            with self.lock:
+                files = self.files[name]
+            for f in files:
+                f.write(line.rstrip() + '\n')  # Normalise line ends
+        stream.close()
+        # Wake the current run if the simulator exits
+        self.events[name].set()
+
+    def wrap(self, script):
+        """
+        Return the TCL *script* wrapped to print the marker line of the
+        current run with its status to each output stream when it completes.
+        """
+        marker = '{0} {1}'.format(self.marker, self.run_number)
+        return (
+            'set chiptools_status [catch {\n' +
+            script + '\n' +
+            '} chiptools_message]\n' +
+            'if {$chiptools_status} {puts stderr $chiptools_message}\n' +
+            'flush stderr\n' +
+            'puts "{0} stdout $chiptools_status"\n'.format(marker) +
+            'flush stdout\n' +
+            'puts stderr "{0} stderr $chiptools_status"\n'.format(marker) +
+            'flush stderr\n'
+        )
+
+    def run(
+        self,
+        script,
+        log_path=None,
+        echo=True,
+        failure_patterns=None,
+        timeout=None
+    ):
+        """
+        Run the TCL *script* in the simulator and return a tuple of the
+        return code, standard output and standard error streams of the
+        script. The *log_path*, *echo*, *failure_patterns* and *timeout*
+        arguments behave as they do for *utils.popen*: an AbortedError or an
+        ExecutionTimeout is raised if the script is aborted, in which case
+        the simulator is killed. The *timeout* applies to the standard output
+        marker, the standard error stream is drained for at most
+        *drain_timeout* seconds after it.
+        """
+        fout = utils.OutputLog(
+            None if log_path is None else log_path + '.stdout.log'
+        )
+        ferr = utils.OutputLog(
+            None if log_path is None else log_path + '.stderr.log'
+        )
+        monitor = None
+        if failure_patterns:
+            monitor = utils.FailureMonitor(failure_patterns, self.kill)
+        files = dict(
+            stdout=[fout] + ([utils.LogWrapper(log.info)] if echo else []),
+            stderr=[ferr] + ([utils.LogWrapper(log.error)] if echo else []),
+        )
+        if monitor is not None:
+            for name in self.streams:
+                files[name].append(monitor)
+        self.status = None
+        with self.lock:
+            self.files = files
+            self.run_number += 1
+            for name in self.streams:
+                self.events[name].clear()
+        if self.readers is None:
+            # The readers are started with the first run so that the output
+            # of the simulator start up is captured by it.
+            self.readers = []
+            for name in self.streams:
+                reader = threading.Thread(target=self.read, args=(name,))
+                reader.daemon = True
+                reader.start()
+                self.readers.append(reader)
+        try:
+            try:
+                self.process.stdin.write(self.wrap(script).encode('utf-8'))
+                self.process.stdin.flush()
+            except OSError:
+                # The simulator has exited, the readers wake this run.
+                pass
+            # Readers that have already reached the end of their stream
+            # will not wake this run.
+            for name, reader in zip(self.streams, self.readers):
+                if not reader.is_alive():
+                    self.events[name].set()
+            completed = self.events['stdout'].wait(timeout)
+            if completed and not self.events['stderr'].wait(
+                self.drain_timeout
+            ):
+                log.debug(
+                    'No standard error marker received from the simulator '
+                    'within {0} seconds'.format(self.drain_timeout)
+                )
+        finally:
+            with self.lock:
+                self.files = dict((name, []) for name in self.streams)
+            fout.close()
+            ferr.close()
+        if monitor is not None and monitor.match is not None:
+            self.kill()
+            raise exceptions.AbortedError(
+                'Output matched a failure pattern: ' + monitor.match,
+                match=monitor.match
+            )
+        if not completed:
+            self.kill()
+            raise exceptions.ExecutionTimeout(
+                'Timed out after {0} seconds: {1}'.format(
+                    timeout,
+                    ' '.join(self.command)
+                ),
+                timeout=timeout
+            )
+        if self.status is not None:
+            ret = self.status
+        else:
+            # The simulator exited before the script completed
+            ret = self.process.wait()
+        return ret, fout, ferr
+
+    def kill(self):
+        """Kill the simulator process and any processes it created."""
+        utils.kill_process(self.process)
+
+    def close(self, timeout=10):
+        """
+        Close the command pipe of the simulator, which ends its TCL console,
+        and wait up to *timeout* seconds for it to exit before killing it.
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            self.process.wait()
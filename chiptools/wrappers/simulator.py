@@ -1,6 +1,11 @@
+import hashlib
 import logging
 import os
+import re
+import shlex
+import shutil
 import time
+import traceback
 
 from chiptools.common import exceptions
 from chiptools.common import utils
@@ -24,12 +29,58 @@ class Simulator(ToolchainBase):
         )
         self.libraries = {}
 
+    # Simulators that can compile several source files in one invocation of
+    # their compiler set this flag and implement *compile_batch*; the files
+    # that need compiling are then collected by *compile_project* and passed
+    # to the wrapper in a single call.
+    batch_compile = False
+
+    # Directory (relative to the simulation working directory) holding the
+    # marker files of elaborated designs that can be reused.
+    elaboration_cache_name = '.elaborated'
+    # Number of elaborated designs kept in the shared simulation directory,
+    # the least recently used designs are removed beyond this.
+    elaboration_cache_size = 32
+
+    # Simulators that can be kept running between simulations and driven
+    # through their TCL console set this flag and implement
+    # *get_session_command* and *get_session_script*, refer to
+    # *simulate_warm*.
+    warm_simulation = False
+    session = None
+
+    # Executable name (one of *executables*) and arguments of the command
+    # that prints the simulator version, refer to *get_version*.
+    version_command = None
+    version = None
+
     def compile(self, file_object):
         """
         Compile the supplied *file_object* into the current working library.
         """
         raise NotImplementedError
 
+    def compile_batch(self, file_objects, cwd=None):
+        """
+        Compile the supplied list of *file_objects* in the order given. Each
+        *File* object carries its own target library. Wrappers that set
+        *batch_compile* should override this method to invoke their compilers
+        once per batch rather than once per file.
+        """
+        for file_object in file_objects:
+            self.compile(file_object, cwd=cwd)
+
+    def get_compile_arguments(self, file_object):
+        """
+        Return a list of the additional compile arguments for the given
+        *file_object*. Arguments set in the project configuration take
+        precedence over arguments attached to the file.
+        """
+        args = self.project.get_tool_arguments(self.name, 'compile')
+        if len(args) == 0:
+            args = file_object.get_tool_arguments(self.name, 'compile')
+        return shlex.split(['', args][args is not None])
+
     def simulate(self, library, entity, **kwargs):
         """
         Invoke the simulator and target the given *entity* in the given
@@ -44,7 +95,17 @@ class Simulator(ToolchainBase):
         present on the entity being simulated.
         The optional argument *do* can be used to supply a string argument to
         be interpreted by the simulator as a script to execute after loading.
-
+        The standard output and standard error streams are returned as
+        OutputLog objects (refer to *utils.popen*). The optional argument
+        *log_path* sets the prefix of the log files that the simulator output
+        is captured to.
+        The optional argument *failure_patterns* provides a list of regular
+        expressions that the simulator output is searched for as it is
+        received. If a line matches, the simulator is killed and an
+        AbortedError is raised.
+        The optional argument *timeout* sets the number of seconds that the
+        simulation may run for, if the simulator has not completed when it
+        expires the simulator is killed and an ExecutionTimeout is raised.
         """
         raise NotImplementedError
 
@@ -70,6 +131,387 @@ class Simulator(ToolchainBase):
         lib_path = os.path.join(workdir, libname)
         return os.path.isdir(lib_path)
 
+    def get_library_directory(self, libname, workdir):
+        """
+        Return the path that the library *libname* compiled in the *workdir*
+        is mapped to when it is used by other designs, refer to
+        *set_library_path*.
+        """
+        return os.path.join(workdir, libname)
+
+    def get_version(self):
+        """
+        Return the version string printed by the *version_command* of the
+        simulator, or an empty string if it could not be determined. The
+        version is read once for each simulator instance.
+        """
+        if self.version is None:
+            self.version = ''
+            if self.version_command is not None and self.installed:
+                executable = os.path.join(self.path, self.version_command[0])
+                try:
+                    ret, stdout, stderr = self._call(
+                        executable,
+                        list(self.version_command[1:])
+                    )
+                    self.version = (stdout or '').strip()
+                except:
+                    log.debug(traceback.format_exc())
+            log.debug('{0} version: {1}'.format(
+                self.name,
+                self.version or 'unknown'
+            ))
+        return self.version
+
+    def prepare_sandbox(self, path):
+        """
+        Prepare the sandbox directory given by *path* so that simulations
+        executed in it can use the libraries compiled into the project
+        simulation directory without modifying them. The default
+        implementation links each compiled project library into the sandbox,
+        wrappers that use library mapping files should override this method.
+        """
+        workdir = self.project.get_simulation_directory()
+        for libname in self.project.get_libraries().keys():
+            if self.library_exists(libname, workdir):
+                os.symlink(
+                    os.path.join(workdir, libname),
+                    os.path.join(path, libname),
+                    target_is_directory=True
+                )
+
+    @staticmethod
+    def copy_library_mappings(source, destination, section=None):
+        """
+        Copy the library mapping file *source* to *destination*, converting
+        relative library paths into absolute paths (relative to the directory
+        containing *source*) so that the mappings remain valid when used from
+        another directory. If *section* is supplied only the mappings in that
+        INI file section are converted.
+        """
+        root = os.path.dirname(os.path.abspath(source))
+        current_section = None
+        with open(source, 'r') as fin, open(destination, 'w') as fout:
+            for line in fin:
+                stripped = line.strip()
+                if stripped.startswith('['):
+                    current_section = stripped.strip('[]').lower()
+                elif section is None or current_section == section.lower():
+                    match = re.match(
+                        r'^(\s*[^\s;#=-][^=]*=\s*)(\S.*?)\s*$',
+                        line
+                    )
+                    if match is not None:
+                        path = match.group(2)
+                        if not os.path.isabs(path) and path[0] != '$':
+                            line = '{0}{1}\n'.format(
+                                match.group(1),
+                                os.path.normpath(os.path.join(root, path))
+                            )
+                fout.write(line)
+
+    def get_design_fingerprint(self, paths=None):
+        """
+        Return a string that identifies the compiled state of the project
+        design files for this simulator. If a list of *paths* is given the
+        fingerprint only covers those files.
+        """
+        return self.project.cache.get_fingerprint(self.name, paths)
+
+    def get_elaboration_key(self, library, entity, generics={}, **kwargs):
+        """
+        Return a short key identifying an elaborated design: the top level
+        *library* and *entity*, the elaboration *generics*, any additional
+        keyword arguments that affect elaboration and the design fingerprint.
+        Simulations with matching keys can reuse the same elaborated design.
+        """
+        digest = hashlib.sha1()
+        digest.update(
+            repr((
+                library.lower(),
+                entity.lower(),
+                sorted((str(k), str(v)) for k, v in generics.items()),
+                sorted((str(k), str(v)) for k, v in kwargs.items()),
+                self.get_design_fingerprint(),
+            )).encode('utf-8')
+        )
+        return digest.hexdigest()[:12]
+
+    def is_elaborated(self, name, key, cwd):
+        """
+        Return True if the elaborated design output *name* (for example a
+        snapshot or executable name) in the working directory *cwd* was built
+        from the design identified by the elaboration *key*.
+        """
+        path = os.path.join(cwd, self.elaboration_cache_name, name)
+        if not os.path.exists(path):
+            return False
+        with open(path, 'r') as f:
+            return f.read().strip() == key
+
+    def set_elaborated(self, name, key, cwd):
+        """
+        Record that the elaborated design output *name* in the working
+        directory *cwd* was built from the design identified by the
+        elaboration *key*. If *key* is None the record is removed.
+        """
+        root = os.path.join(cwd, self.elaboration_cache_name)
+        path = os.path.join(root, name)
+        if key is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(key + '\n')
+
+    def get_elaboration_outputs(self, name):
+        """
+        Return the list of paths (relative to the working directory) of the
+        files and directories that make up the elaborated design output
+        *name*. Wrappers that use *elaborate_once* override this method.
+        """
+        return [name]
+
+    def elaborate_once(self, name, key, elaborate):
+        """
+        Make the elaborated design output *name*, built from the design
+        identified by the elaboration *key*, available in the simulation
+        working directory.
+
+        Elaborated designs are cached in the shared simulation directory
+        (refer to *Project.get_shared_simulation_directory*) so that they
+        are reused by every worker and run. If the design has not been
+        elaborated the *elaborate* function is called with the shared
+        directory as its argument. A lock file per output serialises
+        concurrent workers, so each design is elaborated once; sandboxes
+        then receive a copy of the outputs (see *get_elaboration_outputs*).
+        The least recently used designs beyond *elaboration_cache_size* are
+        removed from the cache.
+        """
+        cwd = self.project.get_simulation_directory()
+        shared = self.project.get_shared_simulation_directory()
+        root = os.path.join(shared, self.elaboration_cache_name)
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+        built = False
+        with utils.file_lock(os.path.join(root, name + '.lock')):
+            if self.is_elaborated(name, key, shared):
+                log.info('...reusing elaborated design: ' + name)
+                # Record the use for the least recently used pruning
+                os.utime(os.path.join(root, name))
+            else:
+                log.info('...elaborating design: ' + name)
+                self.set_elaborated(name, None, shared)
+                elaborate(shared)
+                self.set_elaborated(name, key, shared)
+                built = True
+            if (
+                os.path.abspath(cwd) != os.path.abspath(shared) and
+                not self.is_elaborated(name, key, cwd)
+            ):
+                self.set_elaborated(name, None, cwd)
+                for output in self.get_elaboration_outputs(name):
+                    Simulator.copy_output(
+                        os.path.join(shared, output),
+                        os.path.join(cwd, output)
+                    )
+                self.set_elaborated(name, key, cwd)
+        # Pruning takes the lock of each removed design, so it is done after
+        # releasing the lock of this design.
+        if built:
+            self.prune_elaborated(shared)
+
+    def prune_elaborated(self, cwd):
+        """
+        Remove the least recently used elaborated designs in the working
+        directory *cwd* beyond the *elaboration_cache_size*.
+        """
+        root = os.path.join(cwd, self.elaboration_cache_name)
+        markers = []
+        for name in os.listdir(root):
+            if name.endswith('.lock'):
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(root, name))
+            except OSError:
+                continue
+            markers.append((mtime, name))
+        markers.sort()
+        count = max(0, len(markers) - self.elaboration_cache_size)
+        for _, name in markers[:count]:
+            with utils.file_lock(os.path.join(root, name + '.lock')):
+                log.debug('Removing elaborated design: ' + name)
+                self.set_elaborated(name, None, cwd)
+                for output in self.get_elaboration_outputs(name):
+                    Simulator.remove_output(os.path.join(cwd, output))
+
+    @staticmethod
+    def copy_output(source, destination):
+        """
+        Copy the elaborated design output file or directory *source* to
+        *destination*, replacing any existing copy. Missing outputs are
+        ignored.
+        """
+        if not os.path.exists(source):
+            return
+        Simulator.remove_output(destination)
+        directory = os.path.dirname(destination)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        if os.path.isdir(source):
+            shutil.copytree(source, destination, symlinks=True)
+        else:
+            shutil.copy2(source, destination)
+
+    @staticmethod
+    def remove_output(path):
+        """Remove the elaborated design output file or directory *path*."""
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                # The output may still be in use on Windows
+                pass
+
+    def use_warm_simulation(self, gui=False):
+        """
+        Return True if console simulations should be run in a warm
+        simulator session: the simulator supports it and it is enabled by
+        the project 'warm_simulation' configuration item.
+        """
+        return (
+            self.warm_simulation and
+            not gui and
+            self.project.get_warm_simulation()
+        )
+
+    def get_session_command(self, library, entity, generics, includes, args):
+        """
+        Return the command (a list of arguments) that starts the simulator
+        as a console reading TCL commands from its standard input, ready to
+        simulate the given *entity* in the given *library*.
+        """
+        raise NotImplementedError
+
+    def get_session_script(
+        self,
+        library,
+        entity,
+        generics,
+        includes,
+        args,
+        duration,
+        reload
+    ):
+        """
+        Return the TCL script that runs a simulation of the given *entity*
+        in the given *library* for *duration* seconds in the warm simulator
+        session. If *reload* is True the design loaded in the session (if
+        any) is not the one required and must be loaded by the script,
+        otherwise the loaded design only needs to be restarted.
+        """
+        raise NotImplementedError
+
+    def simulate_warm(
+        self,
+        library,
+        entity,
+        generics={},
+        includes={},
+        args=[],
+        duration=None,
+        log_path=None,
+        failure_patterns=None,
+        timeout=None
+    ):
+        """
+        Run a simulation in a warm simulator session that is kept running
+        between simulations, so that the simulator is only launched (and
+        its licence checked out) once. The design is restarted between
+        simulations and is only loaded again when the top level, generics,
+        arguments or compiled design change. The arguments and the returned
+        tuple of return code, standard output and standard error are the
+        same as for *simulate*; if the simulation fails the session is
+        closed so that the next simulation starts with a fresh simulator.
+        """
+        # Imported here to keep the session threads out of tool imports
+        from chiptools.wrappers.session import SimulatorSession
+        cwd = self.project.get_simulation_directory()
+        command = self.get_session_command(
+            library,
+            entity,
+            generics,
+            includes,
+            args
+        )
+        design = self.get_elaboration_key(
+            library,
+            entity,
+            generics,
+            includes=sorted(includes.keys()),
+            args=args
+        )
+        session = self.session
+        if (
+            session is None or
+            session.command != command or
+            session.cwd != cwd or
+            not session.alive()
+        ):
+            self.close_session()
+            log.info('...starting simulator session: ' + ' '.join(command))
+            session = SimulatorSession(command, cwd)
+            self.session = session
+        else:
+            log.info('...reusing simulator session')
+        script = self.get_session_script(
+            library,
+            entity,
+            generics,
+            includes,
+            args,
+            duration,
+            reload=session.design != design
+        )
+        session.design = None
+        try:
+            ret, stdout, stderr = session.run(
+                script,
+                log_path=log_path,
+                echo=self.project.get_simulation_echo(),
+                failure_patterns=failure_patterns,
+                timeout=timeout
+            )
+        except:
+            self.close_session()
+            raise
+        if ret != 0:
+            self.close_session()
+            raise exceptions.ExecutionError(
+                utils.get_error_string(stdout, stderr),
+                return_code=ret
+            )
+        session.design = design
+        return ret, stdout, stderr
+
+    def close_session(self):
+        """Close the warm simulator session, if one is running."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    @staticmethod
+    def tcl_quote(arguments):
+        """
+        Return the given list of *arguments* as a string of TCL words, each
+        braced so that it is passed to the command unchanged.
+        """
+        return ' '.join('{' + str(argument) + '}' for argument in arguments)
+
     def compile_project(self, includes={}):
         self.libraries.update(includes)
         for libname, path in includes.items():
@@ -83,6 +525,7 @@ class Simulator(ToolchainBase):
             force = False
             # Compile each of the sources in the project file
             created_libraries = []
+            batch = []
             skipped = 0
             count = 0
             start_time = time.time()
@@ -131,8 +574,11 @@ class Simulator(ToolchainBase):
                                 file_object.fileType,
                                 libname)
                         )
-                        # Compile the source
-                        self.compile(file_object, cwd=cwd)
+                        # Compile the source, or defer it to the batch
+                        if self.batch_compile:
+                            batch.append(file_object)
+                        else:
+                            self.compile(file_object, cwd=cwd)
                     else:
                         log.error(
                             'File could not be found: ' +
@@ -140,12 +586,27 @@ class Simulator(ToolchainBase):
                                 file_object.path
                             )
                         )
+                        # Files queued for batch compilation were never
+                        # compiled so they must not be marked as up to date
+                        for batched in batch:
+                            cache.remove_file(batched, self.name)
                         return
+                if len(batch) > 0:
+                    log.info(
+                        '...compiling {0} file(s) in batch mode'.format(
+                            len(batch)
+                        )
+                    )
+                    self.compile_batch(batch, cwd=cwd)
             except:
                 # Clear the SHA1 for the file that failed so it will recompile
                 # next time
                 if file_object is not None:
                     cache.remove_file(file_object, self.name)
+                # A failed batch cannot be attributed to a single file, so
+                # every file in the batch is recompiled next time
+                for batched in batch:
+                    cache.remove_file(batched, self.name)
                 cache.save_cache()
                 raise
             if skipped > 0:
@@ -1,6 +1,10 @@
 import logging
 import os
+import re
+import sys
 import shlex
+import shutil
+import traceback
 
 from chiptools.wrappers.simulator import Simulator
 from chiptools.common.filetypes import FileType
@@ -14,9 +18,21 @@ class Ghdl(Simulator):
     name = 'ghdl'
     executables = ['ghdl']
 
+    # Code generators that elaborate designs into executables
+    executable_backends = ['llvm', 'gcc']
+    # Directory (relative to the simulation working directory) holding the
+    # elaborated executables, which is shared with simulation sandboxes.
+    executable_directory_name = '.executables'
+    executable_suffix = '.exe' if sys.platform == 'win32' else ''
+    version_command = ['ghdl', '--version']
+
     def __init__(self, project, user_paths):
         super(Ghdl, self).__init__(project, self.executables, user_paths)
         self.ghdl = os.path.join(self.path, 'ghdl')
+        self.backend = None
+        # Library name : directory of the library (.cf) files of the
+        # libraries compiled outside of the simulation directory.
+        self.library_paths = {}
 
     def simulate(
         self,
@@ -26,56 +42,202 @@ class Ghdl(Simulator):
         generics={},
         includes={},
         args=[],
-        duration=None
+        duration=None,
+        log_path=None,
+        failure_patterns=None,
+        timeout=None
     ):
-        # Elaborate
-        args = [
-            '-e',
-            '--work=' + library,
-            entity,
-        ]
-        Ghdl._call(
-            self.ghdl, args, cwd=self.project.get_simulation_directory()
-        )
-        # Run command
-        args = [
-            '-r',
-            '--work=' + library,
-        ]
-        # Map any generics
+        """
+        Run a simulation of the given *entity* in the given *library*. GHDL
+        binds generics at run time, so with the LLVM and GCC code generators
+        the design is elaborated once into an executable that is shared by
+        the simulations of the entity (refer to *get_executable*) and the
+        executable is run directly with the generics and stop time. Other
+        code generators (mcode) do not build executables, so the design is
+        run by *ghdl -r* for each simulation.
+        """
+        cwd = self.project.get_simulation_directory()
+        # Runtime options: map any generics and set the stop time
+        options = []
         for name, binding in generics.items():
-            args += ['-g{0}={1}'.format(name, binding)]
+            options += ['-g{0}={1}'.format(name, binding)]
         if duration is not None:
             if duration > 0:
-                args += [
+                options += [
                     '--stop-time=' + utils.seconds_to_timestring(duration)
                 ]
+        if self.get_backend() in self.executable_backends:
+            executable = self.get_executable(library, entity, includes)
+            args = options
+        else:
+            self.elaborate(library, entity, includes)
+            executable = self.ghdl
+            args = (
+                ['-r', '--work=' + library] +
+                self.get_library_options(includes) +
+                options +
+                [entity]
+            )
         # Run the simulation
-        args += [entity]
         ret, stdout, stderr = Ghdl._call(
-            self.ghdl,
+            executable,
             args,
-            cwd=self.project.get_simulation_directory(),
-            quiet=False
+            cwd=cwd,
+            quiet=False,
+            log_path=log_path,
+            echo=self.project.get_simulation_echo(),
+            failure_patterns=failure_patterns,
+            timeout=timeout
         )
 
         return ret, stdout, stderr
 
+    def get_backend(self):
+        """
+        Return the name of the code generator used by GHDL ('mcode', 'llvm'
+        or 'gcc') as reported by *ghdl --version*, or an empty string if it
+        could not be determined.
+        """
+        if self.backend is None:
+            self.backend = ''
+            version = self.get_version().lower()
+            if 'mcode' in version:
+                self.backend = 'mcode'
+            elif 'llvm' in version:
+                self.backend = 'llvm'
+            elif 'gcc' in version:
+                self.backend = 'gcc'
+            log.debug('GHDL code generator: ' + (self.backend or 'unknown'))
+        return self.backend
+
+    def get_library_options(self, includes=None):
+        """
+        Return the list of *-P* options that add the directories of the
+        libraries compiled outside of the simulation directory (the
+        libraries given to *set_library_path* and the *includes* dictionary
+        of library name : directory) to the GHDL library search path.
+        """
+        paths = list(self.library_paths.values())
+        paths += list((includes or {}).values())
+        options = []
+        for path in paths:
+            option = '-P' + os.path.abspath(path)
+            if option not in options:
+                options.append(option)
+        return options
+
+    def elaborate(self, library, entity, includes=None):
+        """
+        Elaborate the given *entity* in the given *library* for *ghdl -r*,
+        unless it has already been elaborated from the current design
+        (refer to *elaborate_once*). The *includes* dictionary gives the
+        directories of additional libraries, see *get_library_options*.
+        """
+        options = self.get_library_options(includes)
+        self.elaborate_once(
+            entity,
+            self.get_elaboration_key(library, entity, libraries=options),
+            lambda directory: Ghdl._call(
+                self.ghdl,
+                ['-e', '--work=' + library] + options + [entity],
+                cwd=directory,
+                timeout=self.project.get_tool_timeout(self.name, 'elaborate')
+            )
+        )
+
+    def get_elaboration_outputs(self, name):
+        """
+        Return the path of the executable that GHDL may generate for the
+        entity *name* when elaborating without an output file name.
+        """
+        return [name.lower() + self.executable_suffix]
+
+    def get_executable(self, library, entity, includes=None):
+        """
+        Return the path to the executable of the given *entity* in the given
+        *library* elaborated from the current design, elaborating it if
+        required. The *includes* dictionary gives the directories of
+        additional libraries, see *get_library_options*.
+
+        Executables are stored in the executable directory of the
+        simulation directory, which is shared with simulation sandboxes, and
+        are named using the elaboration key of the design so that an
+        executable is only built again when the design changes. Concurrent
+        workers elaborate an executable under a lock file: the first worker
+        builds it into a temporary file that is moved into place when
+        complete, the others wait for the lock and reuse the result.
+        """
+        cwd = self.project.get_simulation_directory()
+        root = os.path.join(cwd, self.executable_directory_name)
+        options = self.get_library_options(includes)
+        key = self.get_elaboration_key(library, entity, libraries=options)
+        prefix = '{0}_{1}_'.format(library, entity).lower()
+        path = os.path.join(root, prefix + key + self.executable_suffix)
+        if os.path.exists(path):
+            log.info('...reusing elaborated design: ' + path)
+            return path
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+        with utils.file_lock(os.path.join(root, prefix + 'lock')):
+            if os.path.exists(path):
+                log.info('...reusing elaborated design: ' + path)
+                return path
+            log.info('...elaborating {0}.{1}'.format(library, entity))
+            temp = '{0}.{1}.tmp'.format(path, os.getpid())
+            try:
+                Ghdl._call(
+                    self.ghdl,
+                    ['-e', '--work=' + library, '-o', temp] + options +
+                    [entity],
+                    cwd=cwd,
+                    timeout=self.project.get_tool_timeout(
+                        self.name,
+                        'elaborate'
+                    )
+                )
+                os.replace(temp, path)
+            finally:
+                if os.path.exists(temp):
+                    os.remove(temp)
+            self.remove_executables(root, prefix, path)
+        return path
+
+    @classmethod
+    def remove_executables(cls, root, prefix, path):
+        """
+        Remove the executables in the *root* directory that were elaborated
+        from previous designs of the entity with the given name *prefix*,
+        keeping the executable at *path*. Only names made of the prefix and
+        an elaboration key are removed so that the executables of entities
+        whose names start with the same prefix, lock files and the temporary
+        files of other workers are kept.
+        """
+        pattern = re.compile(
+            re.escape(prefix) + '[0-9a-f]{12}' +
+            re.escape(cls.executable_suffix) + '$'
+        )
+        for name in os.listdir(root):
+            if pattern.match(name) and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    # The executable may still be running on Windows
+                    pass
+
     def compile(self, file_object, cwd=None):
         args = self.project.get_tool_arguments(self.name, 'compile')
         if len(args) == 0:
             args = file_object.get_tool_arguments(self.name, 'compile')
         args = shlex.split(['', args][args is not None])
-        args += [
-            '-a',
-            '--work=' + file_object.library,
-            file_object.path
-        ]
+        args += ['-a', '--work=' + file_object.library]
+        args += self.get_library_options()
+        args += [file_object.path]
         if file_object.fileType == FileType.VHDL:
             Ghdl._call(
                 self.ghdl,
                 args,
-                cwd=self.project.get_simulation_directory()
+                cwd=self.project.get_simulation_directory(),
+                timeout=self.project.get_tool_timeout(self.name, 'compile')
             )
         else:
             log.warning(
@@ -95,11 +257,52 @@ class Ghdl(Simulator):
                 return True
         return False
 
+    def get_library_directory(self, libname, workdir):
+        """
+        Return the directory holding the library *libname* compiled in the
+        *workdir*: GHDL writes the library files directly into the working
+        directory.
+        """
+        return workdir
+
     def set_working_library(self, library, cwd=None):
         pass
 
     def set_library_path(self, library, path, cwd=None):
-        pass
+        """
+        Add the directory *path* holding the compiled *library* to the
+        library search path used to compile and elaborate the design.
+        """
+        self.library_paths[library] = path
 
     def add_library(self, library):
         pass
+
+    def prepare_sandbox(self, path):
+        """
+        Link the GHDL library (.cf) and object (.o) files from the simulation
+        directory into the sandbox given by *path*. Files are copied instead
+        if the platform does not permit symbolic links. The directory of
+        elaborated executables is also linked so that sandboxes share them,
+        if it cannot be linked each sandbox elaborates its own executables.
+        """
+        workdir = self.project.get_simulation_directory()
+        executables = os.path.join(workdir, self.executable_directory_name)
+        try:
+            if not os.path.exists(executables):
+                os.makedirs(executables, exist_ok=True)
+            os.symlink(
+                executables,
+                os.path.join(path, self.executable_directory_name),
+                target_is_directory=True
+            )
+        except (OSError, NotImplementedError):
+            log.debug(traceback.format_exc())
+        for name in os.listdir(workdir):
+            if name.endswith('.cf') or name.endswith('.o'):
+                source = os.path.join(workdir, name)
+                destination = os.path.join(path, name)
+                try:
+                    os.symlink(source, destination)
+                except (OSError, NotImplementedError):
+                    shutil.copy2(source, destination)
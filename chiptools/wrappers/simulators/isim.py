@@ -1,6 +1,5 @@
 import logging
 import os
-import shlex
 
 from chiptools.wrappers.simulator import Simulator
 from chiptools.common.filetypes import FileType
@@ -13,12 +12,19 @@ class Isim(Simulator):
 
     name = 'isim'
     executables = ['fuse', 'vlogcomp', 'vhpcomp']
+    version_command = ['fuse', '-version']
 
-    # Name of the output file generated by fuse
+    # Name of the output file generated by fuse, a hash identifying the
+    # elaborated design is appended to this name
     sim_exe_name = 'fuse_sim'
     sim_project_name = 'isim_project.prj'
     sim_ini_name = 'xilinxsim.ini'
     sim_tcl_name = 'isim.tcl'
+    # Project files used to pass batches of sources to vhpcomp and vlogcomp
+    vhdl_project_name = 'vhpcomp.prj'
+    verilog_project_name = 'vlogcomp.prj'
+
+    batch_compile = True
 
     def __init__(self, project, user_paths):
         super(Isim, self).__init__(project, self.executables, user_paths)
@@ -56,18 +62,35 @@ class Isim(Simulator):
         generics={},
         includes={},
         args=[],
-        duration=None
+        duration=None,
+        log_path=None,
+        failure_patterns=None,
+        timeout=None
     ):
         cwd = self.project.get_simulation_directory()
-        # Execute FUSE on the design files:
-        fuse_args = [
-            library + '.' + entity,
-            '-o', self.sim_exe_name,
-        ]
-        # Set simulator generics
-        for name, binding in generics.items():
-            fuse_args += ['--generic_top', name + '=' + str(binding)]
-        Isim._call(self.fuse, fuse_args, cwd=cwd, quiet=False)
+        # Simulation executables are named using a hash of the top level,
+        # generics and design so that simulations sharing them can skip
+        # elaboration.
+        key = self.get_elaboration_key(library, entity, generics)
+        sim_exe_name = '{0}_{1}'.format(self.sim_exe_name, key)
+
+        def elaborate(directory):
+            # Execute FUSE on the design files:
+            fuse_args = [
+                library + '.' + entity,
+                '-o', sim_exe_name,
+            ]
+            # Set simulator generics
+            for name, binding in generics.items():
+                fuse_args += ['--generic_top', name + '=' + str(binding)]
+            Isim._call(
+                self.fuse,
+                fuse_args,
+                cwd=directory,
+                quiet=False,
+                timeout=self.project.get_tool_timeout(self.name, 'elaborate')
+            )
+        self.elaborate_once(sim_exe_name, key, elaborate)
         # Fuse generates a simulation executable, this can be called now with
         # the specified simulator arguments:
         sim_args = []
@@ -86,23 +109,32 @@ class Isim(Simulator):
         sim_args += ['-tclbatch', self.sim_tcl_name]
         # Run the simulation
         ret, stdout, stderr = Isim._call(
-            os.path.join(cwd, self.sim_exe_name),
+            os.path.join(cwd, sim_exe_name),
             sim_args,
             cwd=self.project.get_simulation_directory(),
-            quiet=False
+            quiet=False,
+            log_path=log_path,
+            echo=self.project.get_simulation_echo(),
+            failure_patterns=failure_patterns,
+            timeout=timeout
         )
 
         return ret, stdout, stderr
 
+    def get_elaboration_outputs(self, name):
+        """
+        Return the paths of the simulation executable *name* generated by
+        fuse and of its ISim database directory.
+        """
+        return [name, os.path.join('isim', name + '.sim')]
+
     def compile(self, file_object, cwd=None):
         cwd = self.project.get_simulation_directory()
         if file_object.library not in self.libraries:
             self.libraries[file_object.library] = file_object.library
             self.write_includes()
-        args = self.project.get_tool_arguments(self.name, 'compile')
-        if len(args) == 0:
-            args = file_object.get_tool_arguments(self.name, 'compile')
-        args = shlex.split(['', args][args is not None])
+        args = self.get_compile_arguments(file_object)
+        timeout = self.project.get_tool_timeout(self.name, 'compile')
         args += [
             '-incremental',
             '-work',
@@ -110,17 +142,78 @@ class Isim(Simulator):
             file_object.path
         ]
         if file_object.fileType == FileType.VHDL:
-            Isim._call(self.vhpcomp, args, cwd=cwd)
+            Isim._call(self.vhpcomp, args, cwd=cwd, timeout=timeout)
         elif file_object.fileType == FileType.Verilog:
-            Isim._call(self.vlogcomp, args, cwd=cwd)
+            Isim._call(self.vlogcomp, args, cwd=cwd, timeout=timeout)
         elif file_object.fileType == FileType.SystemVerilog:
-            Isim._call(self.vlogcomp, args, cwd=cwd)
+            Isim._call(self.vlogcomp, args, cwd=cwd, timeout=timeout)
         else:
             log.warning(
                 'ISIM wrapper skipping file with unknown type: ' +
                 file_object.path
             )
 
+    def compile_batch(self, file_objects, cwd=None):
+        """
+        Compile the supplied *file_objects* by listing them in a project
+        (.prj) file so that vhpcomp and vlogcomp are each invoked once for the
+        batch instead of once per file. The xilinxsim.ini library mapping is
+        written once before compilation starts. Consecutive files that use
+        the same compiler and compile arguments are compiled together, so
+        the project compile order is preserved across the batches.
+        """
+        cwd = self.project.get_simulation_directory()
+        for file_object in file_objects:
+            if file_object.library not in self.libraries:
+                self.libraries[file_object.library] = file_object.library
+        self.write_includes()
+        groups = []
+        for file_object in file_objects:
+            if file_object.fileType == FileType.VHDL:
+                executable = self.vhpcomp
+                project_name = self.vhdl_project_name
+                language = 'vhdl'
+            elif file_object.fileType in [
+                FileType.Verilog,
+                FileType.SystemVerilog
+            ]:
+                executable = self.vlogcomp
+                project_name = self.verilog_project_name
+                language = 'verilog'
+            else:
+                log.warning(
+                    'ISIM wrapper skipping file with unknown type: ' +
+                    file_object.path
+                )
+                continue
+            key = (
+                executable,
+                project_name,
+                tuple(self.get_compile_arguments(file_object))
+            )
+            # A file only joins the previous group if it directly follows
+            # it, a dependency must never be compiled after its users.
+            if len(groups) == 0 or groups[-1][0] != key:
+                groups.append((key, []))
+            groups[-1][1].append((language, file_object))
+        for (executable, project_name, args), entries in groups:
+            project_path = os.path.join(cwd, project_name)
+            with open(project_path, 'w') as f:
+                for language, file_object in entries:
+                    f.write(
+                        '{0} {1} \"{2}\"\n'.format(
+                            language,
+                            file_object.library,
+                            file_object.path
+                        )
+                    )
+            Isim._call(
+                executable,
+                list(args) + ['-incremental', '-prj', project_name],
+                cwd=cwd,
+                timeout=self.project.get_tool_timeout(self.name, 'compile')
+            )
+
     def library_exists(self, libname, workdir):
         if os.path.exists(os.path.join(workdir, libname)):
             return True
@@ -134,3 +227,19 @@ class Isim(Simulator):
 
     def add_library(self, library):
         pass
+
+    def prepare_sandbox(self, path):
+        """
+        Copy the xilinxsim.ini library mappings from the simulation directory
+        into the sandbox given by *path*, converting relative library paths
+        into absolute paths.
+        """
+        source = os.path.join(
+            self.project.get_simulation_directory(),
+            self.sim_ini_name
+        )
+        if os.path.exists(source):
+            Isim.copy_library_mappings(
+                source,
+                os.path.join(path, self.sim_ini_name)
+            )
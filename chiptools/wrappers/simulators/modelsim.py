@@ -21,6 +21,11 @@ class Modelsim(Simulator):
 
     name = 'modelsim'
     executables = ['vcom', 'vlib', 'vlog', 'vmap', 'vsim']
+    version_command = ['vsim', '-version']
+
+    sim_ini_name = 'modelsim.ini'
+
+    warm_simulation = True
 
     def __init__(self, project, user_paths):
         super(Modelsim, self).__init__(project, self.executables, user_paths)
@@ -38,7 +43,10 @@ class Modelsim(Simulator):
         generics={},
         includes={},
         args=[],
-        duration=None
+        duration=None,
+        log_path=None,
+        failure_patterns=None,
+        timeout=None
     ):
         """
         Invoke the simulator and target the given *entity* in the given
@@ -53,17 +61,29 @@ class Modelsim(Simulator):
         the entity being simulated.
         The optional argument *do* can be used to supply a string argument to
         be interpreted by the simulator as a script to execute after loading.
+        The optional argument *log_path* sets the prefix of the log files that
+        the simulator output is captured to.
+        The optional argument *failure_patterns* provides a list of regular
+        expressions, the simulation is aborted if its output matches any of
+        them. The optional argument *timeout* sets the number of seconds
+        that the simulation may run for before it is aborted.
+        If the project 'warm_simulation' configuration item is set, console
+        simulations are run in a vsim session that is kept running between
+        simulations (refer to *simulate_warm*).
         """
-        # Add any custom arguments from the project file
-        arguments = self.project.get_tool_arguments(self.name, 'simulate')
-        arguments = shlex.split(['', arguments][arguments is not None])
-        arguments += args
-        # Add any includes
-        for libname, path in includes.items():
-            arguments += ['-L', libname]
-        # Map any generics
-        for name, binding in generics.items():
-            arguments += ['-G{0}={1}'.format(name, binding)]
+        if self.use_warm_simulation(gui):
+            return self.simulate_warm(
+                library,
+                entity,
+                generics=generics,
+                includes=includes,
+                args=args,
+                duration=duration,
+                log_path=log_path,
+                failure_patterns=failure_patterns,
+                timeout=timeout
+            )
+        arguments = self.get_simulate_arguments(generics, includes, args)
         # Enable or disable the GUI
         arguments += [['-c'], ['-i']][gui]
         # Apply any DO commands
@@ -81,10 +101,74 @@ class Modelsim(Simulator):
             self.vsim,
             arguments,
             cwd=self.project.get_simulation_directory(),
-            quiet=False
+            quiet=False,
+            log_path=log_path,
+            echo=self.project.get_simulation_echo(),
+            failure_patterns=failure_patterns,
+            timeout=timeout
         )
         return ret, stdout, stderr
 
+    def get_simulate_arguments(self, generics, includes, args):
+        """
+        Return the list of vsim arguments that load a design with the given
+        *generics*, *includes* and additional *args*.
+        """
+        # Add any custom arguments from the project file
+        arguments = self.project.get_tool_arguments(self.name, 'simulate')
+        arguments = shlex.split(['', arguments][arguments is not None])
+        arguments += args
+        # Add any includes
+        for libname, path in includes.items():
+            arguments += ['-L', libname]
+        # Map any generics
+        for name, binding in generics.items():
+            arguments += ['-G{0}={1}'.format(name, binding)]
+        return arguments
+
+    def get_session_command(self, library, entity, generics, includes, args):
+        """
+        Return the command that starts vsim as a console without a design,
+        designs are loaded by the session scripts.
+        """
+        return [self.vsim, '-c']
+
+    def get_session_script(
+        self,
+        library,
+        entity,
+        generics,
+        includes,
+        args,
+        duration,
+        reload
+    ):
+        """
+        Return the TCL script that runs a simulation in the vsim console: if
+        *reload* is True any loaded design is closed and the design is
+        loaded with its generics, otherwise the loaded design is restarted
+        with *restart -f*.
+        """
+        if reload:
+            script = 'catch {quit -sim}\n'
+            script += 'vsim -onfinish stop {0} {{{1}.{2}}}\n'.format(
+                Modelsim.tcl_quote(
+                    self.get_simulate_arguments(generics, includes, args)
+                ),
+                library,
+                entity
+            )
+        else:
+            script = 'restart -f\n'
+        script += 'set NumericStdNoWarnings 1\n'
+        if duration is not None:
+            if duration <= 0:
+                duration = '-all'
+            else:
+                duration = utils.seconds_to_timestring(duration)
+            script += 'run ' + duration + '\n'
+        return script
+
     def compile(self, file_object, cwd=None):
         """
         Compile the supplied *file_object* into the current working library.
@@ -97,23 +181,27 @@ class Modelsim(Simulator):
             args = file_object.get_tool_arguments(self.name, 'compile')
         args = shlex.split(['', args][args is not None])
         args += [file_object.path]
+        timeout = self.project.get_tool_timeout(self.name, 'compile')
         if file_object.fileType == FileType.VHDL:
             Modelsim._call(
                 self.vcom,
                 args,
-                cwd=self.project.get_simulation_directory()
+                cwd=self.project.get_simulation_directory(),
+                timeout=timeout
             )
         elif file_object.fileType == FileType.Verilog:
             Modelsim._call(
                 self.vlog,
                 args,
-                cwd=self.project.get_simulation_directory()
+                cwd=self.project.get_simulation_directory(),
+                timeout=timeout
             )
         elif file_object.fileType == FileType.SystemVerilog:
             Modelsim._call(
                 self.vlog,
                 args,
-                cwd=self.project.get_simulation_directory()
+                cwd=self.project.get_simulation_directory(),
+                timeout=timeout
             )
         else:
             log.warning(
@@ -146,3 +234,20 @@ class Modelsim(Simulator):
             [library, library],
             cwd=self.project.get_simulation_directory()
         )
+
+    def prepare_sandbox(self, path):
+        """
+        Copy the modelsim.ini library mappings from the simulation directory
+        into the sandbox given by *path*, converting relative library paths
+        into absolute paths.
+        """
+        source = os.path.join(
+            self.project.get_simulation_directory(),
+            self.sim_ini_name
+        )
+        if os.path.exists(source):
+            Modelsim.copy_library_mappings(
+                source,
+                os.path.join(path, self.sim_ini_name),
+                section='library'
+            )
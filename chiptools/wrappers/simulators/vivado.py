@@ -1,6 +1,5 @@
 import logging
 import os
-import shlex
 import sys
 
 from chiptools.wrappers.simulator import Simulator
@@ -25,9 +24,15 @@ class Vivado(Simulator):
     xsim_name = 'xsim' + platform_suffix
 
     executables = [xvhdl_name, xvlog_name, xelab_name, xsim_name]
+    version_command = [xelab_name, '--version']
 
     sim_ini_name = 'xsim.ini'
     sim_tcl_name = 'xsim.tcl'
+    # Project files used to pass batches of sources to xvhdl and xvlog
+    vhdl_project_name = 'xvhdl.prj'
+    verilog_project_name = 'xvlog.prj'
+
+    batch_compile = True
 
     def __init__(self, project, user_paths):
         super(Vivado, self).__init__(project, self.executables, user_paths)
@@ -60,46 +65,33 @@ class Vivado(Simulator):
         generics={},
         includes={},
         args=[],
-        duration=None
+        duration=None,
+        log_path=None,
+        failure_patterns=None,
+        timeout=None
     ):
+        """
+        Invoke xsim on a snapshot of the given *entity* in the given
+        *library* elaborated with the given *generics*, the snapshot is
+        reused if it has already been elaborated from the current design.
+        If the project 'warm_simulation' configuration item is set, console
+        simulations are run in an xsim session that is kept running between
+        simulations of the same snapshot (refer to *simulate_warm*).
+        """
+        if self.use_warm_simulation(gui):
+            return self.simulate_warm(
+                library,
+                entity,
+                generics=generics,
+                includes=includes,
+                args=args,
+                duration=duration,
+                log_path=log_path,
+                failure_patterns=failure_patterns,
+                timeout=timeout
+            )
         cwd = self.project.get_simulation_directory()
-        # Set simulator generics
-        # NOTE: Different behavior is required when calling xelab on Windows
-        # as the command line argument to xelab '-generic_top' does not work
-        # correctly. See: https://github.com/pabennett/chiptools/issues/1
-        if sys.platform == 'win32':
-            xelab_args = ''  # use a string sequence for Vivado on Windows
-            if gui:
-                xelab_args += '-debug all'
-            for name, binding in generics.items():
-                # TODO: The -generic_top argument formatting is hacked here for
-                # Vivado simulator on Windows. Xilinx may address this issue in
-                # the future, which will mean this code needs modifying again.
-                # The issue is present in Vivado 2015.4
-                xelab_args += (
-                    '-generic_top' + ' ' +
-                    name.upper() +
-                    '\"' + '=' + '\"' +
-                    str(binding) + ' '
-                )
-            # Execute XELAB on the design files:
-            xelab_args += (' ' + library + '.' + str(entity))
-            xelab_args += (' ' + '-s' + ' ' + str(entity))
-            Vivado._call_str_args(self.xelab, xelab_args, cwd=cwd, quiet=False)
-        else:
-            # Normal behavior on other platforms.
-            xelab_args = []
-            if gui:
-                xelab_args += ['-debug', 'all']
-            for name, binding in generics.items():
-                xelab_args += [
-                    '-generic_top',
-                    name.upper() + '=' + str(binding) + ' ' ,
-                ]
-            # Execute XELAB on the design files:
-            xelab_args += [library + '.' + str(entity)]
-            xelab_args += ['-s', str(entity)]
-            Vivado._call(self.xelab, xelab_args, cwd=cwd, quiet=False)
+        snapshot = self.get_snapshot(library, entity, generics, gui)
         # Fuse generates a simulation executable, this can be called now with
         # the specified simulator arguments:
         sim_args = []
@@ -129,43 +121,237 @@ class Vivado(Simulator):
                 f.write('exit\n')
         sim_args += ['-tclbatch', self.sim_tcl_name]
         # Path to snapshot to execute
-        sim_args += [entity]
+        sim_args += [snapshot]
         # Run the simulation
         ret, stdout, stderr = Vivado._call(
             self.xsim,
             sim_args,
             cwd=self.project.get_simulation_directory(),
-            quiet=False
+            quiet=False,
+            log_path=log_path,
+            echo=self.project.get_simulation_echo(),
+            failure_patterns=failure_patterns,
+            timeout=timeout
         )
 
         return ret, stdout, stderr
 
+    def get_snapshot(self, library, entity, generics, gui):
+        """
+        Return the name of the snapshot of the given *entity* in the given
+        *library* elaborated with the given *generics*, elaborating it if it
+        has not been elaborated from the current design (refer to
+        *elaborate_once*). The snapshot is made available in the simulation
+        working directory.
+        """
+        # Elaborated snapshots are named using a hash of the top level,
+        # generics and design so that simulations sharing them can skip
+        # elaboration.
+        key = self.get_elaboration_key(library, entity, generics, gui=gui)
+        snapshot = '{0}_{1}'.format(entity, key)
+        self.elaborate_once(
+            snapshot,
+            key,
+            lambda directory: self.elaborate(
+                library,
+                entity,
+                snapshot,
+                gui,
+                generics,
+                directory
+            )
+        )
+        return snapshot
+
+    def get_elaboration_outputs(self, name):
+        """
+        Return the paths of the snapshot directory *name* generated by xelab
+        and of its elaboration log.
+        """
+        return [os.path.join('xsim.dir', name), name + '.log']
+
+    def get_session_command(self, library, entity, generics, includes, args):
+        """
+        Return the command that starts xsim as a console on the snapshot of
+        the design, elaborating the snapshot if required. Each snapshot is
+        run in its own session as generics are bound at elaboration.
+        """
+        snapshot = self.get_snapshot(library, entity, generics, False)
+        return [
+            self.xsim,
+            '-onfinish', 'stop',
+            '-onerror', 'stop',
+            snapshot
+        ]
+
+    def get_session_script(
+        self,
+        library,
+        entity,
+        generics,
+        includes,
+        args,
+        duration,
+        reload
+    ):
+        """
+        Return the TCL script that runs a simulation in the xsim console,
+        the snapshot is restarted unless it has just been loaded.
+        """
+        script = '' if reload else 'restart\n'
+        if duration is not None:
+            if duration <= 0:
+                duration = 'all'
+            else:
+                duration = utils.seconds_to_timestring(duration)
+            script += 'run {0}\n'.format(duration)
+        return script
+
+    def elaborate(self, library, entity, snapshot, gui, generics, cwd):
+        """
+        Invoke xelab on the given *entity* in the given *library* to generate
+        the simulation *snapshot*, binding the given *generics*.
+        """
+        timeout = self.project.get_tool_timeout(self.name, 'elaborate')
+        # Set simulator generics
+        # NOTE: Different behavior is required when calling xelab on Windows
+        # as the command line argument to xelab '-generic_top' does not work
+        # correctly. See: https://github.com/pabennett/chiptools/issues/1
+        if sys.platform == 'win32':
+            xelab_args = ''  # use a string sequence for Vivado on Windows
+            if gui:
+                xelab_args += '-debug all'
+            for name, binding in generics.items():
+                # TODO: The -generic_top argument formatting is hacked here for
+                # Vivado simulator on Windows. Xilinx may address this issue in
+                # the future, which will mean this code needs modifying again.
+                # The issue is present in Vivado 2015.4
+                xelab_args += (
+                    '-generic_top' + ' ' +
+                    name.upper() +
+                    '\"' + '=' + '\"' +
+                    str(binding) + ' '
+                )
+            # Execute XELAB on the design files:
+            xelab_args += (' ' + library + '.' + str(entity))
+            xelab_args += (' ' + '-s' + ' ' + snapshot)
+            xelab_args += (' ' + '-log' + ' ' + snapshot + '.log')
+            Vivado._call_str_args(
+                self.xelab,
+                xelab_args,
+                cwd=cwd,
+                quiet=False,
+                timeout=timeout
+            )
+        else:
+            # Normal behavior on other platforms.
+            xelab_args = []
+            if gui:
+                xelab_args += ['-debug', 'all']
+            for name, binding in generics.items():
+                xelab_args += [
+                    '-generic_top',
+                    name.upper() + '=' + str(binding) + ' ' ,
+                ]
+            # Execute XELAB on the design files:
+            xelab_args += [library + '.' + str(entity)]
+            xelab_args += ['-s', snapshot]
+            # Snapshots may be elaborated concurrently in the same directory
+            xelab_args += ['-log', snapshot + '.log']
+            Vivado._call(
+                self.xelab,
+                xelab_args,
+                cwd=cwd,
+                quiet=False,
+                timeout=timeout
+            )
+
     def compile(self, file_object, cwd=None):
         cwd = self.project.get_simulation_directory()
         if file_object.library not in self.libraries:
             self.libraries[file_object.library] = file_object.library
             self.write_includes()
-        args = self.project.get_tool_arguments(self.name, 'compile')
-        if len(args) == 0:
-            args = file_object.get_tool_arguments(self.name, 'compile')
-        args = shlex.split(['', args][args is not None])
+        args = self.get_compile_arguments(file_object)
+        timeout = self.project.get_tool_timeout(self.name, 'compile')
         args += [
             '-work',
             file_object.library,
             file_object.path
         ]
         if file_object.fileType == FileType.VHDL:
-            Vivado._call(self.xvhdl, args, cwd=cwd)
+            Vivado._call(self.xvhdl, args, cwd=cwd, timeout=timeout)
         elif file_object.fileType == FileType.Verilog:
-            Vivado._call(self.xvlog, args, cwd=cwd)
+            Vivado._call(self.xvlog, args, cwd=cwd, timeout=timeout)
         elif file_object.fileType == FileType.SystemVerilog:
-            Vivado._call(self.xvlog, args, cwd=cwd)
+            Vivado._call(self.xvlog, args, cwd=cwd, timeout=timeout)
         else:
             log.warning(
                 'Vivado wrapper skipping file with unknown type: ' +
                 file_object.path
             )
 
+    def compile_batch(self, file_objects, cwd=None):
+        """
+        Compile the supplied *file_objects* by listing them in a project
+        (.prj) file so that xvhdl and xvlog are each invoked once for the
+        batch instead of once per file. The xsim.ini library mapping is
+        written once before compilation starts. Consecutive files that use
+        the same compiler and compile arguments are compiled together, so
+        the project compile order is preserved across the batches.
+        """
+        cwd = self.project.get_simulation_directory()
+        for file_object in file_objects:
+            if file_object.library not in self.libraries:
+                self.libraries[file_object.library] = file_object.library
+        self.write_includes()
+        groups = []
+        for file_object in file_objects:
+            if file_object.fileType == FileType.VHDL:
+                executable = self.xvhdl
+                project_name = self.vhdl_project_name
+                language = 'vhdl'
+            elif file_object.fileType == FileType.Verilog:
+                executable = self.xvlog
+                project_name = self.verilog_project_name
+                language = 'verilog'
+            elif file_object.fileType == FileType.SystemVerilog:
+                executable = self.xvlog
+                project_name = self.verilog_project_name
+                language = 'sv'
+            else:
+                log.warning(
+                    'Vivado wrapper skipping file with unknown type: ' +
+                    file_object.path
+                )
+                continue
+            key = (
+                executable,
+                project_name,
+                tuple(self.get_compile_arguments(file_object))
+            )
+            # A file only joins the previous group if it directly follows
+            # it, a dependency must never be compiled after its users.
+            if len(groups) == 0 or groups[-1][0] != key:
+                groups.append((key, []))
+            groups[-1][1].append((language, file_object))
+        for (executable, project_name, args), entries in groups:
+            project_path = os.path.join(cwd, project_name)
+            with open(project_path, 'w') as f:
+                for language, file_object in entries:
+                    f.write(
+                        '{0} {1} \"{2}\"\n'.format(
+                            language,
+                            file_object.library,
+                            file_object.path
+                        )
+                    )
+            Vivado._call(
+                executable,
+                list(args) + ['-prj', project_name],
+                cwd=cwd,
+                timeout=self.project.get_tool_timeout(self.name, 'compile')
+            )
+
     def library_exists(self, libname, workdir):
         if os.path.exists(os.path.join(workdir, libname)):
             return True
@@ -181,3 +367,19 @@ class Vivado(Simulator):
         cwd = self.project.get_simulation_directory()
         if not os.path.exists(os.path.join(cwd, library)):
             os.makedirs(os.path.join(cwd, library))
+
+    def prepare_sandbox(self, path):
+        """
+        Copy the xsim.ini library mappings from the simulation directory
+        into the sandbox given by *path*, converting relative library paths
+        into absolute paths.
+        """
+        source = os.path.join(
+            self.project.get_simulation_directory(),
+            self.sim_ini_name
+        )
+        if os.path.exists(source):
+            Vivado.copy_library_mappings(
+                source,
+                os.path.join(path, self.sim_ini_name)
+            )
@@ -285,6 +285,7 @@ class Ise(synthesiser.Synthesiser):
             ['-user', 'off'],
             cwd=self.project.get_synthesis_directory(),
             quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'xwebtalk')
         )
 
     @synthesiser.throws_synthesis_exception
@@ -312,7 +313,13 @@ class Ise(synthesiser.Synthesiser):
         args = shlex.split(['', args][args is not None])
         args += ['-o', fout, '-u', '0', fin]
 
-        Ise._call(self.promgen, args, cwd=working_directory, quiet=False)
+        Ise._call(
+            self.promgen,
+            args,
+            cwd=working_directory,
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'promgen')
+        )
 
     @synthesiser.throws_synthesis_exception
     def ise_xst(self, part, entity, generics, working_directory):
@@ -349,7 +356,8 @@ class Ise(synthesiser.Synthesiser):
             self.xst,
             args,
             cwd=working_directory,
-            quiet=False
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'xst')
         )
 
     @synthesiser.throws_synthesis_exception
@@ -379,7 +387,8 @@ class Ise(synthesiser.Synthesiser):
             self.map,
             args,
             cwd=working_directory,
-            quiet=False
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'map')
         )
 
     @synthesiser.throws_synthesis_exception
@@ -413,7 +422,8 @@ class Ise(synthesiser.Synthesiser):
             self.par,
             args,
             cwd=working_directory,
-            quiet=False
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'par')
         )
 
     @synthesiser.throws_synthesis_exception
@@ -451,7 +461,8 @@ class Ise(synthesiser.Synthesiser):
             self.ngdbuild,
             args,
             cwd=working_directory,
-            quiet=False
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'ngdbuild')
         )
 
     @synthesiser.throws_synthesis_exception
@@ -480,7 +491,8 @@ class Ise(synthesiser.Synthesiser):
             self.bitgen,
             args,
             cwd=working_directory,
-            quiet=False
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'bitgen')
         )
 
     @synthesiser.throws_synthesis_exception
@@ -560,7 +572,8 @@ class Ise(synthesiser.Synthesiser):
             self.xflow,
             args,
             cwd=workingDirectory,
-            quiet=False
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'xflow')
         )
 
     @synthesiser.throws_synthesis_exception
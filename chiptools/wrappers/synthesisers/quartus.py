@@ -324,5 +324,6 @@ class Quartus(synthesiser.Synthesiser):
             self.quartus_sh,
             args,
             cwd=workingDirectory,
-            quiet=False
+            quiet=False,
+            timeout=self.project.get_tool_timeout(self.name, 'quartus_sh')
         )
@@ -112,6 +112,10 @@ class Vivado(synthesiser.Synthesiser):
                     ],
                     cwd=synthesis_dir,
                     quiet=False,
+                    timeout=self.project.get_tool_timeout(
+                        self.name,
+                        'synthesis'
+                    )
                 )
             except:
                 # Archive the outputs
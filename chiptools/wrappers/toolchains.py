@@ -123,7 +123,16 @@ class ToolchainBase:
         return ''
 
     @staticmethod
-    def _call(executable, args=[], cwd=None, quiet=True):
+    def _call(
+        executable,
+        args=[],
+        cwd=None,
+        quiet=True,
+        log_path=None,
+        echo=True,
+        failure_patterns=None,
+        timeout=None
+    ):
         log.debug('executing {0} in dir {1} with args {2}'.format(
             executable,
             cwd,
@@ -131,11 +140,25 @@ class ToolchainBase:
         ))
         command = [executable]
         command += args
-        ret, stdout, stderr = execute(command, path=cwd, quiet=quiet)
+        ret, stdout, stderr = execute(
+            command,
+            path=cwd,
+            quiet=quiet,
+            log_path=log_path,
+            echo=echo,
+            failure_patterns=failure_patterns,
+            timeout=timeout
+        )
         return (ret, stdout, stderr)
 
     @staticmethod
-    def _call_str_args(executable, args='', cwd=None, quiet=True):
+    def _call_str_args(
+        executable,
+        args='',
+        cwd=None,
+        quiet=True,
+        timeout=None
+    ):
         log.debug('executing {0} in dir {1} with args {2}'.format(
             executable,
             cwd,
@@ -143,5 +166,10 @@ class ToolchainBase:
         ))
         command = executable
         command += (' ' + args)
-        ret, stdout, stderr = execute(command, path=cwd, quiet=quiet)
+        ret, stdout, stderr = execute(
+            command,
+            path=cwd,
+            quiet=quiet,
+            timeout=timeout
+        )
         return (ret, stdout, stderr)
@@ -16,7 +16,6 @@ Matplotlib is available on your system.
 import os
 import random
 import logging
-import re
 import math
 
 try:
@@ -32,6 +31,9 @@ except ImportError:
 # Import the ChipTools base test class, our test classes should be derived from
 # the ChipToolsTest class (which is derived from unittest.TestCase)
 from chiptools.testing.testloader import ChipToolsTest
+# The vectors module reads and writes stimulus and response files, using NumPy
+# if it is available.
+from chiptools.testing import vectors
 
 # The logging system is already configured by ChipTools, any messages you print
 # here will be formatted and displayed using the ChipTools logger config.
@@ -68,10 +70,16 @@ class MaxHoldsTestBase(ChipToolsTest):
         """The ChipTools test framework will call the simulationSetup method
         prior to executing the simulator. Place any code that is required to
         prepare simulator inputs in this method."""
+        # Parametrised tests receive their width in the 'data_width' generic
+        # and a seed for the random number generator.
+        if 'data_width' in self.generic_matrix:
+            self.data_width = self.generics['data_width']
+        if self.seed is not None:
+            random.seed(self.seed)
         # Generate the values for the test
         self.values = self.generator(self.data_width, self.sequence_lengths)
         # Override the 'data_width' generic with the test setting
-        self.generics['data_width'] = self.data_width
+        self.generics = dict(self.generics, data_width=self.data_width)
         # Set the paths for the input and output files using the
         # 'simulation_root' attribute as the working directory
         self.input_path = os.path.join(self.simulation_root, 'input.txt')
@@ -93,28 +101,20 @@ class MaxHoldsTestBase(ChipToolsTest):
         list containing lists of integers. After each integer list the
         component will be reset and the maximum output recorded, this allows us
         to test the reset functionality of the component too.
+        Each line holds a 4 bit opcode and a data value, the testbench ignores
+        the data value of reset lines.
         """
-        with open(path, 'w') as f:
-            for sequence in values:
-                # Reset the component at the beginning of a new sequence.
-                f.write('{0}\n'.format(bin(reset_opcode)[2:].zfill(4)))
-                # Write each value in the sequence to the stimulus file
-                for value in sequence:
-                    f.write(
-                        '{0} {1}\n'.format(
-                            bin(write_opcode)[2:].zfill(4),
-                            bin(value)[2:].zfill(data_width),
-                        )
-                    )
+        rows = []
+        for sequence in values:
+            # Reset the component at the beginning of a new sequence.
+            rows.append([reset_opcode, 0])
+            # Write each value in the sequence to the stimulus file
+            rows.extend([write_opcode, value] for value in sequence)
+        vectors.write_text(path, rows, [4, data_width])
 
     def read_output(self, path):
-        output_values = []
-        with open(path, 'r') as f:
-            data = f.readlines()
-        for valueIdx, value in enumerate(data):
-            # testbench response
-            output_values.append(int(value, 2))  # Binary to integer
-        return output_values
+        # testbench response, one binary value per line
+        return vectors.read_text(path, self.data_width)
 
     def sequence_max(self, sequence):
         tracking_max = []
@@ -137,24 +137,25 @@ class MaxHoldsTestBase(ChipToolsTest):
         input_values = [
             [0] + seq if len(seq) > 0 else [0] for seq in input_values
         ]
-        # Get the actual values from the testbench output file
-        actual = self.read_output(path)
         # Get the expected maximum values from the value sequence
         expected = self.sequence_max(input_values)
-        log.info("Got {0} actual values".format(len(actual)))
         log.info("Got {0} expected values".format(len(expected)))
-        log.info("Plotting data...")
         # Save the actual and expected values as a plot for reference
         if plt is not None:
-            self.save_figure(actual, expected, input_values)
-        # Compare our actual values with our expected values
+            log.info("Plotting data...")
+            self.save_figure(self.read_output(path), expected, input_values)
+        # Compare our actual values with our expected values. The response
+        # file is read in chunks so that large files are compared with
+        # constant memory, the comparison stops at the first mismatch.
         log.info("Comparing data values...")
-        self.assertEqual(len(actual), len(expected))
-        for valIdx, val in enumerate(actual):
-            # Per element comparison checking, you could use assertListEqual
-            # but it can be slow for large lists
-            # (https://bugs.python.org/issue19217)
-            self.assertEqual(val, expected[valIdx])
+        mismatch = vectors.find_mismatch(
+            vectors.iter_text(path, self.data_width),
+            expected
+        )
+        if mismatch is not None:
+            self.fail(
+                'Value {0} is {1}, expected {2}'.format(*mismatch)
+            )
         log.info("...done")
 
     def save_figure(self, actual, expected, input_values, fontsize=10):
@@ -162,7 +163,7 @@ class MaxHoldsTestBase(ChipToolsTest):
         Save a plot of the actual and expected values recorded during the test.
         Figures are a useful reference to see why a test might be failing.
         """
-        name = self.__class__.__name__
+        name = self.__class__.__name__ + self.get_parameter_string()
         fig = plt.figure(0, figsize=(10, 7.5))
         # Plot the actual maximum and expected maximum values together
         plt.title(
@@ -213,27 +214,18 @@ class max_hold_random_tests_32bit(MaxHoldsTestBase):
         # You can also access the simulator stdout (transcript) and search it
         # for patterns, this is useful if your testbench has built in assertion
         # checking.
-        self.assertIsNone(re.search('.*Error:.*', self.sim_stdout))
+        self.assertIsNone(self.sim_stdout_log.search('.*Error:.*'))
 
 ###############################################################################
-# Re-use the 32bit test to define other tests of different widths
+# Re-use the 32bit test to sweep other widths, each width is run with two
+# random seeds and reported as a separate test, for example:
+# max_hold_random_tests.test_max_hold[data_width=8,seed=2]
 ###############################################################################
 
 
-class max_hold_random_tests_100bit(max_hold_random_tests_32bit):
-    data_width = 100
-
-
-class max_hold_random_tests_128bit(max_hold_random_tests_32bit):
-    data_width = 128
-
-
-class max_hold_random_tests_1bit(max_hold_random_tests_32bit):
-    data_width = 1
-
-
-class max_hold_random_tests_8bit(max_hold_random_tests_32bit):
-    data_width = 8
+class max_hold_random_tests(max_hold_random_tests_32bit):
+    generic_matrix = {'data_width': [1, 8, 100, 128]}
+    seeds = [1, 2]
 
 ###############################################################################
 # Re-use the 32bit test to define static data tests
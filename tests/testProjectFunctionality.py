@@ -7,15 +7,44 @@ vendor tools are not available in the environment.
 
 import unittest
 import os
+import time
+import types
+import socket
+import threading
+import shutil
+import tempfile
 import logging
 import sys
+from xml.dom import minidom
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
 
 testroot = os.path.dirname(__file__) or '.'
 sys.path.insert(0, os.path.abspath(os.path.join(testroot, os.path.pardir)))
 
 from chiptools.core.project import Project
+from chiptools.core.watcher import FileWatcher
+from chiptools.core.dependencies import SourceFile
+from chiptools.core.dependencies import get_changed_files
+from chiptools.core.vendor_libraries import VendorLibraryCache
+from chiptools.testing import result_cache
+from chiptools.testing import results
+from chiptools.testing import report
+from chiptools.testing import parallel
+from chiptools.testing import distributed
+from chiptools.testing.retry import RetryPolicy
+from chiptools.testing.retry import FAILURE_TEST
+from chiptools.testing.retry import FAILURE_INFRASTRUCTURE
+from chiptools.testing.retry import FlakinessStore
+from chiptools.testing.last_run import LastRunStore
+from chiptools.testing import durations
+from chiptools.testing import test_index
+from chiptools.testing import testloader
 from chiptools.parsers.xml_project import XmlProjectParser
 from chiptools.core.cli import CommandLine
+from chiptools.testing.testloader import ChipToolsTest
+from chiptools.wrappers.simulator import Simulator
+from chiptools.wrappers.simulators.ghdl import Ghdl
 
 # Blackhole log messages from chiptools
 logging.config.dictConfig({'version': 1})
@@ -341,6 +370,1214 @@ class TestManualProjectInterface(TestProjectInterface):
         )
 
 
+class TestDependencyGraph(TestProjectInterface):
+
+    wrapper_data = """
+library lib1;
+    use lib1.support.all;
+entity wrapper is
+end entity;
+architecture RTL of wrapper is
+    -- component file3 is not used
+    component file2 is
+        port (CLOCK : in std_logic);
+    end component;
+begin
+    top_i : entity lib1.top port map (CLOCK => '0');
+    file2_i : file2 port map (CLOCK => '0');
+end RTL;
+"""
+
+    def testDependencies(self):
+        project = Project()
+        XmlProjectParser.load_project(self.project_path, project)
+        wrapper_path = os.path.join(self.root, 'lib3', 'wrapper.vhd')
+        with open(wrapper_path, 'w') as f:
+            f.write(self.wrapper_data)
+        try:
+            project.add_file(os.path.abspath(wrapper_path), library='lib3')
+            graph = project.get_dependency_graph()
+            self.assertEqual(
+                sorted(
+                    os.path.basename(p)
+                    for p in graph.get_dependencies('lib3', 'WRAPPER')
+                ),
+                ['file2.vhd', 'support.vhd', 'top.vhd', 'wrapper.vhd'],
+            )
+            self.assertEqual(
+                [
+                    os.path.basename(p)
+                    for p in graph.get_dependencies('lib1', 'top')
+                ],
+                ['top.vhd'],
+            )
+            lib3_file = os.path.join(self.root, 'lib3', 'file3.vhd')
+            self.assertFalse(
+                graph.is_affected('lib3', 'wrapper', [lib3_file])
+            )
+            self.assertTrue(
+                graph.is_affected('lib3', 'wrapper', [wrapper_path])
+            )
+        finally:
+            os.remove(wrapper_path)
+
+    def testAffectedTests(self):
+        project = Project()
+        XmlProjectParser.load_project(self.project_path, project)
+
+        class TopTest(ChipToolsTest):
+            library = 'lib1'
+            entity = 'top'
+
+            def test_top(self):
+                pass
+
+        class File2Test(TopTest):
+            library = 'lib2'
+            entity = 'file2'
+
+        class UnknownTest(TopTest):
+            entity = 'missing'
+
+        tests = [TopTest('test_top'), File2Test('test_top')]
+        lib1_file = os.path.join(self.root, 'lib1', 'top.vhd')
+        affected = project.select_affected_tests(tests, [lib1_file])
+        self.assertEqual(affected, tests[:1])
+        # Changes to the test module affect all of its tests
+        affected = project.select_affected_tests(tests, [__file__])
+        self.assertEqual(affected, tests)
+        # Tests with an unknown top level are always selected
+        affected = project.select_affected_tests(
+            [UnknownTest('test_top')],
+            [lib1_file]
+        )
+        self.assertEqual(len(affected), 1)
+
+    def testAffectedTestIds(self):
+        project = Project()
+        XmlProjectParser.load_project(self.project_path, project)
+
+        class TopTest(ChipToolsTest):
+            library = 'lib1'
+            entity = 'top'
+
+            def test_top(self):
+                pass
+
+        class File2Test(TopTest):
+            library = 'lib2'
+            entity = 'file2'
+
+        unit = types.SimpleNamespace(
+            path=__file__,
+            loaded=True,
+            testsuite=[
+                [TopTest('test_top')],
+                [File2Test('test_top'), File2Test('test_top')],
+            ],
+        )
+        project.tests = [unit]
+        lib1_file = os.path.join(self.root, 'lib1', 'top.vhd')
+        lib2_file = os.path.join(self.root, 'lib2', 'file2.vhd')
+        lib3_file = os.path.join(self.root, 'lib3', 'file3.vhd')
+        self.assertEqual(project.get_affected_test_ids([lib1_file]), [0])
+        self.assertEqual(project.get_affected_test_ids([lib2_file]), [1, 2])
+        self.assertEqual(project.get_affected_test_ids([lib3_file]), [])
+        self.assertEqual(
+            project.get_affected_test_ids([__file__]),
+            [0, 1, 2]
+        )
+
+    def testChangedFiles(self):
+        # Deleted files are not mistaken for git revisions
+        deleted = os.path.join('lib1', 'deleted.vhd')
+        self.assertEqual(
+            get_changed_files([deleted], self.root),
+            [os.path.normpath(os.path.join(self.root, deleted))]
+        )
+
+    def testConfigurationBinding(self):
+        source = SourceFile('config.vhd', 'lib3')
+        source.scan_vhdl(
+            'configuration cfg of wrapper is\n' +
+            '    for RTL\n' +
+            '        for all : file2 use entity lib2.file2(RTL); end for;\n' +
+            '        for u0 : top use configuration work.top_cfg;\n' +
+            '        end for;\n' +
+            '    end for;\n' +
+            'end configuration;\n'
+        )
+        self.assertIn(('lib2', 'file2'), source.references)
+        self.assertIn(('lib3', 'top_cfg'), source.references)
+
+
+class TestResultCacheFingerprint(TestProjectInterface):
+
+    def testHelperPaths(self):
+        helper_path = os.path.abspath(os.path.join(self.root, 'helper.py'))
+        helper = types.ModuleType('chiptools_test_helper')
+        helper.__file__ = helper_path
+        helper.os = os
+        module = types.ModuleType('chiptools_test_module')
+        module.helper = helper
+        module.unittest = unittest
+        module.Project = Project
+        self.assertEqual(
+            result_cache.TestResultCache.get_helper_paths(module),
+            [helper_path]
+        )
+
+    def testToolArguments(self):
+        class TopTest(ChipToolsTest):
+            library = 'lib1'
+            entity = 'top'
+
+            def test_top(self):
+                pass
+
+        test = TopTest('test_top')
+        cache = result_cache.TestResultCache
+        self.assertNotEqual(
+            cache.get_fingerprint(test, 'design', '[]'),
+            cache.get_fingerprint(test, 'design', "['-O2']"),
+        )
+
+
+class TestShards(unittest.TestCase):
+
+    class ShardedTest(unittest.TestCase):
+        def test_a(self):
+            pass
+
+        def test_b(self):
+            pass
+
+        def test_c(self):
+            pass
+
+        def test_d(self):
+            pass
+
+        def test_e(self):
+            pass
+
+    names = ['test_a', 'test_b', 'test_c', 'test_d', 'test_e']
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.tests = [self.ShardedTest(name) for name in self.names]
+        self.test_ids = [test.id() for test in self.tests]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def check_coverage(self, count, durations=None):
+        shards = [
+            results.select_shard(self.test_ids, index, count, durations)
+            for index in range(1, count + 1)
+        ]
+        self.assertEqual(
+            sorted(test_id for shard in shards for test_id in shard),
+            sorted(self.test_ids)
+        )
+        return shards
+
+    def testSelectShard(self):
+        for count in range(1, 7):
+            shards = self.check_coverage(count)
+            sizes = [len(shard) for shard in shards]
+            self.assertLessEqual(max(sizes) - min(sizes), 1)
+        durations = dict(zip(self.test_ids, [10, 1, 1, 1, 1]))
+        shards = self.check_coverage(2, durations)
+        self.assertIn(set([self.test_ids[0]]), shards)
+
+    def testShardPlan(self):
+        plan = results.get_shard_plan(self.test_ids, 2)
+        self.assertEqual(plan, results.get_shard_plan(self.test_ids[::-1], 2))
+        self.assertNotEqual(plan, results.get_shard_plan(self.test_ids, 3))
+        self.assertNotEqual(
+            plan,
+            results.get_shard_plan(self.test_ids[1:], 2)
+        )
+        self.assertNotEqual(
+            plan,
+            results.get_shard_plan(self.test_ids, 2, {self.test_ids[0]: 1})
+        )
+
+    def write_shard(self, index, count, run=None, test_ids=None):
+        test_ids = self.test_ids if test_ids is None else test_ids
+        shard = sorted(results.select_shard(test_ids, index, count))
+        path = os.path.join(
+            self.root,
+            'results_{0}_of_{1}.jsonl'.format(index, count)
+        )
+        writer = results.ResultWriter(
+            path,
+            shard='{0}/{1}'.format(index, count),
+            plan=results.get_shard_plan(test_ids, count),
+            tests=shard
+        )
+        writer.start()
+        for test in self.tests:
+            if test.id() in shard and (run is None or test.id() in run):
+                writer.add_test(test, (0, '', '', 1.0, {}))
+        writer.stop()
+        return path
+
+    def testMergeResults(self):
+        for index in range(1, 4):
+            self.write_shard(index, 3)
+        pattern = os.path.join(self.root, '*.jsonl')
+        result = results.merge_results([pattern])
+        self.assertIsNotNone(result)
+        self.assertEqual(result.success_count, len(self.test_ids))
+        self.assertEqual(
+            results.read_durations([pattern]),
+            dict((test_id, 1.0) for test_id in self.test_ids)
+        )
+
+    def testMergeMissingShard(self):
+        paths = [self.write_shard(index, 3) for index in range(1, 4)]
+        self.assertIsNone(results.merge_results(paths[1:]))
+
+    def testMergeMissingTest(self):
+        paths = [self.write_shard(1, 2), self.write_shard(2, 2, run=[])]
+        self.assertIsNone(results.merge_results(paths))
+
+    def testMergeDifferentPlans(self):
+        # The second shard was given a different test selection
+        paths = [
+            self.write_shard(1, 2),
+            self.write_shard(2, 2, test_ids=self.test_ids[:-1])
+        ]
+        self.assertIsNone(results.merge_results(paths))
+
+    def testMergeDuplicateResult(self):
+        path = self.write_shard(1, 1)
+        copy = os.path.join(self.root, 'copy.jsonl')
+        shutil.copy(path, copy)
+        self.assertIsNone(results.merge_results([path, copy]))
+
+
+class TestResultWriters(unittest.TestCase):
+
+    class WrittenTest(unittest.TestCase):
+        def test_pass(self):
+            pass
+
+        def test_fail(self):
+            pass
+
+        def test_timeout(self):
+            pass
+
+        def test_skip(self):
+            pass
+
+        def test_long(self):
+            pass
+
+    output = '\x1b[31m** Error: bad <value> & "more"\x1b[0m\x00\x07\n'
+    outcomes = [
+        ('test_pass', (parallel.RESULT_PASS, output, '', 1.0, {})),
+        ('test_fail', (
+            parallel.RESULT_FAIL,
+            output,
+            'Traceback\nAssertionError: \x1b[1mfailed\x1b[0m\n',
+            2.0,
+            dict(return_code=1, logs=['a.stdout.log'], attempts=2)
+        )),
+        ('test_timeout', (
+            parallel.RESULT_TIMEOUT,
+            '',
+            'ExecutionTimeout: timed out\n',
+            3.0,
+            dict(return_code=None)
+        )),
+        ('test_skip', (parallel.RESULT_SKIP, 'no simulator', '', 0, {})),
+    ]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def get_testcases(self, path):
+        document = minidom.parse(path)
+        return dict(
+            (element.getAttribute('name'), element)
+            for element in document.getElementsByTagName('testcase')
+        )
+
+    def testJUnitWriter(self):
+        path = os.path.join(self.root, 'junit.xml')
+        writer = results.JUnitWriter(path)
+        writer.start()
+        self.assertEqual(self.get_testcases(path), {})
+        for count, (name, outcome) in enumerate(self.outcomes):
+            writer.add_test(self.WrittenTest(name), outcome)
+            # The report is complete after each test
+            self.assertEqual(len(self.get_testcases(path)), count + 1)
+        writer.stop()
+        testcases = self.get_testcases(path)
+        self.assertEqual(
+            sorted(testcases),
+            sorted(name for name, _ in self.outcomes)
+        )
+        text = testcases['test_pass'].getElementsByTagName(
+            'system-out'
+        )[0].firstChild.data
+        self.assertEqual(
+            text,
+            '** Error: bad <value> & "more"\ufffd\ufffd\n'
+        )
+        failure = testcases['test_fail'].getElementsByTagName('failure')[0]
+        self.assertEqual(
+            failure.getAttribute('message'),
+            'AssertionError: failed'
+        )
+        properties = dict(
+            (element.getAttribute('name'), element.getAttribute('value'))
+            for element in testcases['test_fail'].getElementsByTagName(
+                'property'
+            )
+        )
+        self.assertEqual(
+            properties,
+            dict(return_code='1', log='a.stdout.log', attempts='2')
+        )
+        error = testcases['test_timeout'].getElementsByTagName('error')[0]
+        self.assertEqual(error.getAttribute('type'), 'timeout')
+        self.assertEqual(
+            len(testcases['test_skip'].getElementsByTagName('skipped')),
+            1
+        )
+
+    class TagChecker(HTMLParser):
+        """Record the HTML elements that are not closed in order."""
+        def __init__(self):
+            super(TestResultWriters.TagChecker, self).__init__()
+            self.stack = []
+            self.errors = []
+
+        def handle_starttag(self, tag, attrs):
+            self.stack.append(tag)
+
+        def handle_startendtag(self, tag, attrs):
+            pass
+
+        def handle_endtag(self, tag):
+            if len(self.stack) == 0 or self.stack.pop() != tag:
+                self.errors.append(tag)
+
+    def testHTMLReportWriter(self):
+        path = os.path.join(self.root, 'report.html')
+        log_path = os.path.join(self.root, 'logs', 'test_long.stdout.log')
+        writer = report.HTMLReportWriter(path, max_output=200)
+        writer.start()
+        outcomes = self.outcomes + [
+            ('test_long', (
+                parallel.RESULT_FAIL,
+                'start\n' + 'x' * 10000 + '\nend\n',
+                '',
+                4.0,
+                dict(return_code=1, logs=[log_path])
+            )),
+        ]
+        for name, outcome in outcomes:
+            writer.add_test(self.WrittenTest(name), outcome)
+        # The rows of completed tests are written before the run ends
+        with open(path, 'r') as f:
+            self.assertEqual(
+                f.read().count('<tr class="test"'),
+                len(outcomes)
+            )
+        writer.stop()
+        with open(path, 'r') as f:
+            data = f.read()
+        checker = self.TagChecker()
+        checker.feed(data)
+        checker.close()
+        self.assertEqual(checker.errors, [])
+        self.assertEqual(checker.stack, [])
+        self.assertTrue(data.rstrip().endswith('</html>'))
+        self.assertIn('Pass 1 Fail 2 Skip 1 Timeout 1', data)
+        # Long outputs are truncated and the log files are linked
+        self.assertIn('character(s) omitted', data)
+        self.assertNotIn('x' * 200, data)
+        self.assertIn('start\nxxx', data)
+        self.assertIn('xxx\nend\n', data)
+        self.assertIn(
+            '<a href="logs/test_long.stdout.log">test_long.stdout.log</a>',
+            data
+        )
+        self.assertIn('&lt;value&gt; &amp;', data)
+
+    def testResultWriter(self):
+        path = os.path.join(self.root, 'results.jsonl')
+        writer = results.ResultWriter(path, shard='1/1', tests=['a'])
+        writer.start()
+        for name, outcome in self.outcomes[:2]:
+            writer.add_test(self.WrittenTest(name), outcome)
+        # The results of an interrupted run are kept
+        start, stop, records = results.read_results(path)
+        self.assertEqual(start['shard'], '1/1')
+        self.assertIsNone(stop)
+        self.assertEqual(len(records), 2)
+        for name, outcome in self.outcomes[2:]:
+            writer.add_test(self.WrittenTest(name), outcome, cached=True)
+        writer.stop()
+        start, stop, records = results.read_results(path)
+        self.assertIsNotNone(stop)
+        records = dict((record['id'], record) for record in records)
+        record = records[self.WrittenTest('test_fail').id()]
+        self.assertEqual(record['code'], parallel.RESULT_FAIL)
+        self.assertEqual(record['output'], self.outcomes[1][1][1])
+        self.assertEqual(record['return_code'], 1)
+        self.assertEqual(record['logs'], ['a.stdout.log'])
+        self.assertEqual(record['attempts'], 2)
+        self.assertFalse(record['cached'])
+        self.assertTrue(records[self.WrittenTest('test_skip').id()]['cached'])
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    modelsim_banner = (
+        '# vsim -c lib1.top\n'
+        '# // Questa Sim-64\n'
+        '# // Copyright 1991-2020 Mentor Graphics Corporation\n'
+        '# // All Rights Reserved.\n'
+        '# // THIS WORK CONTAINS TRADE SECRET AND PROPRIETARY INFORMATION\n'
+        '# // WHICH IS THE PROPERTY OF MENTOR GRAPHICS CORPORATION OR ITS\n'
+        '# // LICENSORS AND IS SUBJECT TO LICENSE TERMS.\n'
+    )
+
+    def outcome(self, code, output='', return_code=1):
+        return (code, output, '', 1.0, dict(return_code=return_code))
+
+    def testBannerIsNotInfrastructure(self):
+        policy = RetryPolicy()
+        outcome = self.outcome(
+            parallel.RESULT_ERROR,
+            self.modelsim_banner + '# ** Fatal: (vsim-3421) Index out of range'
+        )
+        self.assertEqual(policy.classify(outcome), FAILURE_TEST)
+
+    def testLicenceCheckoutFailure(self):
+        policy = RetryPolicy()
+        for message in [
+            '# ** Error: Unable to checkout a license.',
+            'ERROR: [Common 17-345] A valid license was not found',
+            'FLEXlm error: -15,570. System Error: 115',
+            'License checkout failed for feature msimhdlsim',
+        ]:
+            outcome = self.outcome(
+                parallel.RESULT_ERROR,
+                self.modelsim_banner + message
+            )
+            self.assertEqual(
+                policy.classify(outcome),
+                FAILURE_INFRASTRUCTURE,
+                message
+            )
+        # Infrastructure failures require a simulator error
+        outcome = self.outcome(
+            parallel.RESULT_FAIL,
+            'Unable to checkout a license.'
+        )
+        self.assertEqual(policy.classify(outcome), FAILURE_TEST)
+        outcome = self.outcome(parallel.RESULT_PASS)
+        self.assertIsNone(policy.classify(outcome))
+
+    def testRetryLimits(self):
+        policy = RetryPolicy(retries=1, infrastructure_retries=2)
+        test = unittest.FunctionTestCase(lambda: None)
+        failures = []
+        infrastructure = self.outcome(
+            parallel.RESULT_ERROR,
+            'No space left on device'
+        )
+        failure = self.outcome(parallel.RESULT_FAIL)
+        self.assertTrue(policy.retry(test, infrastructure, failures))
+        self.assertTrue(policy.retry(test, infrastructure, failures))
+        self.assertFalse(policy.retry(test, infrastructure, failures))
+        self.assertTrue(policy.retry(test, failure, failures))
+        self.assertFalse(policy.retry(test, failure, failures))
+        code, output, error, duration, details = policy.get_outcome(
+            self.outcome(parallel.RESULT_PASS, return_code=0),
+            failures
+        )
+        self.assertEqual(details['attempts'], 4)
+        self.assertEqual(details['infrastructure_retries'], 2)
+        self.assertTrue(details['flaky'])
+
+
+class TestParallelSchedule(unittest.TestCase):
+
+    class MatrixTest(ChipToolsTest):
+        library = 'lib1'
+        entity = 'top'
+        generic_matrix = {'width': [8, 16]}
+        seeds = [1, 2]
+
+        def test_top(self):
+            pass
+
+    def testTakeNext(self):
+        tests = [
+            self.MatrixTest('test_top', parameters=parameters)
+            for parameters in self.MatrixTest.get_parameter_sets()
+        ]
+        runner = parallel.ParallelTestRunner(None, None, jobs=2)
+        pending = list(range(len(tests)))
+        # Idle workers start different designs
+        first = runner.take_next(tests, pending, [])
+        second = runner.take_next(tests, pending, [first])
+        self.assertNotEqual(
+            runner.get_design(tests[first]),
+            runner.get_design(tests[second])
+        )
+        # A worker continues with the design that it has elaborated
+        design = runner.get_design(tests[second])
+        third = runner.take_next(tests, pending, [first], design)
+        self.assertEqual(runner.get_design(tests[third]), design)
+
+    def testSchedule(self):
+        tests = [
+            self.MatrixTest('test_top', parameters=parameters)
+            for parameters in self.MatrixTest.get_parameter_sets()
+        ]
+        ids = [test.id() for test in tests]
+        runner = parallel.ParallelTestRunner(
+            None,
+            None,
+            jobs=2,
+            durations={ids[0]: 1.0, ids[1]: 5.0, ids[2]: 3.0},
+            priority=set([ids[2]])
+        )
+        # Priority tests first, then tests without a history in suite order,
+        # then the longest tests first
+        self.assertEqual(
+            runner.schedule(tests),
+            [2] + list(range(3, len(tests))) + [1, 0]
+        )
+
+    def testSameDesignPreferred(self):
+        tests = [
+            self.MatrixTest('test_top', parameters=parameters)
+            for parameters in self.MatrixTest.get_parameter_sets()
+        ]
+        runner = parallel.ParallelTestRunner(None, None, jobs=2)
+        design = runner.get_design(tests[0])
+        pending = [
+            index for index in range(len(tests))
+            if runner.get_design(tests[index]) != design
+        ]
+        same = [
+            index for index in range(1, len(tests))
+            if runner.get_design(tests[index]) == design
+        ]
+        self.assertGreater(len(same), 0)
+        # The test of the same design is taken from the back of the queue
+        pending += same
+        self.assertEqual(
+            runner.take_next(tests, pending, [], design),
+            same[0]
+        )
+        self.assertNotIn(same[0], pending)
+        # Otherwise a test of a design that is not running is taken
+        pending = list(range(1, len(tests)))
+        index = runner.take_next(tests, pending, [0])
+        self.assertNotEqual(runner.get_design(tests[index]), design)
+
+
+class TestParallelRunner(unittest.TestCase):
+    """
+    Run fake ChipTools tests through the ParallelTestRunner using threads in
+    place of the worker processes.
+    """
+
+    class RunnerTest(ChipToolsTest):
+        library = 'lib1'
+        entity = 'top'
+        generic_matrix = {'width': [8, 16]}
+
+        def test_pass(self):
+            pass
+
+        def test_fail(self):
+            self.fail('failed')
+
+        def test_skip(self):
+            self.skipTest('skipped')
+
+    class Writer:
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.outcomes = {}
+
+        def add_test(self, test, outcome):
+            with self.lock:
+                self.outcomes[test.id()] = outcome
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.simulator = FakeSimulator()
+        self.tests = [
+            self.RunnerTest(name, parameters=parameters)
+            for name in ['test_pass', 'test_fail', 'test_skip']
+            for parameters in self.RunnerTest.get_parameter_sets()
+        ]
+        worker = types.SimpleNamespace(get_test=self.get_test)
+        self.initialise_worker = parallel._initialise_worker
+        self.executor = parallel.ProcessPoolExecutor
+        parallel._initialise_worker = lambda state: setattr(
+            parallel,
+            '_worker',
+            worker
+        )
+        parallel.ProcessPoolExecutor = ThreadPoolExecutor
+        self.lock = threading.Lock()
+        self.threads = set()
+
+    def tearDown(self):
+        parallel._initialise_worker = self.initialise_worker
+        parallel.ProcessPoolExecutor = self.executor
+        shutil.rmtree(self.root)
+
+    def get_test(self, module_path, test_id):
+        with self.lock:
+            self.threads.add(threading.current_thread().name)
+        test = [test for test in self.tests if test.id() == test_id][0]
+        test = test.__class__(test._testMethodName, test.parameters)
+        test.postImport({}, testroot, self.simulator)
+        return test
+
+    def testCollectResults(self):
+        writer = self.Writer()
+        project = types.SimpleNamespace(
+            get_simulation_directory=lambda: self.root
+        )
+        runner = parallel.ParallelTestRunner(
+            project,
+            self.simulator,
+            jobs=2,
+            writers=[writer]
+        )
+        runner.get_worker_state = lambda sandbox_root: {}
+        result = runner.run(unittest.TestSuite(self.tests))
+        ids = [test.id() for test in self.tests]
+        self.assertEqual(sorted(writer.outcomes), sorted(ids))
+        self.assertEqual(sorted(result.outcomes), sorted(ids))
+        # Outcomes are reported in suite order
+        self.assertEqual([item[1].id() for item in result.result], ids)
+        self.assertEqual(result.testsRun, len(self.tests))
+        self.assertEqual(result.failure_count, 2)
+        self.assertEqual(result.success_count, 4)
+        self.assertEqual(len(result.skipped), 2)
+        self.assertEqual(
+            [result.outcomes[test_id][0] for test_id in ids],
+            [parallel.RESULT_PASS] * 2 +
+            [parallel.RESULT_FAIL] * 2 +
+            [parallel.RESULT_SKIP] * 2
+        )
+        self.assertEqual(len(self.simulator.simulations), len(self.tests))
+        self.assertLessEqual(len(self.threads), 2)
+
+
+class FakeSimulator:
+    """
+    A simulator wrapper that completes every simulation without running a
+    simulator, recording the arguments of each simulation.
+    """
+    name = 'fake'
+    installed = True
+
+    def __init__(self):
+        self.project = types.SimpleNamespace(
+            root=os.path.abspath(testroot),
+            tests=[],
+            get_files=lambda: [],
+            get_simulation_log_directory=lambda: None,
+            get_failure_patterns=lambda: [],
+            get_timeout=lambda: None,
+        )
+        self.lock = threading.Lock()
+        self.simulations = []
+
+    def simulate(self, **kwargs):
+        with self.lock:
+            self.simulations.append(kwargs)
+        return 0, '', ''
+
+
+class TestDistributed(unittest.TestCase):
+    """
+    Run a coordinator on localhost with in-process workers that run fake
+    ChipTools tests using the FakeSimulator.
+    """
+
+    class DistributedTest(ChipToolsTest):
+        library = 'lib1'
+        entity = 'top'
+        generic_matrix = {'width': [8, 16, 32]}
+
+        def test_a(self):
+            pass
+
+        def test_b(self):
+            pass
+
+    authkey = b'chiptools'
+
+    def setUp(self):
+        self.simulator = FakeSimulator()
+        self.tests = [
+            self.DistributedTest(name, parameters=parameters)
+            for name in ['test_a', 'test_b']
+            for parameters in self.DistributedTest.get_parameter_sets()
+        ]
+        with socket.socket() as s:
+            s.bind(('localhost', 0))
+            self.address = ('localhost', s.getsockname()[1])
+        self.runner = distributed.DistributedTestRunner(
+            self.simulator.project,
+            self.simulator,
+            self.address,
+            self.authkey
+        )
+        self.state = dict(
+            root=self.simulator.project.root,
+            tool_name=self.simulator.name,
+            fingerprint=self.runner.fingerprint
+        )
+        # Workers run the fake tests instead of recreating the project
+        worker = types.SimpleNamespace(
+            get_test=self.get_test,
+            sandbox=types.SimpleNamespace(close=lambda: None)
+        )
+        self.initialise_worker = parallel._initialise_worker
+        parallel._initialise_worker = lambda state: setattr(
+            parallel,
+            '_worker',
+            worker
+        )
+        self.result = None
+        # IDs of the tests started by the workers
+        self.started = []
+        self.coordinator = threading.Thread(
+            target=lambda: setattr(
+                self,
+                'result',
+                self.runner.run(unittest.TestSuite(self.tests))
+            )
+        )
+        self.coordinator.daemon = True
+        self.coordinator.start()
+
+    def tearDown(self):
+        self.runner.finished = True
+        self.coordinator.join(10)
+        parallel._initialise_worker = self.initialise_worker
+
+    def get_test(self, module_path, test_id):
+        self.assertEqual(
+            os.path.normcase(module_path),
+            os.path.normcase(os.path.abspath(__file__))
+        )
+        self.started.append(test_id)
+        test = [test for test in self.tests if test.id() == test_id][0]
+        test = test.__class__(test._testMethodName, test.parameters)
+        test.postImport({}, testroot, self.simulator)
+        return test
+
+    def start_workers(self, count):
+        workers = []
+        for index in range(count):
+            worker = threading.Thread(
+                target=distributed.run_worker,
+                args=(self.state, self.address, self.authkey, str(index)),
+                kwargs=dict(heartbeat_interval=0.1, reconnect_timeout=5)
+            )
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def connect(self):
+        """Connect to the coordinator as a worker that runs no tests."""
+        deadline = time.time() + 10
+        while True:
+            try:
+                conn = distributed.Client(self.address, authkey=self.authkey)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        conn.send((
+            'hello',
+            'lost',
+            self.state['tool_name'],
+            self.state['fingerprint']
+        ))
+        self.assertEqual(conn.recv(), ('accepted',))
+        return conn
+
+    def check_result(self):
+        self.coordinator.join(30)
+        self.assertFalse(self.coordinator.is_alive())
+        self.assertEqual(self.result.testsRun, len(self.tests))
+        self.assertEqual(self.result.success_count, len(self.tests))
+        self.assertEqual(
+            sorted(self.result.outcomes),
+            sorted(test.id() for test in self.tests)
+        )
+
+    def run_workers(self, count):
+        for worker in self.start_workers(count):
+            worker.join(30)
+            self.assertFalse(worker.is_alive())
+        self.check_result()
+
+    def testOneWorker(self):
+        self.run_workers(1)
+        self.assertEqual(sorted(self.started), sorted(self.result.outcomes))
+
+    def testTwoWorkers(self):
+        self.run_workers(2)
+        # Each test is run once
+        self.assertEqual(sorted(self.started), sorted(self.result.outcomes))
+
+    def testLostWorker(self):
+        """The test of a worker that is lost is run by another worker."""
+        conn = self.connect()
+        conn.send(('request',))
+        message = conn.recv()
+        self.assertEqual(message[0], 'test')
+        conn.send(('heartbeat',))
+        conn.close()
+        self.run_workers(1)
+        self.assertIn(message[3], self.started)
+        self.assertEqual(sorted(self.started), sorted(self.result.outcomes))
+
+    def testResendResult(self):
+        """
+        A result resent by a worker that reconnects is accepted once and
+        the test is not run again.
+        """
+        conn = self.connect()
+        conn.send(('request',))
+        _, index, module_path, test_id = conn.recv()
+        conn.close()
+        outcome = (parallel.RESULT_PASS, 'resent', '', 1.0, {})
+        for _ in range(2):
+            conn = self.connect()
+            conn.send(('result', index, test_id, outcome))
+            conn.close()
+        self.run_workers(2)
+        self.assertEqual(self.result.outcomes[test_id], outcome)
+        self.assertNotIn(test_id, self.started)
+        self.assertEqual(len(self.started), len(self.tests) - 1)
+
+
+class TestStores(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.root, 'project')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testLastRunStore(self):
+        store = LastRunStore(self.cache_path)
+        store.add_outcome('a', parallel.RESULT_PASS)
+        store.add_outcome('b', parallel.RESULT_FAIL)
+        store.add_outcome('c', parallel.RESULT_TIMEOUT)
+        store.add_outcome('d', parallel.RESULT_SKIP)
+        store.save_cache()
+        store = LastRunStore(self.cache_path)
+        self.assertEqual(store.get_failed(), ['b', 'c'])
+        # Only tests that are run again replace their outcome
+        store.add_outcome('b', parallel.RESULT_PASS)
+        self.assertEqual(store.get_failed(), ['c'])
+        store.delete()
+        self.assertEqual(LastRunStore(self.cache_path).get_failed(), [])
+
+    def testCorruptedStore(self):
+        with open(self.cache_path + LastRunStore.cache_file_name, 'w') as f:
+            f.write('not a pickle')
+        self.assertEqual(LastRunStore(self.cache_path).cache, {})
+
+    def testFlakinessStore(self):
+        store = FlakinessStore(self.cache_path)
+        self.assertIsNone(store.get_flakiness('a'))
+        store.add_outcome('a', dict(flaky=True, infrastructure_retries=1))
+        store.add_outcome('a', {})
+        store.save_cache()
+        store = FlakinessStore(self.cache_path)
+        self.assertEqual(store.get_flakiness('a'), 0.5)
+
+    def testDurationStore(self):
+        store = durations.TestDurationStore(self.cache_path)
+        self.assertIsNone(store.get_expected_duration('a'))
+        for duration in range(1, 13):
+            store.add_duration('a', float(duration))
+        store.add_duration('b', 4.0)
+        store.save_cache()
+        store = durations.TestDurationStore(self.cache_path)
+        # Only the 10 most recent durations are kept
+        self.assertEqual(
+            store.cache['a'],
+            [float(duration) for duration in range(3, 13)]
+        )
+        self.assertEqual(store.get_expected_duration('a'), 7.5)
+        self.assertEqual(
+            store.get_expected_durations(['a', 'b', 'c']),
+            {'a': 7.5, 'b': 4.0}
+        )
+
+    def testTestIndex(self):
+        helper_path = os.path.join(self.root, 'index_helper.py')
+        module_path = os.path.join(self.root, 'index_tests.py')
+        with open(helper_path, 'w') as f:
+            f.write('WIDTH = 8\n')
+        with open(module_path, 'w') as f:
+            f.write(
+                'import index_helper\n' +
+                'from chiptools.testing.testloader import ChipToolsTest\n' +
+                'class IndexTest(ChipToolsTest):\n' +
+                '    """Index test"""\n' +
+                '    library = \'lib1\'\n' +
+                '    entity = \'top\'\n' +
+                '    def test_width(self):\n' +
+                '        """Check the width"""\n' +
+                '        pass\n'
+            )
+        sys.path.insert(0, self.root)
+        try:
+            suite = testloader.load_tests(module_path, self.root)
+        finally:
+            sys.path.remove(self.root)
+            sys.modules.pop('index_helper', None)
+        index = test_index.TestIndex(self.cache_path)
+        self.assertIsNone(index.get_entries(module_path))
+        entries = index.add_suite(module_path, suite)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['name'], 'test_width')
+        self.assertEqual(entries[0]['description'], 'Check the width')
+        self.assertEqual(entries[0]['entity'], 'top')
+        index.save_cache()
+        index = test_index.TestIndex(self.cache_path)
+        self.assertEqual(index.get_entries(module_path), entries)
+        # Changes to a helper module invalidate the entries
+        with open(helper_path, 'w') as f:
+            f.write('WIDTH = 16\n')
+        self.assertIsNone(index.get_entries(module_path))
+        index.add_suite(module_path, suite)
+        self.assertEqual(index.get_entries(module_path), entries)
+        # As do changes to the test module itself
+        with open(module_path, 'a') as f:
+            f.write('# modified\n')
+        self.assertIsNone(index.get_entries(module_path))
+
+
+class TestVendorLibraryCache(unittest.TestCase):
+
+    class StubSimulator:
+        """A simulator that compiles each library into a directory."""
+        name = 'stub'
+        version = 'stub 1.0'
+        library_exists = Simulator.library_exists
+        get_library_directory = Simulator.get_library_directory
+
+        def __init__(self, path):
+            self.path = path
+
+        def get_version(self):
+            return self.version
+
+    class StubGhdl(StubSimulator):
+        """A simulator that writes library files into the build directory."""
+        name = 'ghdl'
+        library_exists = Ghdl.library_exists
+        get_library_directory = Ghdl.get_library_directory
+
+    class StubCache(VendorLibraryCache):
+        """A cache that builds libraries without running a simulator."""
+        def __init__(self, options):
+            super(TestVendorLibraryCache.StubCache, self).__init__(options)
+            self.built = []
+
+        def _build_library(self, simulator, library, force=False):
+            self.built.append(library)
+            target = self.get_build_directory(simulator, library)
+            if simulator.name == 'ghdl':
+                os.makedirs(target, exist_ok=True)
+                open(
+                    os.path.join(target, library + '-obj93.cf'),
+                    'w'
+                ).close()
+            else:
+                os.makedirs(os.path.join(target, library), exist_ok=True)
+            return True
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.sources = os.path.join(self.root, 'sources')
+        os.makedirs(self.sources)
+        for name in ['b.vhd', 'a.vhd', 'pkg.vhd']:
+            with open(os.path.join(self.sources, name), 'w') as f:
+                f.write('-- ' + name + '\n')
+        os.environ['CHIPTOOLS_TEST_SOURCES'] = self.sources
+        self.libraries = {
+            'unisim': '$CHIPTOOLS_TEST_SOURCES/pkg.vhd,\n' +
+                      '$CHIPTOOLS_TEST_SOURCES/*.vhd',
+        }
+        self.options = types.SimpleNamespace(
+            get_vendor_libraries=lambda: self.libraries,
+            get_vendor_library_cache_path=lambda: os.path.join(
+                self.root,
+                'cache'
+            ),
+        )
+        self.simulator = self.StubSimulator(self.root)
+
+    def tearDown(self):
+        del os.environ['CHIPTOOLS_TEST_SOURCES']
+        shutil.rmtree(self.root)
+
+    def testSources(self):
+        self.assertEqual(
+            VendorLibraryCache.get_sources(self.libraries['unisim']),
+            [
+                os.path.abspath(os.path.join(self.sources, name))
+                for name in ['pkg.vhd', 'a.vhd', 'b.vhd']
+            ]
+        )
+
+    def testFingerprint(self):
+        sources = VendorLibraryCache.get_sources(self.libraries['unisim'])
+        fingerprint = VendorLibraryCache.get_fingerprint(
+            self.simulator,
+            sources
+        )
+        # An upgrade of the simulator in place changes the fingerprint
+        self.simulator.version = 'stub 2.0'
+        self.assertNotEqual(
+            fingerprint,
+            VendorLibraryCache.get_fingerprint(self.simulator, sources)
+        )
+        self.simulator.version = 'stub 1.0'
+        self.assertEqual(
+            fingerprint,
+            VendorLibraryCache.get_fingerprint(self.simulator, sources)
+        )
+        with open(sources[0], 'a') as f:
+            f.write('-- edited\n')
+        self.assertNotEqual(
+            fingerprint,
+            VendorLibraryCache.get_fingerprint(self.simulator, sources)
+        )
+
+    def testBuild(self):
+        cache = self.StubCache(self.options)
+        self.assertEqual(cache.get_missing_libraries(self.simulator), [
+            'unisim'
+        ])
+        self.assertTrue(cache.build(self.simulator))
+        build_directory = cache.get_build_directory(self.simulator, 'unisim')
+        self.assertEqual(
+            cache.get_built_libraries(self.simulator),
+            {'unisim': os.path.join(build_directory, 'unisim')}
+        )
+        # Built libraries are only rebuilt when forced
+        self.assertTrue(cache.build(self.simulator))
+        self.assertEqual(cache.built, ['unisim'])
+        self.assertTrue(cache.build(self.simulator, force=True))
+        self.assertEqual(cache.built, ['unisim', 'unisim'])
+        self.assertFalse(cache.build(self.simulator, ['missing']))
+        # Another simulator version uses its own build
+        self.simulator.version = 'stub 2.0'
+        cache.clear()
+        self.assertEqual(cache.get_missing_libraries(self.simulator), [
+            'unisim'
+        ])
+
+    def testGhdlLibraryPath(self):
+        """GHDL libraries are used from the build directory."""
+        simulator = self.StubGhdl(self.root)
+        cache = self.StubCache(self.options)
+        self.assertIsNone(cache.get_library_path(simulator, 'unisim'))
+        self.assertTrue(cache.build(simulator))
+        build_directory = cache.get_build_directory(simulator, 'unisim')
+        self.assertEqual(
+            cache.get_library_path(simulator, 'unisim'),
+            build_directory
+        )
+        ghdl = Ghdl(None, {})
+        ghdl.set_library_path('unisim', build_directory)
+        self.assertEqual(
+            ghdl.get_library_options({'unimacro': build_directory}),
+            ['-P' + os.path.abspath(build_directory)]
+        )
+
+
+class TestWatch(TestProjectInterface):
+
+    def testReload(self):
+        project = Project()
+        XmlProjectParser.load_project(self.project_path, project)
+        tool_wrapper = project.tool_wrapper
+        with open(self.project_path, 'r') as f:
+            data = f.read()
+        # Change a config item, remove a library and add a unit test
+        start = data.index("\t<library name='lib3'>")
+        end = data.index('</library>', start) + len('</library>')
+        data = data[:start] + data[end:]
+        data = data.replace(self.project_part, 'another_fpga')
+        data = data.replace(
+            '</project>',
+            '<unittest path=\'tests.py\'/>\n</project>'
+        )
+        with open(self.project_path, 'w') as f:
+            f.write(data)
+        project.reload()
+        project.reload()
+        self.assertEqual(project.get_fpga_part(), 'another_fpga')
+        self.assertNotIn(
+            'file3.vhd',
+            [os.path.basename(f.path) for f in project.get_files()]
+        )
+        self.assertEqual(len(project.tests), 1)
+        # The tool wrappers are kept between reloads
+        self.assertIs(project.tool_wrapper, tool_wrapper)
+
+    def testFileWatcher(self):
+        paths = [
+            os.path.join(self.root, 'lib1', path)
+            for path in self.project_structure['lib1']
+        ]
+        watcher = FileWatcher(paths, interval=0.01, debounce=0.01)
+        try:
+            self.assertEqual(watcher.poll(), set())
+            with open(paths[0], 'a') as f:
+                f.write('-- modified\n')
+            os.remove(paths[1])
+            self.assertEqual(
+                watcher.wait(),
+                set(os.path.abspath(p) for p in paths[:2])
+            )
+            self.assertEqual(watcher.poll(), set())
+        finally:
+            watcher.stop()
+            # Restore the removed file for tearDown
+            with open(paths[1], 'w') as f:
+                f.write('')
+
+
 class TestUninitialisedProjectCLI(TestProjectInterface):
     """
     These tests check that the CommandLine handles all user command errors
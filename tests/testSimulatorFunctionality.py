@@ -1,13 +1,27 @@
 import unittest
 import os
 import re
+import types
+import shutil
 import logging
+import tempfile
+import time
 import sys
 
 testroot = os.path.dirname(__file__) or '.'
 sys.path.insert(0, os.path.abspath(os.path.join(testroot, os.path.pardir)))
 
 from chiptools.core import cli
+from chiptools.common import utils
+from chiptools.common import exceptions
+from chiptools.testing import vcd
+from chiptools.testing import vectors
+from chiptools.testing.testloader import ChipToolsTest
+from chiptools.core.sandbox import SimulationSandbox
+from chiptools.wrappers.simulator import Simulator
+from chiptools.wrappers.simulators.vivado import Vivado
+from chiptools.wrappers.simulators.isim import Isim
+from chiptools.common.filetypes import FileType
 
 # Blackhole log messages from chiptools
 logging.config.dictConfig({'version': 1})
@@ -133,5 +147,952 @@ class TestExampleProjectsMaxHoldIsim(TestExampleProjectsMaxHoldModelsim):
 class TestExampleProjectsMaxHoldGhdl(TestExampleProjectsMaxHoldModelsim):
     simulator_name = 'ghdl'
 
+
+class TestOutputCapture(unittest.TestCase):
+
+    lines = 1000
+    command = [
+        sys.executable,
+        '-c',
+        'for i in range({0}): print("line", i)'.format(lines)
+    ]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testPopenWithoutLog(self):
+        """Without a log file the complete output is kept in memory."""
+        code, stdout, stderr = utils.popen(self.command, echo=False)
+        self.assertEqual(code, 0)
+        self.assertIsInstance(stdout, utils.OutputLog)
+        self.assertEqual(len(str(stdout).splitlines()), self.lines)
+        self.assertEqual(stdout.summary(), str(stdout))
+        self.assertIn('line 500\n', stdout)
+        self.assertEqual(stdout.search(r'^line (\d+)$').group(1), '0')
+        self.assertIsNotNone(stdout.search('^line 999$'))
+        self.assertIsNone(stdout.search('Error:'))
+        self.assertEqual(str(stderr), '')
+
+    def testPopenWithLog(self):
+        """With a log file only the first and last lines are in memory."""
+        log_path = os.path.join(self.root, 'run')
+        code, stdout, stderr = utils.popen(
+            self.command,
+            log_path=log_path,
+            echo=False
+        )
+        self.assertEqual(code, 0)
+        self.assertLess(
+            len(stdout.summary().splitlines()),
+            self.lines
+        )
+        self.assertEqual(len(stdout.read().splitlines()), self.lines)
+        self.assertIsNotNone(stdout.search('^line 500$'))
+
+    def testLogPath(self):
+        """Generic values in a test ID give a safe and unique log file."""
+        class GenericTest(ChipToolsTest):
+            def test_output(self):
+                pass
+
+        project = types.SimpleNamespace(
+            get_simulation_log_directory=lambda: self.root
+        )
+        paths = set()
+        for value in ['a/b', 'a:b', 'a"b', 'a_b']:
+            test = GenericTest(
+                'test_output',
+                parameters=({'path': value}, None)
+            )
+            test.simulator = types.SimpleNamespace(project=project)
+            path = test.get_log_path()
+            self.assertEqual(os.path.dirname(path), self.root)
+            with open(path + '.stdout.log', 'w'):
+                pass
+            paths.add(path)
+        self.assertEqual(len(paths), 4)
+
+
+
+class TestProcessControl(unittest.TestCase):
+    """
+    Run child Python processes that misbehave and check that they are
+    stopped.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testFailurePattern(self):
+        """A child is killed as soon as its output matches a pattern."""
+        command = [
+            sys.executable,
+            '-c',
+            'import time\n' +
+            'print("starting", flush=True)\n' +
+            'print("Error: assertion failed", flush=True)\n' +
+            'time.sleep(60)\n'
+        ]
+        start_time = time.time()
+        with self.assertRaises(exceptions.AbortedError) as context:
+            utils.popen(
+                command,
+                echo=False,
+                failure_patterns=[r'^Error:']
+            )
+        self.assertLess(time.time() - start_time, 30)
+        self.assertEqual(context.exception.match, 'Error: assertion failed')
+        # Output that does not match is not aborted
+        code, stdout, stderr = utils.popen(
+            [sys.executable, '-c', 'print("No Error: here")'],
+            echo=False,
+            failure_patterns=[r'^Error:']
+        )
+        self.assertEqual(code, 0)
+        self.assertIn('No Error: here\n', stdout)
+
+    @staticmethod
+    def is_running(pid):
+        """Return True if the process *pid* is running (not a zombie)."""
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        stat_path = '/proc/{0}/stat'.format(pid)
+        if os.path.exists(stat_path):
+            with open(stat_path, 'r') as f:
+                # The state follows the parenthesised command name
+                return f.read().rsplit(')', 1)[-1].split()[0] != 'Z'
+        return True
+
+    @unittest.skipIf(sys.platform == 'win32', 'requires POSIX process IDs')
+    def testTimeout(self):
+        """The process group of a child that times out is killed."""
+        pid_path = os.path.join(self.root, 'grandchild.pid')
+        command = [
+            sys.executable,
+            '-c',
+            'import subprocess, sys, time\n' +
+            'p = subprocess.Popen(\n' +
+            '    [sys.executable, "-c", "import time; time.sleep(60)"]\n' +
+            ')\n' +
+            'with open({0!r}, "w") as f:\n'.format(pid_path) +
+            '    f.write(str(p.pid))\n' +
+            'print("started", flush=True)\n' +
+            'time.sleep(60)\n'
+        ]
+        start_time = time.time()
+        with self.assertRaises(exceptions.ExecutionTimeout) as context:
+            utils.popen(command, echo=False, timeout=2)
+        # The grandchild holds the output pipes open, the call only returns
+        # early if it was killed with its parent
+        self.assertLess(time.time() - start_time, 30)
+        self.assertEqual(context.exception.timeout, 2)
+        with open(pid_path, 'r') as f:
+            pid = int(f.read())
+        deadline = time.time() + 10
+        while self.is_running(pid) and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(self.is_running(pid))
+
+class TestSimulatorSession(unittest.TestCase):
+    """
+    Run scripts in a fake simulator console that interprets the wrapped
+    scripts of the SimulatorSession: *puts*, *warn* (puts to stderr),
+    *error*, *sleep* and *exit* commands in the script and the *puts* and
+    *flush* commands of the wrapper. The console redirects its standard
+    error stream to its standard output stream if it is given a 'merge'
+    argument.
+    """
+
+    console = '''
+import sys, time
+if sys.argv[1:] == ['merge']:
+    sys.stderr = sys.stdout
+status, message, script = 0, '', False
+for line in iter(sys.stdin.readline, ''):
+    line = line.strip()
+    if line.startswith('set chiptools_status'):
+        status, script = 0, True
+    elif line.startswith('} chiptools_message'):
+        script = False
+    elif script:
+        command, _, argument = line.partition(' ')
+        if status:
+            continue
+        elif command == 'puts':
+            print(argument)
+        elif command == 'warn':
+            print(argument, file=sys.stderr)
+        elif command == 'error':
+            status, message = 1, argument
+        elif command == 'sleep':
+            time.sleep(float(argument))
+        elif command == 'exit':
+            sys.exit(int(argument))
+    elif line.startswith('if {$chiptools_status}'):
+        if status:
+            print(message, file=sys.stderr)
+    elif line.startswith('puts'):
+        text = line.split(None, 1)[1]
+        stream = sys.stdout
+        if text.startswith('stderr '):
+            stream, text = sys.stderr, text[len('stderr '):]
+        text = text.strip('"').replace('$chiptools_status', str(status))
+        print(text, file=stream)
+    elif line.startswith('flush'):
+        sys.stdout.flush()
+        sys.stderr.flush()
+'''
+
+    def setUp(self):
+        from chiptools.wrappers.session import SimulatorSession
+        self.SimulatorSession = SimulatorSession
+        self.sessions = []
+
+    def tearDown(self):
+        for session in self.sessions:
+            session.close(timeout=1)
+
+    def start(self, *args):
+        session = self.SimulatorSession(
+            [sys.executable, '-c', self.console] + list(args)
+        )
+        self.sessions.append(session)
+        return session
+
+    def testProtocol(self):
+        session = self.start()
+        ret, stdout, stderr = session.run(
+            'puts hello\nwarn careful',
+            echo=False,
+            timeout=10
+        )
+        self.assertEqual(ret, 0)
+        self.assertEqual(str(stdout), 'hello\n')
+        self.assertEqual(str(stderr), 'careful\n')
+        # The session is reused for the next script
+        ret, stdout, stderr = session.run(
+            'puts before\nerror failed\nputs after',
+            echo=False
+        )
+        self.assertEqual(ret, 1)
+        self.assertEqual(str(stdout), 'before\n')
+        self.assertEqual(str(stderr), 'failed\n')
+        self.assertTrue(session.alive())
+        # The exit code is returned if the simulator exits
+        ret, stdout, stderr = session.run('exit 3', echo=False)
+        self.assertEqual(ret, 3)
+        self.assertFalse(session.alive())
+
+    def testMergedStreams(self):
+        """A redirected standard error stream does not hang the run."""
+        session = self.start('merge')
+        session.drain_timeout = 30
+        for _ in range(3):
+            ret, stdout, stderr = session.run(
+                'puts hello\nwarn careful',
+                echo=False,
+                timeout=10
+            )
+            self.assertEqual(ret, 0)
+            self.assertEqual(str(stdout), 'hello\ncareful\n')
+            self.assertEqual(str(stderr), '')
+
+    def testTimeout(self):
+        session = self.start()
+        with self.assertRaises(exceptions.ExecutionTimeout):
+            session.run('puts waiting\nsleep 30', echo=False, timeout=0.5)
+        session.process.wait(10)
+        self.assertFalse(session.alive())
+
+    def testFailurePattern(self):
+        session = self.start()
+        with self.assertRaises(exceptions.AbortedError) as context:
+            session.run(
+                'puts ok\nputs FATAL: licence lost\nsleep 30',
+                echo=False,
+                failure_patterns=['^FATAL'],
+            )
+        self.assertEqual(context.exception.match, 'FATAL: licence lost')
+        session.process.wait(10)
+        self.assertFalse(session.alive())
+
+
+class TestGhdlExecutables(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testRemoveExecutables(self):
+        """Only stale executables of the same entity are removed."""
+        from chiptools.wrappers.simulators.ghdl import Ghdl
+        suffix = Ghdl.executable_suffix
+        stale = 'work_top_0123456789ab' + suffix
+        current = 'work_top_ba9876543210' + suffix
+        kept = [
+            current,
+            'work_top_lock',
+            'work_top_tb_0123456789ab' + suffix,
+            'work_top_tb_lock',
+            'work_top_0123456789ab{0}.{1}.tmp'.format(suffix, os.getpid()),
+        ]
+        for name in [stale] + kept:
+            with open(os.path.join(self.root, name), 'w'):
+                pass
+        Ghdl.remove_executables(
+            self.root,
+            'work_top_',
+            os.path.join(self.root, current)
+        )
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(kept))
+
+
+
+class TestStubSimulatorInterface(unittest.TestCase):
+    """
+    Base class of the tests that exercise the Simulator wrapper methods in a
+    temporary directory using a stub project, without running a simulator.
+    """
+
+    class StubSimulator(Simulator):
+        name = 'stub'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.simulation_directory = os.path.join(self.root, 'simulation')
+        os.makedirs(self.simulation_directory)
+        self.project = types.SimpleNamespace(
+            get_simulation_directory=lambda: self.simulation_directory,
+            get_libraries=lambda: {'lib1': [], 'lib2': []},
+            get_tool_arguments=lambda name, flow: '',
+            get_tool_timeout=lambda name, flow: None,
+        )
+        self.user_paths = {'stub': self.root}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+
+class TestSimulationSandbox(TestStubSimulatorInterface):
+
+    def testLinkLibraries(self):
+        simulator = self.StubSimulator(self.project, [], self.user_paths)
+        self.assertTrue(simulator.installed)
+        os.makedirs(os.path.join(self.simulation_directory, 'lib1'))
+        sandbox = SimulationSandbox(simulator, name='worker').create()
+        try:
+            path = sandbox.path
+            self.assertEqual(
+                os.path.dirname(path),
+                os.path.join(
+                    self.simulation_directory,
+                    SimulationSandbox.sandbox_directory_name
+                )
+            )
+            # Only the compiled libraries are linked into the sandbox
+            self.assertEqual(os.listdir(path), ['lib1'])
+            self.assertTrue(os.path.islink(os.path.join(path, 'lib1')))
+            self.assertEqual(
+                os.path.realpath(os.path.join(path, 'lib1')),
+                os.path.realpath(
+                    os.path.join(self.simulation_directory, 'lib1')
+                )
+            )
+            # The sandboxed wrapper runs in the sandbox directory
+            self.assertEqual(
+                sandbox.simulator.project.get_simulation_directory(),
+                path
+            )
+            self.assertEqual(
+                simulator.project.get_simulation_directory(),
+                self.simulation_directory
+            )
+        finally:
+            sandbox.close()
+        self.assertFalse(os.path.exists(path))
+
+    def testLibraryMappings(self):
+        simulator = Vivado(self.project, {'vivado': self.root})
+        with open(
+            os.path.join(self.simulation_directory, Vivado.sim_ini_name),
+            'w'
+        ) as f:
+            f.write('--Generated\nlib1=lib1\nlib2=/opt/lib2\n')
+        with SimulationSandbox(simulator, name='worker') as sandbox:
+            with open(
+                os.path.join(sandbox.path, Vivado.sim_ini_name),
+                'r'
+            ) as f:
+                data = f.read()
+        # Relative library paths are resolved against the simulation
+        # directory so that the sandbox uses the shared libraries
+        self.assertEqual(
+            data,
+            '--Generated\nlib1={0}\nlib2=/opt/lib2\n'.format(
+                os.path.join(self.simulation_directory, 'lib1')
+            )
+        )
+
+
+class TestElaborationCache(TestStubSimulatorInterface):
+
+    def setUp(self):
+        super(TestElaborationCache, self).setUp()
+        self.shared_directory = os.path.join(self.root, 'shared')
+        self.project.get_shared_simulation_directory = (
+            lambda: self.shared_directory
+        )
+        self.simulator = self.StubSimulator(self.project, [], self.user_paths)
+        self.elaborated = []
+
+    def elaborate(self, name):
+        def elaborate(cwd):
+            self.elaborated.append(name)
+            with open(os.path.join(cwd, name), 'w') as f:
+                f.write(name)
+        return elaborate
+
+    def elaborate_once(self, name, key):
+        self.simulator.elaborate_once(name, key, self.elaborate(name))
+
+    def get_marker(self, name):
+        return os.path.join(
+            self.shared_directory,
+            Simulator.elaboration_cache_name,
+            name
+        )
+
+    def testElaborateOnce(self):
+        self.elaborate_once('top', 'key1')
+        self.elaborate_once('top', 'key1')
+        self.assertEqual(self.elaborated, ['top'])
+        # The output is copied from the shared directory
+        self.assertTrue(
+            os.path.exists(os.path.join(self.simulation_directory, 'top'))
+        )
+        self.assertTrue(
+            self.simulator.is_elaborated(
+                'top',
+                'key1',
+                self.simulation_directory
+            )
+        )
+        # A different design is elaborated again
+        self.elaborate_once('top', 'key2')
+        self.assertEqual(self.elaborated, ['top', 'top'])
+        self.assertTrue(
+            self.simulator.is_elaborated(
+                'top',
+                'key2',
+                self.simulation_directory
+            )
+        )
+
+    def testPrune(self):
+        self.simulator.elaboration_cache_size = 2
+        self.elaborate_once('a', 'key')
+        self.elaborate_once('b', 'key')
+        os.utime(self.get_marker('a'), (1000, 1000))
+        os.utime(self.get_marker('b'), (2000, 2000))
+        # Reusing a design makes it the most recently used
+        self.elaborate_once('a', 'key')
+        self.elaborate_once('c', 'key')
+        self.assertEqual(self.elaborated, ['a', 'b', 'c'])
+        for name in ['a', 'c']:
+            self.assertTrue(os.path.exists(self.get_marker(name)))
+            self.assertTrue(
+                os.path.exists(os.path.join(self.shared_directory, name))
+            )
+        self.assertFalse(os.path.exists(self.get_marker('b')))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.shared_directory, 'b'))
+        )
+        # A pruned design is elaborated again when it is next used
+        self.elaborate_once('b', 'key')
+        self.assertEqual(self.elaborated, ['a', 'b', 'c', 'b'])
+
+
+class TestBatchCompile(TestStubSimulatorInterface):
+    """
+    Compile batches of files with the Vivado and ISim wrappers, recording
+    the compiler calls and the contents of the .prj files passed to them.
+    """
+
+    def setUp(self):
+        super(TestBatchCompile, self).setUp()
+        self.calls = []
+        self.call = Simulator._call
+        Simulator._call = staticmethod(self.record_call)
+        self.xilinx = os.environ.get('XILINX', None)
+        self.files = [
+            self.get_file('a.vhd', 'lib1', FileType.VHDL),
+            self.get_file('b.vhd', 'lib1', FileType.VHDL),
+            self.get_file('c.vhd', 'lib1', FileType.VHDL, '-O2'),
+            self.get_file('d.v', 'lib2', FileType.Verilog),
+            self.get_file('e.sv', 'lib2', FileType.SystemVerilog),
+            self.get_file('f.vhd', 'lib2', FileType.VHDL),
+        ]
+
+    def tearDown(self):
+        Simulator._call = self.call
+        if self.xilinx is None:
+            os.environ.pop('XILINX', None)
+        else:
+            os.environ['XILINX'] = self.xilinx
+        super(TestBatchCompile, self).tearDown()
+
+    def get_file(self, name, library, file_type, args=''):
+        return types.SimpleNamespace(
+            path=os.path.join(self.root, name),
+            library=library,
+            fileType=file_type,
+            get_tool_arguments=lambda tool_name, flow: args,
+        )
+
+    def record_call(self, executable, args=[], cwd=None, **kwargs):
+        with open(os.path.join(cwd, args[-1]), 'r') as f:
+            self.calls.append((os.path.basename(executable), args, f.read()))
+        return 0, '', ''
+
+    def get_entry(self, language, library, name):
+        return '{0} {1} "{2}"\n'.format(
+            language,
+            library,
+            os.path.join(self.root, name)
+        )
+
+    def testVivado(self):
+        simulator = Vivado(self.project, {'vivado': self.root})
+        simulator.compile_batch(self.files)
+        # Consecutive files with the same compiler and arguments are
+        # compiled together, in the project compile order
+        self.assertEqual(
+            self.calls,
+            [
+                (
+                    'xvhdl',
+                    ['-prj', 'xvhdl.prj'],
+                    self.get_entry('vhdl', 'lib1', 'a.vhd') +
+                    self.get_entry('vhdl', 'lib1', 'b.vhd')
+                ),
+                (
+                    'xvhdl',
+                    ['-O2', '-prj', 'xvhdl.prj'],
+                    self.get_entry('vhdl', 'lib1', 'c.vhd')
+                ),
+                (
+                    'xvlog',
+                    ['-prj', 'xvlog.prj'],
+                    self.get_entry('verilog', 'lib2', 'd.v') +
+                    self.get_entry('sv', 'lib2', 'e.sv')
+                ),
+                (
+                    'xvhdl',
+                    ['-prj', 'xvhdl.prj'],
+                    self.get_entry('vhdl', 'lib2', 'f.vhd')
+                ),
+            ]
+        )
+        with open(
+            os.path.join(self.simulation_directory, Vivado.sim_ini_name),
+            'r'
+        ) as f:
+            data = f.read()
+        self.assertIn('lib1=lib1\n', data)
+        self.assertIn('lib2=lib2\n', data)
+
+    def testIsim(self):
+        simulator = Isim(self.project, {'isim': self.root})
+        simulator.compile_batch(self.files)
+        self.assertEqual(
+            self.calls,
+            [
+                (
+                    'vhpcomp',
+                    ['-incremental', '-prj', 'vhpcomp.prj'],
+                    self.get_entry('vhdl', 'lib1', 'a.vhd') +
+                    self.get_entry('vhdl', 'lib1', 'b.vhd')
+                ),
+                (
+                    'vhpcomp',
+                    ['-O2', '-incremental', '-prj', 'vhpcomp.prj'],
+                    self.get_entry('vhdl', 'lib1', 'c.vhd')
+                ),
+                (
+                    'vlogcomp',
+                    ['-incremental', '-prj', 'vlogcomp.prj'],
+                    self.get_entry('verilog', 'lib2', 'd.v') +
+                    self.get_entry('verilog', 'lib2', 'e.sv')
+                ),
+                (
+                    'vhpcomp',
+                    ['-incremental', '-prj', 'vhpcomp.prj'],
+                    self.get_entry('vhdl', 'lib2', 'f.vhd')
+                ),
+            ]
+        )
+
+class TestVectors(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'vectors.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def assertValues(self, actual, expected):
+        if hasattr(actual, 'tolist'):
+            actual = actual.tolist()
+        self.assertEqual([
+            list(row) if isinstance(row, (list, tuple)) else row
+            for row in actual
+        ], expected)
+
+    def roundTrip(self, values, width, **kwargs):
+        vectors.write_text(self.path, values, width, **kwargs)
+        return vectors.read_text(self.path, width, **kwargs)
+
+    def testUnsignedBinary(self):
+        values = [0, 1, 5, 255]
+        self.assertValues(self.roundTrip(values, 8), values)
+        with open(self.path) as f:
+            self.assertEqual(f.readline(), '00000000\n')
+
+    def testSignedHex(self):
+        values = [-128, -1, 0, 127]
+        self.assertValues(self.roundTrip(values, 8, radix=16, signed=True),
+                          values)
+        with open(self.path) as f:
+            self.assertEqual(f.read().split(), ['80', 'ff', '00', '7f'])
+
+    def testHexDigits(self):
+        # A 10 bit value is written using 3 hexadecimal digits
+        self.roundTrip([0x3ff], 10, radix=16)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), '3ff\n')
+
+    def testFixedPoint(self):
+        values = [-1.5, -0.25, 0.0, 0.75]
+        self.assertValues(
+            self.roundTrip(values, 8, signed=True, frac_bits=4),
+            values
+        )
+
+    def testWideValues(self):
+        # Values wider than NUMPY_MAX_WIDTH are processed in pure Python
+        width = vectors.NUMPY_MAX_WIDTH + 10
+        values = [0, 1 << (width - 1), (1 << width) - 1]
+        self.assertValues(self.roundTrip(values, width, radix=16), values)
+        values = [-(1 << (width - 1)), -1, (1 << (width - 1)) - 1]
+        self.assertValues(
+            self.roundTrip(values, width, signed=True),
+            values
+        )
+
+    def testColumns(self):
+        rows = [[1, -2], [3, -4]]
+        self.assertValues(
+            self.roundTrip(rows, [4, 8], radix=16, signed=True),
+            rows
+        )
+
+    def testRange(self):
+        with self.assertRaises(ValueError):
+            vectors.write_text(self.path, [256], 8)
+        with self.assertRaises(ValueError):
+            vectors.write_text(self.path, [-129], 8, signed=True)
+
+    def testMetavalue(self):
+        with open(self.path, 'w') as f:
+            f.write('0001\n00U1\n')
+        with self.assertRaises(ValueError):
+            vectors.read_text(self.path, 4)
+
+    def testBinaryFile(self):
+        values = [-32768, -1, 0, 1, 32767]
+        for byteorder in ['little', 'big']:
+            vectors.write_binary(
+                self.path,
+                values,
+                16,
+                signed=True,
+                byteorder=byteorder
+            )
+            self.assertEqual(os.path.getsize(self.path), 10)
+            self.assertValues(
+                vectors.read_binary(
+                    self.path,
+                    16,
+                    signed=True,
+                    byteorder=byteorder
+                ),
+                values
+            )
+        with open(self.path, 'ab') as f:
+            f.write(b'\x00')
+        with self.assertRaises(ValueError):
+            vectors.read_binary(self.path, 16)
+
+    def readChunks(self, chunks):
+        values = []
+        sizes = []
+        for chunk in chunks:
+            sizes.append(len(chunk))
+            values.extend(getattr(chunk, 'tolist', lambda: chunk)())
+        return values, sizes
+
+    def testTextChunks(self):
+        values = list(range(-50, 50))
+        vectors.write_text(self.path, values, 8, signed=True)
+        self.assertEqual(
+            self.readChunks(
+                vectors.iter_text(self.path, 8, signed=True, chunk_size=16)
+            ),
+            (values, [16] * 6 + [4])
+        )
+
+    def testTextChunkLineEnds(self):
+        with open(self.path, 'wb') as f:
+            f.write(b''.join(
+                '{0:04b}\r\n'.format(i).encode() for i in range(10)
+            ))
+        values, sizes = self.readChunks(
+            vectors.iter_text(self.path, 4, chunk_size=3)
+        )
+        self.assertEqual(values, list(range(10)))
+        self.assertEqual(sizes, [3, 3, 3, 1])
+
+    def testTextChunkLayout(self):
+        # The file is decoded line by line after the layout changes
+        with open(self.path, 'w') as f:
+            f.write('01\n02\n03\n004\n05\n\n')
+        values, sizes = self.readChunks(
+            vectors.iter_text(self.path, 8, radix=16, chunk_size=2)
+        )
+        self.assertEqual(values, [1, 2, 3, 4, 5])
+        self.assertEqual(sum(sizes), 5)
+
+    def testEmptyFiles(self):
+        open(self.path, 'w').close()
+        self.assertEqual(list(vectors.iter_text(self.path, 8)), [])
+        self.assertEqual(list(vectors.iter_binary(self.path, 8)), [])
+
+    def testBinaryChunks(self):
+        values = list(range(-20, 20))
+        vectors.write_binary(self.path, values, 12, signed=True)
+        self.assertEqual(
+            self.readChunks(
+                vectors.iter_binary(
+                    self.path,
+                    12,
+                    signed=True,
+                    chunk_size=16
+                )
+            ),
+            (values, [16, 16, 8])
+        )
+
+    def testFindMismatch(self):
+        values = list(range(40))
+        vectors.write_text(self.path, values, 8)
+
+        def chunks():
+            return vectors.iter_text(self.path, 8, chunk_size=16)
+        self.assertIsNone(vectors.find_mismatch(chunks(), values))
+        self.assertIsNone(vectors.find_mismatch(chunks(), iter(values)))
+        model = values[:20] + [99] + values[21:]
+        mismatch = vectors.find_mismatch(chunks(), model)
+        self.assertEqual(mismatch, (20, 20, 99))
+        self.assertIs(type(mismatch[0]), int)
+        self.assertIs(type(mismatch[1]), int)
+        self.assertIsNone(vectors.find_mismatch(chunks(), model, 79))
+        self.assertEqual(
+            vectors.find_mismatch(chunks(), values[:-1]),
+            (39, 39, None)
+        )
+        mismatch = vectors.find_mismatch(chunks(), values + [40])
+        self.assertEqual(mismatch, (40, None, 40))
+        self.assertIs(type(mismatch[0]), int)
+        mismatch = vectors.find_mismatch(chunks(), values[:16])
+        self.assertEqual(mismatch, (16, 16, None))
+
+
+class TestVectorsPython(TestVectors):
+    """Run the vector tests without NumPy."""
+
+    def setUp(self):
+        super(TestVectorsPython, self).setUp()
+        self.numpy = vectors.numpy
+        vectors.numpy = None
+
+    def tearDown(self):
+        vectors.numpy = self.numpy
+        super(TestVectorsPython, self).tearDown()
+
+
+class TestVcd(unittest.TestCase):
+
+    steps = 200
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'waves.vcd')
+        lines = [
+            '$date today $end',
+            '$timescale 10 ps $end',
+            '$scope module tb $end',
+            '$var wire 1 ! clock $end',
+            '$var wire 8 " data [7:0] $end',
+            '$var real 64 # level $end',
+            '$scope module dut $end',
+            '$var wire 1 ! clk $end',
+            '$upscope $end',
+            '$upscope $end',
+            '$enddefinitions $end',
+            '#0',
+            '$dumpvars',
+            '0!',
+            'bx "',
+            'r0 #',
+            '$end',
+        ]
+        # The clock rises at 5 and falls at 10 with data set to the cycle
+        # number, the level is updated every fourth cycle.
+        for cycle in range(1, self.steps):
+            lines += [
+                '#{0}'.format(10 * cycle - 5),
+                '1!',
+                '#{0}'.format(10 * cycle),
+                '0!',
+                'b{0:b} "'.format(cycle),
+            ]
+            if cycle % 4 == 0:
+                lines.append('r{0} #'.format(cycle * 0.5))
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.vcd = vcd.VcdFile(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testDeclarations(self):
+        self.assertAlmostEqual(self.vcd.timescale, 1e-11)
+        self.assertEqual(
+            sorted(self.vcd.signals),
+            ['tb.clock', 'tb.data', 'tb.dut.clk', 'tb.level']
+        )
+        self.assertEqual(self.vcd.signals['tb.data'].width, 8)
+        self.assertEqual(self.vcd.signals['tb.level'].type, 'real')
+        with self.assertRaises(KeyError):
+            self.vcd.get_signal('tb.missing')
+
+    def testValues(self):
+        times, values = self.vcd.get_values('tb.data')
+        self.assertEqual(times, [10 * i for i in range(self.steps)])
+        self.assertEqual(
+            values,
+            ['x'] + ['{0:b}'.format(i) for i in range(1, self.steps)]
+        )
+        self.assertEqual(
+            self.vcd.get_values('tb.level', end=85),
+            ([0, 40, 80], [0.0, 2.0, 4.0])
+        )
+
+    def testAliases(self):
+        self.assertEqual(
+            list(self.vcd.changes(['tb.clock', 'tb.dut.clk'], end=5)),
+            [
+                (0, 'tb.clock', '0'),
+                (0, 'tb.dut.clk', '0'),
+                (5, 'tb.clock', '1'),
+                (5, 'tb.dut.clk', '1'),
+            ]
+        )
+
+    def testWindow(self):
+        # The value at the start of the window is the initial value
+        self.assertEqual(
+            self.vcd.get_values('tb.data', start=25, end=45),
+            ([25, 30, 40], ['10', '11', '100'])
+        )
+        self.assertEqual(
+            self.vcd.get_values('tb.level', start=25, end=85),
+            ([25, 40, 80], [0.0, 2.0, 4.0])
+        )
+        # Changes at the start time replace the initial value
+        self.assertEqual(
+            self.vcd.get_values('tb.data', start=30, end=50),
+            ([30, 40, 50], ['11', '100', '101'])
+        )
+        self.assertEqual(
+            self.vcd.get_values('tb.data', start=0, end=0),
+            ([0], ['x'])
+        )
+        # Without initial values only the changes in the window are read
+        self.assertEqual(
+            list(self.vcd.changes(['tb.data'], start=25, end=45)),
+            [(30, 'tb.data', '11'), (40, 'tb.data', '100')]
+        )
+        # A window after the last change holds the final values
+        self.assertEqual(
+            self.vcd.get_values('tb.data', start=10 * self.steps),
+            ([10 * self.steps], ['{0:b}'.format(self.steps - 1)])
+        )
+
+    def testStates(self):
+        states = [
+            (time, dict(values)) for time, values in self.vcd.states(
+                ['tb.clock', 'tb.data'],
+                start=30,
+                end=40
+            )
+        ]
+        self.assertEqual(states, [
+            (30, {'tb.clock': '0', 'tb.data': '11'}),
+            (35, {'tb.clock': '1', 'tb.data': '11'}),
+            (40, {'tb.clock': '0', 'tb.data': '100'}),
+        ])
+
+    def testSearch(self):
+        # Search the file in small regions to exercise the binary search of
+        # the window start and the backwards search of the initial values.
+        search_size = vcd.SEARCH_SIZE
+        vcd.SEARCH_SIZE = 16
+        try:
+            for start in [0, 25, 30, 1000, 1234, 10 * self.steps - 5]:
+                cycle = start // 10
+                self.assertEqual(
+                    self.vcd.get_values('tb.data', start=start, end=start),
+                    ([start], ['{0:b}'.format(cycle) if cycle else 'x'])
+                )
+                self.assertEqual(
+                    self.vcd.get_values('tb.level', start=start)[1][0],
+                    (cycle - cycle % 4) * 0.5
+                )
+        finally:
+            vcd.SEARCH_SIZE = search_size
+
+    @unittest.skipIf(vcd.numpy is None, 'NumPy is not installed')
+    def testArrays(self):
+        times, values = self.vcd.get_arrays('tb.data', end=20)
+        self.assertEqual(times.tolist(), [0, 10, 20])
+        self.assertEqual(values.mask.tolist(), [True, False, False])
+        self.assertEqual(values.compressed().tolist(), [1, 2])
+        times, values = self.vcd.get_arrays('tb.level', start=45, end=85)
+        self.assertEqual(times.tolist(), [45, 80])
+        self.assertEqual(values.tolist(), [2.0, 4.0])
+
+
 if __name__ == '__main__':
     unittest.main()